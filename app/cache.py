@@ -0,0 +1,206 @@
+"""
+Caché read-through de las respuestas de pacientes (GET del paciente y GET de cada arreglo).
+
+Las entradas se agrupan por patient_id y dentro por "vista": "patient" para el paciente
+completo o el nombre del arreglo ("meals", "vital_signs", ...). Las escrituras de
+app/db/queries.py invalidan solo las vistas que cambian.
+
+El backend se elige con PATIENT_CACHE:
+    memory (por defecto)   LRU + TTL en el proceso
+    redis                  compartido entre workers, requiere el paquete `redis` y REDIS_URL
+    none                   sin caché
+    paquete.modulo:Clase   cualquier subclase de PatientCache
+
+Para evitar guardar un valor viejo cuando una escritura llega mientras se está leyendo de
+MongoDB, token() devuelve una marca de versión del paciente que cambia al invalidar; set()
+descarta el valor si la marca cambió desde que empezó la lectura.
+"""
+import importlib
+import os
+import time
+from collections import OrderedDict
+import bson
+from prometheus_client import Counter
+
+CACHE_HITS = Counter("patient_cache_hits_total", "Aciertos del caché de pacientes", ["view"])
+CACHE_MISSES = Counter("patient_cache_misses_total", "Fallos del caché de pacientes", ["view"])
+CACHE_EVICTIONS = Counter("patient_cache_evictions_total", "Pacientes expulsados del caché por tamaño")
+CACHE_INVALIDATIONS = Counter("patient_cache_invalidations_total", "Vistas invalidadas por escrituras", ["view"])
+
+
+class PatientCache:
+    """Interfaz de los backends de caché. Todas las operaciones son por paciente y vista."""
+
+    async def get(self, patient_id: str, view: str):
+        raise NotImplementedError
+
+    async def set(self, patient_id: str, view: str, value, token):
+        raise NotImplementedError
+
+    async def token(self, patient_id: str):
+        raise NotImplementedError
+
+    async def invalidate(self, patient_id: str, views):
+        raise NotImplementedError
+
+
+class NullCache(PatientCache):
+    async def get(self, patient_id, view):
+        return None
+
+    async def set(self, patient_id, view, value, token):
+        pass
+
+    async def token(self, patient_id):
+        return None
+
+    async def invalidate(self, patient_id, views):
+        pass
+
+
+class MemoryCache(PatientCache):
+    """LRU por paciente con TTL por vista, dentro del proceso."""
+
+    def __init__(self, max_patients: int = 1000, ttl: float = 30.0):
+        self.max_patients = max_patients
+        self.ttl = ttl
+        self._entries = OrderedDict()  # patient_id -> {"gen": int, "views": {view: (expira, valor)}}
+        # Escrituras de pacientes que no están en caché, para que las lecturas en curso de esos
+        # pacientes no guarden un valor viejo sin ocupar el LRU con entradas vacías:
+        # patient_id -> valor de `_clock` al invalidar. Se guardan las últimas `max_patients`;
+        # `_floor` recuerda la más reciente de las descartadas y rechaza las lecturas anteriores.
+        self._clock = 0
+        self._invalidated = OrderedDict()
+        self._floor = 0
+
+    async def get(self, patient_id, view):
+        entry = self._entries.get(patient_id)
+        if entry is None or view not in entry["views"]:
+            return None
+        expira, value = entry["views"][view]
+        if expira < time.monotonic():
+            del entry["views"][view]
+            return None
+        self._entries.move_to_end(patient_id)
+        return value
+
+    async def set(self, patient_id, view, value, token):
+        entry = self._entries.get(patient_id)
+        if entry is None:
+            ultima = max(self._floor, self._invalidated.get(patient_id, 0))
+            if token[0] != "clock" or token[1] < ultima:
+                return
+            entry = self._entries[patient_id] = {"gen": 0, "views": {}}
+            while len(self._entries) > self.max_patients:
+                self._entries.popitem(last=False)
+                CACHE_EVICTIONS.inc()
+        elif token != ("gen", entry["gen"]):
+            return
+        else:
+            self._entries.move_to_end(patient_id)
+        entry["views"][view] = (time.monotonic() + self.ttl, value)
+
+    async def token(self, patient_id):
+        entry = self._entries.get(patient_id)
+        return ("gen", entry["gen"]) if entry else ("clock", self._clock)
+
+    async def invalidate(self, patient_id, views):
+        entry = self._entries.get(patient_id)
+        if entry is None:
+            self._clock += 1
+            self._invalidated[patient_id] = self._clock
+            self._invalidated.move_to_end(patient_id)
+            while len(self._invalidated) > self.max_patients:
+                _, reloj = self._invalidated.popitem(last=False)
+                self._floor = max(self._floor, reloj)
+            return
+        entry["gen"] += 1
+        for view in views:
+            entry["views"].pop(view, None)
+
+
+class RedisCache(PatientCache):
+    """
+    Caché compartido entre workers: un hash `patient_cache:<id>` por paciente con una
+    vista por campo (codificada en BSON, que admite los bytes de las respuestas ya
+    serializadas) y la generación en el campo `_gen`.
+    """
+
+    def __init__(self, url: str, ttl: float = 30.0):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("PATIENT_CACHE=redis requiere instalar el paquete `redis`") from e
+        self.redis = redis.from_url(url)
+        self.ttl = int(ttl)
+
+    @staticmethod
+    def _key(patient_id):
+        return f"patient_cache:{patient_id}"
+
+    async def get(self, patient_id, view):
+        raw = await self.redis.hget(self._key(patient_id), view)
+        return bson.decode(raw)["value"] if raw is not None else None
+
+    async def set(self, patient_id, view, value, token):
+        key = self._key(patient_id)
+        if int(await self.redis.hget(key, "_gen") or 0) != token:
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, view, bson.encode({"value": value}))
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def token(self, patient_id):
+        return int(await self.redis.hget(self._key(patient_id), "_gen") or 0)
+
+    async def invalidate(self, patient_id, views):
+        key = self._key(patient_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hincrby(key, "_gen", 1)
+            pipe.hdel(key, *views)
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+
+def create_cache() -> PatientCache:
+    backend = os.getenv("PATIENT_CACHE", "memory")
+    ttl = float(os.getenv("PATIENT_CACHE_TTL", "30"))
+
+    if backend == "none":
+        return NullCache()
+    if backend == "memory":
+        return MemoryCache(max_patients=int(os.getenv("PATIENT_CACHE_SIZE", "1000")), ttl=ttl)
+    if backend == "redis":
+        return RedisCache(os.getenv("REDIS_URL", "redis://localhost:6379/0"), ttl=ttl)
+
+    module_name, _, class_name = backend.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+patient_cache = create_cache()
+
+
+async def cached(patient_id: str, view: str, loader, fresh=None):
+    """
+    Devuelve la vista del caché o la calcula con `loader()` (corrutina) y la guarda.
+    `fresh(valor)` permite descartar un valor cacheado que ya no sirve (cuenta como fallo).
+    """
+    value = await patient_cache.get(patient_id, view)
+    if value is not None and (fresh is None or fresh(value)):
+        CACHE_HITS.labels(view=view).inc()
+        return value
+
+    CACHE_MISSES.labels(view=view).inc()
+    token = await patient_cache.token(patient_id)
+    value = await loader()
+    await patient_cache.set(patient_id, view, value, token)
+    return value
+
+
+async def invalidate(patient_id, views):
+    """Invalida las vistas de un paciente después de una escritura."""
+    views = list(views)
+    for view in views:
+        CACHE_INVALIDATIONS.labels(view=view).inc()
+    await patient_cache.invalidate(str(patient_id), views)
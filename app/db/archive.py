@@ -0,0 +1,398 @@
+"""
+Archivo en frío de las actividades viejas de los pacientes (modo embebido).
+
+Casi todas las lecturas piden las últimas semanas, pero los arreglos embebidos guardaban
+todas las entradas para siempre dentro del documento del paciente, que se lee en cada
+petición. Este trabajo mueve las entradas con más de ARCHIVE_AFTER_DAYS días a la colección
+`activity_archive`, en bloques de hasta ARCHIVE_CHUNK_SIZE entradas comprimidas:
+
+    {"patient_id": ObjectId, "type": "meals", "start": datetime, "end": datetime, "count": 500,
+     "ids": [ObjectId, ...], "data": Binary(zlib(BSON {"entries": [...]}))}
+
+El paciente guarda en `archived_before` la fecha de corte más reciente: todo lo archivado es
+anterior a esa fecha. Las lecturas de app/db/queries.py solo abren los bloques cuando el rango
+pedido llega a antes de `archived_before` y, en las páginas, solo si la parte caliente no
+alcanzó a llenar la página con entradas posteriores al corte.
+
+El trabajo procesa los pacientes por _id en lotes de ARCHIVE_BATCH_SIZE y guarda el avance en
+`job_checkpoint`, así que si se corta se retoma desde el último lote con el mismo corte. Cada
+paciente es idempotente: las copias que dejó una ejecución cortada se reemplazan por las
+entradas actuales y el $pull quita del arreglo caliente solo los elementos idénticos a los
+archivados, así que reprocesar un paciente o un PUT concurrente no duplica ni pierde
+entradas. Un PUT sobre una entrada archivada reescribe su bloque (ver set_entry).
+
+En modo buckets no hace falta: las actividades ya viven fuera del documento del paciente.
+
+Uso (por ejemplo desde un cron nocturno):
+    python -m app.db.archive [--days 180] [--batch-size 100] [--restart]
+"""
+import argparse
+import asyncio
+import heapq
+import os
+import zlib
+from datetime import datetime, timedelta, timezone
+import bson
+from bson import Binary, ObjectId
+from pymongo import ASCENDING, DESCENDING
+from app.db.client import db_client
+from app.db.models.activity import ACTIVITY_FIELDS, DATETIME_FIELDS
+from app.db import buckets, summary
+from app.db.indexes import ensure_indexes
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "100"))
+ARCHIVE_CHUNK_SIZE = int(os.getenv("ARCHIVE_CHUNK_SIZE", "500"))
+
+CHECKPOINT_ID = "activity_archive"
+
+
+def archive_collection():
+    return db_client.conectacare.activity_archive
+
+
+def checkpoint_collection():
+    return db_client.conectacare.job_checkpoint
+
+
+def encode_entries(entries: list) -> Binary:
+    return Binary(zlib.compress(bson.encode({"entries": entries}), 6))
+
+
+def decode_entries(chunk: dict) -> list:
+    return bson.decode(zlib.decompress(chunk["data"]))["entries"]
+
+
+def _key(field: str, entry: dict) -> tuple:
+    return entry[DATETIME_FIELDS[field]], entry["id"]
+
+
+def build_chunks(patient_id: ObjectId, field: str, entries: list) -> list:
+    """Bloques comprimidos de `entries`, en orden cronológico."""
+    entries = sorted(entries, key=lambda entry: _key(field, entry))
+    chunks = []
+    for i in range(0, len(entries), ARCHIVE_CHUNK_SIZE):
+        chunk = entries[i:i + ARCHIVE_CHUNK_SIZE]
+        chunks.append({
+            "patient_id": patient_id,
+            "type": field,
+            "start": chunk[0][DATETIME_FIELDS[field]],
+            "end": chunk[-1][DATETIME_FIELDS[field]],
+            "count": len(chunk),
+            "ids": [entry["id"] for entry in chunk],
+            "data": encode_entries(chunk),
+        })
+    return chunks
+
+
+def reaches_archive(archived_before, date_from=None) -> bool:
+    """True si un rango que empieza en `date_from` (None = sin límite) puede incluir entradas archivadas."""
+    return archived_before is not None and (date_from is None or buckets.utc_naive(date_from) < archived_before)
+
+
+async def find_entries(patient_id: ObjectId, field: str, date_from=None, date_to=None, limit=None, after=None) -> list:
+    """
+    Entradas archivadas de `field`, de la más reciente a la más antigua, con la misma semántica
+    que queries.find_activity_page. Los bloques se abren del más reciente al más antiguo y se
+    deja de leer cuando los que quedan ya no pueden entrar en la página.
+    """
+    fecha = DATETIME_FIELDS[field]
+    # Las fechas de los bloques y entradas vienen de MongoDB sin zona; las del rango, de la API o del cursor
+    date_from, date_to = buckets.utc_naive(date_from), buckets.utc_naive(date_to)
+    if after is not None:
+        after = (buckets.utc_naive(after[0]), after[1])
+
+    query = {"patient_id": patient_id, "type": field}
+    if date_from is not None:
+        query["end"] = {"$gte": date_from}
+    if date_to is not None:
+        query.setdefault("start", {})["$lt"] = date_to
+    if after is not None:
+        query.setdefault("start", {})["$lte"] = after[0]
+
+    def en_rango(entry):
+        if date_from is not None and entry[fecha] < date_from:
+            return False
+        if date_to is not None and entry[fecha] >= date_to:
+            return False
+        return after is None or _key(field, entry) < after
+
+    encontradas = []
+    async for chunk in archive_collection().find(query).sort("end", DESCENDING):
+        if limit is not None and len(encontradas) >= limit:
+            encontradas = heapq.nlargest(limit, encontradas, key=lambda entry: _key(field, entry))
+            if chunk["end"] < encontradas[-1][fecha]:
+                break
+        encontradas.extend(entry for entry in decode_entries(chunk) if en_rango(entry))
+
+    encontradas.sort(key=lambda entry: _key(field, entry), reverse=True)
+    return encontradas[:limit] if limit is not None else encontradas
+
+
+async def load_entries(patient_id: ObjectId, fields=ACTIVITY_FIELDS) -> dict:
+    """{campo: entradas archivadas en orden cronológico} de los tipos en `fields`."""
+    return (await load_entries_many([patient_id], fields)).get(patient_id, {field: [] for field in fields})
+
+
+async def load_entries_many(patient_ids: list, fields=ACTIVITY_FIELDS) -> dict:
+    """{patient_id: {campo: entradas archivadas en orden cronológico}} de varios pacientes con una sola consulta."""
+    arrays = {}
+    query = {"patient_id": {"$in": list(patient_ids)}, "type": {"$in": list(fields)}}
+    async for chunk in archive_collection().find(query).sort([("patient_id", ASCENDING), ("start", ASCENDING)]):
+        por_tipo = arrays.setdefault(chunk["patient_id"], {field: [] for field in fields})
+        por_tipo[chunk["type"]].extend(decode_entries(chunk))
+    for por_tipo in arrays.values():
+        for field, entries in por_tipo.items():
+            entries.sort(key=lambda entry: _key(field, entry))
+    return arrays
+
+
+def merge_newest_first(field: str, hot: list, cold: list, limit=None) -> list:
+    """Une dos listas ya ordenadas de la más reciente a la más antigua; si un id está en ambas gana la caliente."""
+    calientes = {entry["id"] for entry in hot}
+    merged = heapq.merge(hot, (entry for entry in cold if entry["id"] not in calientes),
+                         key=lambda entry: _key(field, entry), reverse=True)
+    return list(merged)[:limit] if limit is not None else list(merged)
+
+
+def merge_entries(patient: dict, cold_by_field: dict) -> dict:
+    """Completa los arreglos del paciente con entradas archivadas ya leídas ({campo: entradas})."""
+    for field, cold in cold_by_field.items():
+        hot = patient.get(field) or []
+        calientes = {entry["id"] for entry in hot}
+        patient[field] = sorted([entry for entry in cold if entry["id"] not in calientes] + hot, key=lambda entry: _key(field, entry))
+    return patient
+
+
+async def merge_archived(patient: dict, fields=ACTIVITY_FIELDS) -> dict:
+    """Completa los arreglos `fields` del paciente con sus entradas archivadas, si tiene."""
+    if patient.get("archived_before") is None:
+        return patient
+    return merge_entries(patient, await load_entries(patient["_id"], fields))
+
+
+async def complete_page(patient_id: ObjectId, field: str, hot: list, archived_before, date_from=None, date_to=None, limit=None, after=None) -> list:
+    """
+    Completa una página de entradas calientes (de la más reciente a la más antigua) con las
+    archivadas, solo si el rango llega a antes del corte y la página no quedó ya llena con
+    entradas posteriores al corte.
+    """
+    if not reaches_archive(archived_before, date_from):
+        return hot
+    if limit is not None and len(hot) >= limit and hot[limit - 1][DATETIME_FIELDS[field]] >= archived_before:
+        return hot
+    cold = await find_entries(patient_id, field, date_from, date_to, limit, after)
+    return merge_newest_first(field, hot, cold, limit)
+
+
+async def iter_rows(field: str, date_from=None, date_to=None):
+    """Filas {patient_id, ...entrada} archivadas de `field` de todos los pacientes (para la exportación)."""
+    fecha = DATETIME_FIELDS[field]
+    date_from, date_to = buckets.utc_naive(date_from), buckets.utc_naive(date_to)
+    query = {"type": field}
+    if date_from is not None:
+        query["end"] = {"$gte": date_from}
+    if date_to is not None:
+        query["start"] = {"$lt": date_to}
+    async for chunk in archive_collection().find(query).sort([("patient_id", ASCENDING), ("start", ASCENDING)]):
+        for entry in decode_entries(chunk):
+            if (date_from is None or entry[fecha] >= date_from) and (date_to is None or entry[fecha] < date_to):
+                yield {"patient_id": chunk["patient_id"], **entry}
+
+
+async def drop_archived(patient_id: ObjectId, ids) -> None:
+    """Quita del archivo las entradas `ids` del paciente, reescribiendo (o borrando) los bloques que las tienen."""
+    ids = set(ids)
+    async for chunk in archive_collection().find({"patient_id": patient_id, "ids": {"$in": list(ids)}}):
+        quedan = [entry for entry in decode_entries(chunk) if entry["id"] not in ids]
+        if not quedan:
+            await archive_collection().delete_one({"_id": chunk["_id"]})
+            continue
+        fecha = DATETIME_FIELDS[chunk["type"]]
+        await archive_collection().update_one({"_id": chunk["_id"]}, {"$set": {
+            "start": quedan[0][fecha],
+            "end": quedan[-1][fecha],
+            "count": len(quedan),
+            "ids": [entry["id"] for entry in quedan],
+            "data": encode_entries(quedan),
+        }})
+
+
+async def set_entry(patient_id: ObjectId, field: str, entry_id: ObjectId, entry: dict, intentos: int = 3):
+    """
+    PUT sobre una entrada archivada: descomprime su bloque, reemplaza los campos de `entry` y lo
+    vuelve a escribir, e incrementa la revisión del paciente. Devuelve la entrada anterior, o
+    None si `entry_id` no está archivada.
+
+    El bloque se reescribe solo si nadie lo cambió desde la lectura (se compara `data`); si
+    otro PUT o el trabajo de archivo ganó, se reintenta. Si la nueva fecha ya no es anterior a
+    `archived_before`, la entrada vuelve al arreglo caliente (primero se agrega ahí y después se
+    quita del archivo: mientras tanto las lecturas ven la copia caliente).
+    """
+    fecha = DATETIME_FIELDS[field]
+    patients = db_client.conectacare.patient
+    for _ in range(intentos):
+        chunk = await archive_collection().find_one({"patient_id": patient_id, "type": field, "ids": entry_id})
+        if chunk is None:
+            return None
+        entries = decode_entries(chunk)
+        anterior = next(e for e in entries if e["id"] == entry_id)
+        nueva = {**anterior, **entry}
+        nueva[fecha] = buckets.utc_naive(nueva[fecha])
+
+        patient = await patients.find_one({"_id": patient_id}, {"archived_before": 1})
+        if patient is None:
+            return None
+        revision = {"revision": {"$add": [{"$ifNull": ["$revision", 0]}, 1]}}
+
+        if nueva[fecha] >= patient["archived_before"]:
+            ordenado = {"$sortArray": {
+                "input": {"$concatArrays": [{"$ifNull": [f"${field}", []]}, {"$literal": [nueva]}]},
+                "sortBy": {fecha: 1, "id": 1},
+            }}
+            pipeline = [{"$set": {field: ordenado, **revision}}]
+            if field in summary.SUMMARY_SOURCES:
+                pipeline.append({"$set": summary.recompute_stage(field)})
+            await patients.update_one({"_id": patient_id, f"{field}.id": {"$ne": entry_id}}, pipeline)
+            await drop_archived(patient_id, [entry_id])
+            return anterior
+
+        entries = sorted([nueva if e["id"] == entry_id else e for e in entries], key=lambda e: _key(field, e))
+        result = await archive_collection().update_one({"_id": chunk["_id"], "data": chunk["data"]}, {"$set": {
+            "start": entries[0][fecha],
+            "end": entries[-1][fecha],
+            "ids": [e["id"] for e in entries],
+            "data": encode_entries(entries),
+        }})
+        if result.modified_count == 1:
+            await patients.update_one({"_id": patient_id}, [{"$set": {**revision, **summary.replace_stage(field, nueva)}}])
+            return anterior
+    return None
+
+
+async def archive_patient(patient: dict, cutoff: datetime, intentos: int = 3) -> int:
+    """
+    Archiva las entradas anteriores a `cutoff` de un paciente (el documento trae solo esas
+    entradas). Devuelve cuántas quitó del documento.
+
+    El $pull quita solo los elementos idénticos a los archivados: si un PUT modificó una
+    entrada entre la lectura y el $pull, esa entrada queda en el documento, su copia vieja se
+    saca del archivo y, si sigue siendo anterior al corte, se vuelve a archivar.
+    """
+    patient_id = patient["_id"]
+    movidas = {field: patient.get(field) or [] for field in ACTIVITY_FIELDS}
+    movidas = {field: entries for field, entries in movidas.items() if entries}
+    if not movidas:
+        return 0
+
+    # Si una ejecución anterior se cortó después de insertar, esas copias pueden estar viejas:
+    # se reemplazan por las entradas actuales
+    candidatas = [entry["id"] for entries in movidas.values() for entry in entries]
+    await drop_archived(patient_id, candidatas)
+
+    chunks = []
+    for field, entries in movidas.items():
+        chunks += build_chunks(patient_id, field, entries)
+    await archive_collection().insert_many(chunks)
+
+    await db_client.conectacare.patient.update_one(
+        {"_id": patient_id},
+        {
+            "$pull": {field: {"$in": entries} for field, entries in movidas.items()},
+            "$max": {"archived_before": cutoff},
+            "$inc": {"revision": 1},
+        },
+    )
+
+    # Entradas que cambiaron antes del $pull y siguen en el documento
+    cursor = await db_client.conectacare.patient.aggregate([
+        {"$match": {"_id": patient_id}},
+        {"$project": {field: {"$filter": {
+            "input": {"$ifNull": [f"${field}", []]},
+            "as": "e",
+            "cond": {"$in": ["$$e.id", [entry["id"] for entry in entries]]},
+        }} for field, entries in movidas.items()}},
+    ])
+    restantes = next(iter(await cursor.to_list(1)), {})
+    sin_mover = [entry["id"] for field in movidas for entry in restantes.get(field, [])]
+    if not sin_mover:
+        return len(candidatas)
+
+    await drop_archived(patient_id, sin_mover)
+    pendientes = {"_id": patient_id}
+    for field in movidas:
+        pendientes[field] = [entry for entry in restantes.get(field, []) if entry[DATETIME_FIELDS[field]] < cutoff]
+    archivadas = len(candidatas) - len(sin_mover)
+    if intentos > 1:
+        archivadas += await archive_patient(pendientes, cutoff, intentos - 1)
+    return archivadas
+
+
+def pending_pipeline(cutoff: datetime, after=None, limit: int = ARCHIVE_BATCH_SIZE) -> list:
+    """Siguiente lote de pacientes con entradas anteriores a `cutoff`, cada uno solo con esas entradas."""
+    match = {"$or": [{f"{field}.{DATETIME_FIELDS[field]}": {"$lt": cutoff}} for field in ACTIVITY_FIELDS]}
+    if after is not None:
+        match["_id"] = {"$gt": after}
+    return [
+        {"$match": match},
+        {"$sort": {"_id": 1}},
+        {"$limit": limit},
+        {"$project": {
+            field: {"$filter": {
+                "input": {"$ifNull": [f"${field}", []]},
+                "as": "e",
+                "cond": {"$lt": [f"$$e.{DATETIME_FIELDS[field]}", cutoff]},
+            }}
+            for field in ACTIVITY_FIELDS
+        }},
+    ]
+
+
+async def run(days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE, restart: bool = False) -> dict:
+    """Archiva todo lo anterior al corte, retomando el avance guardado si hay una ejecución a medias."""
+    if buckets.BUCKETS_ENABLED:
+        print("ACTIVITY_STORAGE=buckets: las actividades ya están fuera del documento del paciente, no hay nada que archivar")
+        return {"pacientes": 0, "entradas": 0}
+
+    checkpoints = checkpoint_collection()
+    if restart:
+        await checkpoints.delete_one({"_id": CHECKPOINT_ID})
+
+    checkpoint = await checkpoints.find_one({"_id": CHECKPOINT_ID})
+    if checkpoint is None:
+        # El corte se fija al empezar y se guarda, así una ejecución retomada usa el mismo
+        cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=days)
+        checkpoint = {"_id": CHECKPOINT_ID, "cutoff": cutoff, "last_patient_id": None, "patients": 0, "entries": 0}
+        await checkpoints.insert_one(checkpoint)
+    else:
+        print(f"Retomando el archivo con corte {checkpoint['cutoff']:%Y-%m-%d} después de {checkpoint['last_patient_id']}")
+
+    await ensure_indexes(["activity_archive"])
+
+    while True:
+        cursor = await db_client.conectacare.patient.aggregate(
+            pending_pipeline(checkpoint["cutoff"], checkpoint["last_patient_id"], batch_size)
+        )
+        lote = await cursor.to_list()
+        if not lote:
+            break
+        for patient in lote:
+            checkpoint["entries"] += await archive_patient(patient, checkpoint["cutoff"])
+        checkpoint["patients"] += len(lote)
+        checkpoint["last_patient_id"] = lote[-1]["_id"]
+        await checkpoints.replace_one({"_id": CHECKPOINT_ID}, checkpoint)
+        print(f"  {checkpoint['patients']} pacientes, {checkpoint['entries']} entradas archivadas")
+
+    await checkpoints.delete_one({"_id": CHECKPOINT_ID})
+    return {"pacientes": checkpoint["patients"], "entradas": checkpoint["entries"]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mueve las actividades viejas de los pacientes a activity_archive")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="Antigüedad a partir de la cual se archiva")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE, help="Pacientes por lote entre checkpoints")
+    parser.add_argument("--restart", action="store_true", help="Descarta el avance guardado y empieza de nuevo")
+    args = parser.parse_args()
+
+    resultado = asyncio.run(run(args.days, args.batch_size, args.restart))
+    print(f"Archivadas {resultado['entradas']} entradas de {resultado['pacientes']} pacientes")
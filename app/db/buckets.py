@@ -0,0 +1,245 @@
+import os
+from datetime import datetime, timezone
+from collections import defaultdict
+from pymongo import ASCENDING, UpdateOne
+from bson import ObjectId
+from app.db.client import db_client
+from app.db.models.activity import ACTIVITY_FIELDS, DATETIME_FIELDS
+
+# Almacenamiento de actividades en "buckets": en lugar de embeber los seis arreglos en el
+# documento del paciente, cada entrada se guarda en un documento por paciente, tipo y día
+# con un máximo de ACTIVITY_BUCKET_SIZE entradas. Así el documento del paciente no crece y
+# cada escritura toca un documento de tamaño acotado, sin importar el historial del paciente.
+#
+# Se activa con ACTIVITY_STORAGE=buckets. Antes de activarlo hay que mover los arreglos
+# existentes con `python -m app.db.migrate_buckets`.
+#
+# No se usa una colección time-series de MongoDB porque los PUT necesitan actualizar
+# entradas individuales por id, y esas colecciones solo admiten updates muy limitados.
+#
+# Forma de un bucket:
+#   {"patient_id": ObjectId, "type": "meals", "day": datetime(2025, 6, 8), "count": 3, "entries": [...]}
+
+BUCKETS_ENABLED = os.getenv("ACTIVITY_STORAGE", "embedded") == "buckets"
+BUCKET_SIZE = int(os.getenv("ACTIVITY_BUCKET_SIZE", "200"))
+
+
+def bucket_collection():
+    return db_client.conectacare.activity_bucket
+
+
+def utc_naive(value):
+    """
+    Fecha en UTC sin tzinfo, como las devuelve MongoDB. Las que llegan de la API (`...Z`) o de
+    un cursor pueden traerla, y Python no compara fechas con y sin zona. None queda igual.
+    """
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def bucket_day(value: datetime) -> datetime:
+    """Día (medianoche UTC, sin tzinfo como lo devuelve MongoDB) al que pertenece una fecha."""
+    value = utc_naive(value)
+    return datetime(value.year, value.month, value.day)
+
+
+async def push_entry(patient_id: ObjectId, field: str, entry: dict) -> bool:
+    """Agrega una entrada al bucket del día que corresponde; crea un bucket nuevo si el actual está lleno."""
+    day = bucket_day(entry[DATETIME_FIELDS[field]])
+    result = await bucket_collection().update_one(
+        {"patient_id": patient_id, "type": field, "day": day, "count": {"$lt": BUCKET_SIZE}},
+        {"$push": {"entries": entry}, "$inc": {"count": 1}},
+        upsert=True,
+    )
+    return result.modified_count == 1 or result.upserted_id is not None
+
+
+def bucket_updates(patient_id: ObjectId, field: str, entries: list) -> list:
+    """
+    Operaciones para agregar varias entradas de un tipo con un $push/$each por día.
+    Un bucket puede pasarse del tope por el tamaño del lote; el tope es orientativo.
+    """
+    por_dia = defaultdict(list)
+    for entry in entries:
+        por_dia[bucket_day(entry[DATETIME_FIELDS[field]])].append(entry)
+
+    return [
+        UpdateOne(
+            {"patient_id": patient_id, "type": field, "day": day, "count": {"$lt": BUCKET_SIZE}},
+            {"$push": {"entries": {"$each": day_entries}}, "$inc": {"count": len(day_entries)}},
+            upsert=True,
+        )
+        for day, day_entries in por_dia.items()
+    ]
+
+
+async def push_entries(patient_id: ObjectId, entries_by_field: dict) -> None:
+    """Agrega entradas de varios tipos en un solo bulk_write."""
+    ops = [op for field, entries in entries_by_field.items() for op in bucket_updates(patient_id, field, entries)]
+    if ops:
+        await bucket_collection().bulk_write(ops)
+
+
+async def set_entry(patient_id: ObjectId, field: str, entry_id: ObjectId, entry: dict) -> bool:
+    """Reemplaza una entrada por id. Si cambió de día se mueve al bucket correspondiente."""
+    result = await bucket_collection().update_one(
+        {"patient_id": patient_id, "type": field, "day": bucket_day(entry[DATETIME_FIELDS[field]]), "entries.id": entry_id},
+        {"$set": {f"entries.$.{key}": value for key, value in entry.items()}},
+    )
+    if result.matched_count == 1:
+        return True
+
+    pulled = await bucket_collection().update_one(
+        {"patient_id": patient_id, "type": field, "entries.id": entry_id},
+        {"$pull": {"entries": {"id": entry_id}}, "$inc": {"count": -1}},
+    )
+    if pulled.modified_count != 1:
+        return False
+
+    return await push_entry(patient_id, field, entry)
+
+
+async def find_entry(patient_id: ObjectId, field: str, entry_id: ObjectId):
+    """Entrada `entry_id` de un tipo, o None si no existe."""
+    bucket = await bucket_collection().find_one(
+        {"patient_id": patient_id, "type": field, "entries.id": entry_id},
+        {"entries": {"$elemMatch": {"id": entry_id}}},
+    )
+    return bucket["entries"][0] if bucket else None
+
+
+async def find_entries(patient_id: ObjectId, field: str, date_from=None, date_to=None, limit=None, after=None) -> list:
+    """
+    Entradas de un tipo, de la más reciente a la más antigua, con la misma semántica que
+    queries.find_activity_page: `date_from` inclusivo, `date_to` exclusivo y `after` = (fecha, id).
+    Solo se leen los buckets de los días dentro del rango.
+    """
+    fecha = DATETIME_FIELDS[field]
+
+    buckets_match = {"patient_id": patient_id, "type": field}
+    dias = {}
+    if date_from is not None:
+        dias["$gte"] = bucket_day(date_from)
+    if date_to is not None:
+        dias["$lt"] = date_to
+    if after is not None:
+        dias["$lte"] = bucket_day(after[0])
+    if dias:
+        buckets_match["day"] = dias
+
+    entries_match = {}
+    if date_from is not None:
+        entries_match.setdefault(fecha, {})["$gte"] = date_from
+    if date_to is not None:
+        entries_match.setdefault(fecha, {})["$lt"] = date_to
+    if after is not None:
+        after_date, after_id = after
+        entries_match["$or"] = [{fecha: {"$lt": after_date}}, {fecha: after_date, "id": {"$lt": after_id}}]
+
+    pipeline = [
+        {"$match": buckets_match},
+        {"$unwind": "$entries"},
+        {"$replaceRoot": {"newRoot": "$entries"}},
+    ]
+    if entries_match:
+        pipeline.append({"$match": entries_match})
+    pipeline.append({"$sort": {fecha: -1, "id": -1}})
+    if limit is not None:
+        pipeline.append({"$limit": limit})
+
+    cursor = await bucket_collection().aggregate(pipeline)
+    return await cursor.to_list()
+
+
+async def find_all_by_type(patient_id: ObjectId) -> dict:
+    """Los seis arreglos de un paciente reconstruidos desde sus buckets (para el GET del paciente completo)."""
+    arrays = {field: [] for field in ACTIVITY_FIELDS}
+    async for bucket in bucket_collection().find({"patient_id": patient_id}, {"type": 1, "entries": 1}).sort("day", ASCENDING):
+        arrays[bucket["type"]].extend(bucket.get("entries", []))
+    return arrays
+
+
+async def find_arrays_many(patient_ids: list, fields) -> dict:
+    """
+    Variante de find_all_by_type para varios pacientes y solo los tipos en `fields`:
+    {patient_id: {campo: [entradas]}} con una sola consulta.
+    """
+    arrays = {patient_id: {field: [] for field in fields} for patient_id in patient_ids}
+    cursor = bucket_collection().find(
+        {"patient_id": {"$in": patient_ids}, "type": {"$in": list(fields)}},
+        {"patient_id": 1, "type": 1, "entries": 1},
+    ).sort([("patient_id", ASCENDING), ("type", ASCENDING), ("day", ASCENDING)])
+    async for bucket in cursor:
+        arrays[bucket["patient_id"]][bucket["type"]].extend(bucket.get("entries", []))
+    return arrays
+
+
+async def latest_entries(patient_ids: list, fields) -> dict:
+    """
+    Última entrada (por fecha) de cada tipo en `fields` para varios pacientes: {(patient_id, campo): entrada}.
+
+    Son dos consultas sin importar cuántos pacientes haya: la primera obtiene el último día con
+    buckets de cada (paciente, tipo) recorriendo el índice patient_type_day, y la segunda
+    desarma solo los buckets de esos días (un día puede ocupar más de un bucket).
+    """
+    if not patient_ids:
+        return {}
+
+    cursor = await bucket_collection().aggregate([
+        {"$match": {"patient_id": {"$in": patient_ids}, "type": {"$in": list(fields)}}},
+        {"$sort": {"patient_id": 1, "type": 1, "day": -1}},
+        {"$group": {"_id": {"patient_id": "$patient_id", "type": "$type"}, "day": {"$first": "$day"}}},
+    ])
+    ultimos = await cursor.to_list()
+    if not ultimos:
+        return {}
+
+    cursor = await bucket_collection().aggregate([
+        {"$match": {"$or": [{"patient_id": u["_id"]["patient_id"], "type": u["_id"]["type"], "day": u["day"]} for u in ultimos]}},
+        {"$unwind": "$entries"},
+        {"$sort": {f"entries.{DATETIME_FIELDS[field]}": -1 for field in fields}},  # el historial médico ordena por `date`
+        {"$group": {"_id": {"patient_id": "$patient_id", "type": "$type"}, "entry": {"$first": "$entries"}}},
+    ])
+    return {(doc["_id"]["patient_id"], doc["_id"]["type"]): doc["entry"] async for doc in cursor}
+
+
+async def find_timeline(patient_id: ObjectId, fields, date_from=None, date_to=None, limit=None, after=None) -> list:
+    """
+    Entradas de varios tipos mezcladas en un solo orden cronológico (más recientes primero), como
+    [(campo, entrada)], con la misma semántica de rango y cursor que find_entries. Es una sola
+    agregación: la fecha de cada entrada se normaliza en `at` (el historial médico usa `date`).
+    """
+    buckets_match = {"patient_id": patient_id, "type": {"$in": list(fields)}}
+    dias = {}
+    if date_from is not None:
+        dias["$gte"] = bucket_day(date_from)
+    if date_to is not None:
+        dias["$lt"] = date_to
+    if after is not None:
+        dias["$lte"] = bucket_day(after[0])
+    if dias:
+        buckets_match["day"] = dias
+
+    entries_match = {}
+    if date_from is not None:
+        entries_match.setdefault("at", {})["$gte"] = date_from
+    if date_to is not None:
+        entries_match.setdefault("at", {})["$lt"] = date_to
+    if after is not None:
+        after_date, after_id = after
+        entries_match["$or"] = [{"at": {"$lt": after_date}}, {"at": after_date, "entry.id": {"$lt": after_id}}]
+
+    pipeline = [
+        {"$match": buckets_match},
+        {"$unwind": "$entries"},
+        {"$project": {"_id": 0, "type": 1, "entry": "$entries", "at": {"$ifNull": ["$entries.datetime", "$entries.date"]}}},
+    ]
+    if entries_match:
+        pipeline.append({"$match": entries_match})
+    pipeline.append({"$sort": {"at": -1, "entry.id": -1}})
+    if limit is not None:
+        pipeline.append({"$limit": limit})
+
+    cursor = await bucket_collection().aggregate(pipeline)
+    return [(doc["type"], doc["entry"]) async for doc in cursor]
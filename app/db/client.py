@@ -1,21 +1,114 @@
+import asyncio
 import os
-from pymongo import MongoClient
+from typing import Optional
+from pymongo import AsyncMongoClient
+from pydantic_settings import BaseSettings, SettingsConfigDict
 from dotenv import load_dotenv
 
 # Cargar variables de entorno desde el archivo .env
 load_dotenv()
 
-# Obtener la URI de conexión desde las variables de entorno
-mongo_uri = os.getenv('MONGO_URI')
 
-# Verificar que la variable de entorno esté configurada
-if not mongo_uri:
-    raise ValueError("No se ha configurado MONGO_URI en las variables de entorno")
+class MongoSettings(BaseSettings):
+    """
+    Configuración del cliente de MongoDB, leída de las variables MONGO_* (o del .env).
 
-# Crear la conexión a MongoDB
-try:
-    db_client = MongoClient(mongo_uri)
-    print("Conexión a MongoDB establecida correctamente")
-except Exception as e:
-    print(f"Error al conectar a MongoDB: {e}")
-    raise
\ No newline at end of file
+    Los documentos de pacientes son grandes y viajan en casi todas las peticiones, así que por
+    defecto se negocia compresión zlib (incluida en Python; zstd o snappy requieren instalar
+    `zstandard` / `python-snappy` y agregarlos a MONGO_COMPRESSORS) y se mantiene un mínimo
+    de conexiones abiertas.
+    """
+    model_config = SettingsConfigDict(env_prefix="MONGO_", env_file=".env", extra="ignore")
+
+    uri: Optional[str] = None
+    max_pool_size: int = 100
+    min_pool_size: int = 10
+    max_idle_time_ms: Optional[int] = None
+    connect_timeout_ms: int = 5000
+    server_selection_timeout_ms: int = 10000
+    socket_timeout_ms: Optional[int] = None
+    wait_queue_timeout_ms: Optional[int] = None
+    read_preference: str = "primary"
+    compressors: str = "zlib"
+    zlib_compression_level: int = 6
+    app_name: str = "conectacare-registro-actividades"
+    readiness_timeout_ms: int = 2000
+
+    def client_options(self) -> dict:
+        options = {
+            "maxPoolSize": self.max_pool_size,
+            "minPoolSize": self.min_pool_size,
+            "maxIdleTimeMS": self.max_idle_time_ms,
+            "connectTimeoutMS": self.connect_timeout_ms,
+            "serverSelectionTimeoutMS": self.server_selection_timeout_ms,
+            "socketTimeoutMS": self.socket_timeout_ms,
+            "waitQueueTimeoutMS": self.wait_queue_timeout_ms,
+            "readPreference": self.read_preference,
+            "compressors": self.compressors,
+            "zlibCompressionLevel": self.zlib_compression_level,
+            "appname": self.app_name,
+        }
+        return {key: value for key, value in options.items() if value is not None}
+
+
+class LazyMongoClient:
+    """
+    Dueño del AsyncMongoClient del proceso.
+
+    La app lo abre en el lifespan (connect) y lo cierra al apagarse (close). Los scripts y CLIs
+    que no pasan por el lifespan lo crean la primera vez que lo usan. Con varios workers
+    (python -m app.serve) el módulo se importa antes de hacer fork; un cliente creado en el
+    proceso padre compartiría sockets y hilos de monitoreo, cosa que PyMongo no soporta, así
+    que si el pid cambió desde que se creó se crea uno nuevo.
+    El resto del código lo usa igual que al cliente: db_client.conectacare.patient...
+    """
+
+    def __init__(self):
+        self.settings = None
+        self._client = None
+        self._pid = None
+
+    def get(self) -> AsyncMongoClient:
+        if self._client is None or self._pid != os.getpid():
+            if self.settings is None:
+                self.settings = MongoSettings()
+            # Verificar que la URI esté configurada (recién al conectar, no al importar el módulo)
+            if not self.settings.uri:
+                raise RuntimeError("No se ha configurado MONGO_URI en las variables de entorno")
+            # Usamos el cliente asíncrono de PyMongo para no bloquear el event loop de uvicorn:
+            # todas las operaciones (find_one, update_one, insert_one...) deben hacerse con await.
+            try:
+                self._client = AsyncMongoClient(self.settings.uri, **self.settings.client_options())
+                self._pid = os.getpid()
+                print(f"Conexión a MongoDB establecida correctamente (pid {self._pid})")
+            except Exception as e:
+                print(f"Error al conectar a MongoDB: {e}")
+                raise
+        return self._client
+
+    async def connect(self, settings: Optional[MongoSettings] = None):
+        """Crea el cliente con `settings` y abre el pool (lo llama el lifespan de la app)."""
+        await self.close()
+        self.settings = settings or MongoSettings()
+        await self.get().aconnect()
+
+    async def ping(self, timeout_ms: Optional[int] = None):
+        """Ping al servidor usando una conexión del pool; lanza una excepción si no responde a tiempo."""
+        timeout = (timeout_ms or (self.settings or MongoSettings()).readiness_timeout_ms) / 1000
+        await asyncio.wait_for(self.get().admin.command("ping"), timeout)
+
+    async def close(self):
+        # Solo cierra el cliente de este proceso; el heredado de un fork se descarta sin tocarlo
+        if self._client is not None and self._pid == os.getpid():
+            await self._client.close()
+        self._client = None
+        self._pid = None
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __getitem__(self, name):
+        return self.get()[name]
+
+
+db_client = LazyMongoClient()
@@ -0,0 +1,125 @@
+"""
+Agrupación de escrituras de actividades (group commit), opcional.
+
+En las rondas de medicación muchas tablets registran entradas del mismo paciente con
+milisegundos de diferencia y cada POST hace su propio $push sobre el mismo documento. Con
+WRITE_COALESCING=true, queries.push_activity no escribe directamente: deja la entrada en un
+lote por paciente que se escribe WRITE_COALESCE_WINDOW_MS después de la primera entrada (o
+antes si llega a WRITE_COALESCE_MAX_BATCH) con un solo queries.push_activities, es decir un
+$push/$each por arreglo.
+
+Cada entrada ya trae su propio id y cada llamador espera el resultado de su lote: True,
+False si el paciente no existe, o la excepción de la escritura. Si hay más de
+WRITE_COALESCE_MAX_PENDING entradas esperando se rechaza la nueva con WriteQueueFull
+(503 en app/main.py) en lugar de acumular memoria sin límite.
+
+Los lotes son por proceso; con varios workers cada uno agrupa las escrituras que recibe.
+"""
+import asyncio
+import os
+import time
+from prometheus_client import Counter, Histogram
+
+COALESCING_ENABLED = os.getenv("WRITE_COALESCING", "false").lower() == "true"
+COALESCE_WINDOW = float(os.getenv("WRITE_COALESCE_WINDOW_MS", "5")) / 1000
+COALESCE_MAX_BATCH = int(os.getenv("WRITE_COALESCE_MAX_BATCH", "100"))
+COALESCE_MAX_PENDING = int(os.getenv("WRITE_COALESCE_MAX_PENDING", "2000"))
+
+BATCH_SIZE = Histogram(
+    "write_coalesce_batch_size", "Entradas escritas por lote agrupado",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+ADDED_LATENCY = Histogram(
+    "write_coalesce_wait_seconds", "Tiempo que una entrada espera en el lote antes de escribirse",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+REJECTED = Counter("write_coalesce_rejected_total", "Entradas rechazadas por tener la cola llena")
+
+
+class WriteQueueFull(Exception):
+    pass
+
+
+class _Batch:
+    def __init__(self):
+        self.items = []  # (campo, entrada, future, instante en que llegó)
+        self.flushed = False
+
+
+class WriteCoalescer:
+    def __init__(self, write, window: float = COALESCE_WINDOW, max_batch: int = COALESCE_MAX_BATCH,
+                 max_pending: int = COALESCE_MAX_PENDING):
+        self._write = write  # corrutina (patient_id, {campo: [entradas]}) -> bool
+        self.window = window
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self._batches = {}
+        self._pending = 0
+        self._tasks = set()
+
+    async def submit(self, patient_id, field: str, entry: dict) -> bool:
+        if self._pending >= self.max_pending:
+            REJECTED.inc()
+            raise WriteQueueFull("Demasiadas escrituras pendientes")
+
+        batch = self._batches.get(patient_id)
+        if batch is None:
+            batch = self._batches[patient_id] = _Batch()
+            self._spawn(self._flush_later(patient_id, batch))
+
+        future = asyncio.get_running_loop().create_future()
+        batch.items.append((field, entry, future, time.perf_counter()))
+        self._pending += 1
+
+        if len(batch.items) >= self.max_batch:
+            # Se saca del mapa ya, no cuando corra la tarea: las entradas siguientes abren otro lote
+            self._close(patient_id, batch)
+            self._spawn(self._flush(patient_id, batch))
+
+        return await future
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_later(self, patient_id, batch: _Batch):
+        await asyncio.sleep(self.window)
+        await self._flush(patient_id, batch)
+
+    def _close(self, patient_id, batch: _Batch):
+        if self._batches.get(patient_id) is batch:
+            del self._batches[patient_id]
+
+    async def _flush(self, patient_id, batch: _Batch):
+        if batch.flushed:
+            return
+        batch.flushed = True
+        self._close(patient_id, batch)
+
+        ahora = time.perf_counter()
+        entries_by_field = {}
+        for field, entry, _, llegada in batch.items:
+            entries_by_field.setdefault(field, []).append(entry)
+            ADDED_LATENCY.observe(ahora - llegada)
+        BATCH_SIZE.observe(len(batch.items))
+
+        try:
+            result = await self._write(patient_id, entries_by_field)
+        except Exception as e:
+            for _, _, future, _ in batch.items:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for _, _, future, _ in batch.items:
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._pending -= len(batch.items)
+
+    async def close(self):
+        """Escribe los lotes pendientes sin esperar la ventana (al apagar la app)."""
+        for patient_id, batch in list(self._batches.items()):
+            await self._flush(patient_id, batch)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
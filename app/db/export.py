@@ -0,0 +1,234 @@
+"""
+Exportación de actividades de todos los pacientes en NDJSON o CSV, en streaming.
+
+Recorre un cursor del servidor que desarma los arreglos con $unwind (o los buckets en
+modo ACTIVITY_STORAGE=buckets) y trae los documentos en lotes de `batch_size`; cada fila se
+serializa y se entrega en bloques de ~64 KB, opcionalmente comprimidos con gzip sobre la
+marcha. La memoria usada no depende del tamaño del volcado. Lo usan el endpoint
+GET /patients/activities:export y este CLI.
+
+Uso:
+    python -m app.db.export --type vital_signs --from 2025-06-01 --to 2025-06-02 --format csv --gzip -o vital_signs.csv.gz
+    python -m app.db.export --type vital_signs medication_logs --format ndjson --output-dir dumps/
+"""
+import argparse
+import asyncio
+import csv
+import io
+import os
+import sys
+import zlib
+from datetime import datetime
+from bson import ObjectId
+from pydantic import BaseModel
+from app.db.client import db_client
+from app.db.models.activity import ACTIVITY_FIELDS, ACTIVITY_MODELS, DATETIME_FIELDS
+from app.db import archive, buckets
+from app.serialization import dumps
+
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+
+
+def date_range(date_from=None, date_to=None) -> dict:
+    rango = {}
+    if date_from is not None:
+        rango["$gte"] = date_from
+    if date_to is not None:
+        rango["$lt"] = date_to
+    return rango
+
+
+def export_pipeline(field: str, date_from=None, date_to=None) -> list:
+    """Pipeline sobre `patient` que devuelve una fila por entrada de `field` con su patient_id."""
+    fecha = f"{field}.{DATETIME_FIELDS[field]}"
+    rango = date_range(date_from, date_to)
+
+    pipeline = []
+    if rango:
+        # Descarta antes del $unwind los pacientes sin entradas en el rango (usa el índice multikey de la fecha)
+        pipeline.append({"$match": {field: {"$elemMatch": {DATETIME_FIELDS[field]: rango}}}})
+    pipeline += [
+        {"$project": {field: 1}},
+        {"$unwind": f"${field}"},
+    ]
+    if rango:
+        pipeline.append({"$match": {fecha: rango}})
+    pipeline.append({"$replaceRoot": {"newRoot": {"$mergeObjects": [{"patient_id": "$_id"}, f"${field}"]}}})
+    return pipeline
+
+
+def bucket_export_pipeline(field: str, date_from=None, date_to=None) -> list:
+    """Igual que export_pipeline pero sobre `activity_bucket`."""
+    match = {"type": field}
+    dias = {}
+    if date_from is not None:
+        dias["$gte"] = buckets.bucket_day(date_from)
+    if date_to is not None:
+        dias["$lte"] = buckets.bucket_day(date_to)
+    if dias:
+        match["day"] = dias
+
+    pipeline = [
+        {"$match": match},
+        {"$project": {"patient_id": 1, "entries": 1}},
+        {"$unwind": "$entries"},
+    ]
+    rango = date_range(date_from, date_to)
+    if rango:
+        pipeline.append({"$match": {f"entries.{DATETIME_FIELDS[field]}": rango}})
+    pipeline.append({"$replaceRoot": {"newRoot": {"$mergeObjects": [{"patient_id": "$patient_id"}, "$entries"]}}})
+    return pipeline
+
+
+async def iter_activity_rows(field: str, date_from=None, date_to=None, batch_size: int = EXPORT_BATCH_SIZE):
+    """Filas {patient_id, id, ...campos} de todas las entradas de `field`, leídas en lotes del cursor."""
+    if field not in ACTIVITY_FIELDS:
+        raise ValueError(f"Tipo de actividad desconocido: {field}")
+
+    if buckets.BUCKETS_ENABLED:
+        collection = buckets.bucket_collection()
+        pipeline = bucket_export_pipeline(field, date_from, date_to)
+    else:
+        collection = db_client.conectacare.patient
+        pipeline = export_pipeline(field, date_from, date_to)
+
+    cursor = await collection.aggregate(pipeline, batchSize=batch_size)
+    async with cursor:
+        async for row in cursor:
+            yield row
+
+    if not buckets.BUCKETS_ENABLED: # las entradas movidas a activity_archive (app/db/archive.py)
+        async for row in archive.iter_rows(field, date_from, date_to):
+            yield row
+
+
+def csv_columns(field: str) -> list:
+    """Columnas del CSV: patient_id, id y los campos del modelo; los submodelos se aplanan (blood_pressure.systolic)."""
+    columns = ["patient_id", "id"]
+    for name, info in ACTIVITY_MODELS[field].model_fields.items():
+        if name == "id":
+            continue
+        if isinstance(info.annotation, type) and issubclass(info.annotation, BaseModel):
+            columns += [f"{name}.{sub}" for sub in info.annotation.model_fields]
+        else:
+            columns.append(name)
+    return columns
+
+
+def csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def csv_row(columns: list, row: dict) -> list:
+    valores = []
+    for column in columns:
+        value = row
+        for part in column.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        valores.append(csv_value(value))
+    return valores
+
+
+async def export_chunks(field: str, fmt: str = "ndjson", date_from=None, date_to=None, gzip: bool = False,
+                        batch_size: int = EXPORT_BATCH_SIZE):
+    """Bloques de bytes del volcado (NDJSON o CSV con encabezado), comprimidos con gzip si se pide."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato desconocido: {fmt}")
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None  # wbits=31: formato gzip
+    partes = []
+    pendiente = 0
+
+    if fmt == "csv":
+        columns = csv_columns(field)
+        linea = io.StringIO()
+        writer = csv.writer(linea, lineterminator="\n")
+
+        def serializar(row) -> bytes:
+            linea.seek(0)
+            linea.truncate()
+            writer.writerow(row)
+            return linea.getvalue().encode("utf-8")
+
+        partes.append(serializar(columns))
+    else:
+        def serializar(row) -> bytes:
+            return dumps(row) + b"\n"
+
+    def vaciar() -> bytes:
+        data = b"".join(partes)
+        partes.clear()
+        return compressor.compress(data) if compressor else data
+
+    async for row in iter_activity_rows(field, date_from, date_to, batch_size):
+        data = serializar(csv_row(columns, row) if fmt == "csv" else row)
+        partes.append(data)
+        pendiente += len(data)
+        if pendiente >= CHUNK_SIZE:
+            pendiente = 0
+            chunk = vaciar()
+            if chunk:  # gzip puede retener todo el bloque en su buffer interno
+                yield chunk
+
+    chunk = vaciar()
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
+
+
+async def export_to_file(field: str, path: str, fmt: str, date_from=None, date_to=None, gzip: bool = False,
+                         batch_size: int = EXPORT_BATCH_SIZE):
+    if path == "-":
+        out = sys.stdout.buffer
+    else:
+        out = open(path, "wb")
+    try:
+        async for chunk in export_chunks(field, fmt, date_from, date_to, gzip, batch_size):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+        else:
+            out.flush()
+
+
+def export_filename(field: str, fmt: str, gzip: bool) -> str:
+    return f"{field}.{fmt}" + (".gz" if gzip else "")
+
+
+async def main(args):
+    for field in args.type:
+        if args.output and len(args.type) == 1:
+            path = args.output
+        else:
+            path = os.path.join(args.output_dir, export_filename(field, args.format, args.gzip))
+        await export_to_file(field, path, args.format, args.date_from, args.date_to, args.gzip, args.batch_size)
+        if path != "-":
+            print(f"{field}: {path}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta las actividades de todos los pacientes en NDJSON o CSV")
+    parser.add_argument("--type", nargs="+", choices=ACTIVITY_FIELDS, required=True, help="Arreglos a exportar")
+    parser.add_argument("--from", dest="date_from", type=datetime.fromisoformat, help="Fecha inicial (inclusiva) en ISO 8601")
+    parser.add_argument("--to", dest="date_to", type=datetime.fromisoformat, help="Fecha final (exclusiva) en ISO 8601")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    parser.add_argument("--gzip", action="store_true", help="Comprimir la salida con gzip")
+    parser.add_argument("-o", "--output", help="Archivo de salida (- para stdout); solo con un --type")
+    parser.add_argument("--output-dir", default=".", help="Directorio de salida con varios --type")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE, help="Documentos por lote del cursor")
+    args = parser.parse_args()
+
+    if args.output and len(args.type) > 1:
+        parser.error("--output solo se puede usar con un único --type; usar --output-dir")
+
+    asyncio.run(main(args))
@@ -0,0 +1,175 @@
+"""
+Registro de índices de la base `conectacare`.
+
+Los índices se declaran aquí y se reconcilian al arrancar la app (ver app/main.py) o a mano:
+
+    python -m app.db.indexes            # crea los que falten y recrea los que cambiaron
+    python -m app.db.indexes --prune    # además elimina los que no están en el registro
+
+Reconciliar es idempotente: si un índice ya existe con la misma definición no se toca.
+
+Los únicos reemplazan la verificación de duplicados antes de insertar, así que la app no
+arranca si alguno falta o no coincide con su definición (ver missing_unique_indexes).
+"""
+import argparse
+import asyncio
+import os
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
+from app.db.client import db_client
+from app.db.models.activity import ACTIVITY_FIELDS, DATETIME_FIELDS
+
+# Segundos que se guardan las claves de Idempotency-Key (índice TTL; también el vencimiento del LRU de app/idempotency.py)
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+
+INDEXES = {
+    "patient": [
+        # Reemplaza la verificación de duplicados antes de insertar: el insert falla con DuplicateKeyError
+        IndexModel([("document", ASCENDING)], name="document_unique", unique=True),
+        # Pacientes de un caretaker paginados por _id (GET /caretakers/{id}/patients)
+        IndexModel([("caretakers_ids", ASCENDING), ("_id", ASCENDING)], name="caretakers_ids"),
+        # Multikey sobre los ids de cada arreglo (los PUT hacen match por "<arreglo>.id")
+        *[IndexModel([(f"{field}.id", ASCENDING)], name=f"{field}_id") for field in ACTIVITY_FIELDS],
+        *[
+            IndexModel([(f"{field}.{DATETIME_FIELDS[field]}", DESCENDING)], name=f"{field}_{DATETIME_FIELDS[field]}")
+            for field in ACTIVITY_FIELDS
+        ],
+    ],
+    "caretaker": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        # Listado filtrado por rol y paginado por _id (GET /caretakers/?role=...)
+        IndexModel([("role", ASCENDING), ("_id", ASCENDING)], name="role_id"),
+    ],
+    "activity_bucket": [
+        IndexModel([("patient_id", ASCENDING), ("type", ASCENDING), ("day", DESCENDING)], name="patient_type_day"),
+        IndexModel([("patient_id", ASCENDING), ("type", ASCENDING), ("entries.id", ASCENDING)], name="patient_type_entry_id"),
+    ],
+    "activity_archive": [
+        # Bloques archivados de un paciente y tipo, recorridos por fecha (app/db/archive.py)
+        IndexModel([("patient_id", ASCENDING), ("type", ASCENDING), ("end", ASCENDING)], name="patient_type_end"),
+        # Ids ya archivados, para que reprocesar un paciente no duplique entradas
+        IndexModel([("patient_id", ASCENDING), ("ids", ASCENDING)], name="patient_ids"),
+    ],
+    "idempotency_key": [
+        # Las claves de Idempotency-Key (app/idempotency.py) se borran solas después de IDEMPOTENCY_TTL
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=IDEMPOTENCY_TTL),
+    ],
+    "vital_rollup": [
+        # Un agregado por paciente, granularidad y período (app/db/vital_rollups.py); los upserts lo usan como clave
+        IndexModel([("patient_id", ASCENDING), ("granularity", ASCENDING), ("period", ASCENDING)], name="patient_granularity_period", unique=True),
+    ],
+}
+
+# Opciones que cuentan al comparar un índice existente con su definición
+_OPCIONES = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+
+def _modelo_existente(nombre: str, existente: dict) -> IndexModel:
+    """IndexModel con la definición que tenía un índice, para restaurarlo si falla su reemplazo."""
+    opciones = {opcion: existente[opcion] for opcion in _OPCIONES if opcion in existente}
+    return IndexModel([(campo, int(d) if isinstance(d, float) else d) for campo, d in existente["key"]], name=nombre, **opciones)
+
+
+async def _tiene_duplicados(collection, modelo: IndexModel) -> bool:
+    """True si hay documentos que violarían el índice único `modelo`."""
+    doc = modelo.document
+    filtro = dict(doc.get("partialFilterExpression", {}))
+    if doc.get("sparse"):
+        filtro.update({campo: {"$exists": True} for campo in doc["key"]})
+    grupo = {f"k{i}": f"${campo}" for i, campo in enumerate(doc["key"])}
+    cursor = await collection.aggregate([
+        {"$match": filtro},
+        {"$group": {"_id": grupo, "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gt": 1}}},
+        {"$limit": 1},
+    ])
+    return await cursor.to_list(1) != []
+
+
+def _mismo_indice(existente: dict, modelo: IndexModel) -> bool:
+    doc = modelo.document
+    # El servidor puede devolver las direcciones como float (1.0)
+    claves = [(campo, int(d) if isinstance(d, (int, float)) else d) for campo, d in existente["key"]]
+    if claves != list(doc["key"].items()):
+        return False
+    return all(existente.get(opcion) == doc.get(opcion) for opcion in _OPCIONES)
+
+
+async def ensure_indexes(collections=None, prune: bool = False) -> dict:
+    """
+    Reconcilia los índices del registro (o solo los de `collections`).
+    Devuelve por colección los nombres creados, recreados, eliminados y los errores.
+    Un error en un índice (p. ej. documentos duplicados al crear uno único) no detiene el resto.
+
+    Un índice único que cambió no se elimina si su reemplazo no se puede construir: antes se
+    buscan duplicados y, si la creación falla igual, se restaura la definición anterior.
+    """
+    db = db_client.conectacare
+    reporte = {}
+
+    for name, modelos in INDEXES.items():
+        if collections is not None and name not in collections:
+            continue
+
+        collection = db[name]
+        existentes = await collection.index_information()
+        cambios = {"created": [], "rebuilt": [], "dropped": [], "errors": []}
+
+        for modelo in modelos:
+            nombre = modelo.document["name"]
+            actual = existentes.get(nombre)
+            if actual is not None and _mismo_indice(actual, modelo):
+                continue
+            try:
+                if actual is not None and modelo.document.get("unique") and await _tiene_duplicados(collection, modelo):
+                    cambios["errors"].append(f"{nombre}: hay documentos duplicados, se mantiene el índice anterior")
+                    continue
+                if actual is not None:
+                    await collection.drop_index(nombre)
+                await collection.create_indexes([modelo])
+                cambios["rebuilt" if actual is not None else "created"].append(nombre)
+            except PyMongoError as e:
+                cambios["errors"].append(f"{nombre}: {e}")
+                if actual is not None and nombre not in await collection.index_information():
+                    await collection.create_indexes([_modelo_existente(nombre, actual)])
+
+        if prune:
+            declarados = {modelo.document["name"] for modelo in modelos} | {"_id_"}
+            for nombre in existentes:
+                if nombre not in declarados:
+                    await collection.drop_index(nombre)
+                    cambios["dropped"].append(nombre)
+
+        reporte[name] = cambios
+
+    return reporte
+
+
+async def missing_unique_indexes() -> list:
+    """Índices únicos del registro que no existen o no coinciden con su definición ("colección.nombre")."""
+    db = db_client.conectacare
+    faltantes = []
+    for name, modelos in INDEXES.items():
+        unicos = [modelo for modelo in modelos if modelo.document.get("unique")]
+        if not unicos:
+            continue
+        existentes = await db[name].index_information()
+        for modelo in unicos:
+            actual = existentes.get(modelo.document["name"])
+            if actual is None or not _mismo_indice(actual, modelo):
+                faltantes.append(f"{name}.{modelo.document['name']}")
+    return faltantes
+
+
+def print_report(reporte: dict):
+    for name, cambios in reporte.items():
+        resumen = ", ".join(f"{accion}: {', '.join(nombres)}" for accion, nombres in cambios.items() if nombres)
+        print(f"Índices de {name}: {resumen or 'sin cambios'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crea o actualiza los índices declarados en app/db/indexes.py")
+    parser.add_argument("--prune", action="store_true", help="Elimina los índices que no están en el registro")
+    args = parser.parse_args()
+
+    print_report(asyncio.run(ensure_indexes(prune=args.prune)))
@@ -0,0 +1,88 @@
+"""
+Migración de los arreglos embebidos del paciente a buckets (ver app/db/buckets.py).
+
+Para cada paciente que todavía tenga actividades embebidas, agrupa las entradas por tipo y
+día en buckets de hasta ACTIVITY_BUCKET_SIZE entradas, los inserta y luego elimina los
+arreglos del documento del paciente. Se puede volver a ejecutar sin duplicar datos: los
+buckets creados por la migración se marcan con `source: "migration"` y se reemplazan si
+un paciente quedó a medias.
+
+Debe ejecutarse antes de arrancar el servicio con ACTIVITY_STORAGE=buckets.
+
+Uso:
+    python -m app.db.migrate_buckets [--dry-run]
+"""
+import argparse
+import asyncio
+from collections import defaultdict
+from datetime import datetime
+from bson import ObjectId
+from app.db.client import db_client
+from app.db.models.activity import ACTIVITY_FIELDS, DATETIME_FIELDS
+from app.db.buckets import BUCKET_SIZE, bucket_collection, bucket_day
+from app.db.indexes import ensure_indexes
+
+# Día usado para entradas antiguas que no tienen fecha, para no perderlas
+SIN_FECHA = datetime(1970, 1, 1)
+
+
+def build_buckets(patient_id: ObjectId, field: str, entries: list) -> list:
+    por_dia = defaultdict(list)
+    for entry in entries:
+        if not entry.get("id"):
+            entry["id"] = ObjectId()
+        fecha = entry.get(DATETIME_FIELDS[field])
+        por_dia[bucket_day(fecha) if isinstance(fecha, datetime) else SIN_FECHA].append(entry)
+
+    docs = []
+    for day, day_entries in sorted(por_dia.items()):
+        day_entries.sort(key=lambda e: e.get(DATETIME_FIELDS[field]) or SIN_FECHA)
+        for i in range(0, len(day_entries), BUCKET_SIZE):
+            chunk = day_entries[i:i + BUCKET_SIZE]
+            docs.append({
+                "patient_id": patient_id,
+                "type": field,
+                "day": day,
+                "count": len(chunk),
+                "entries": chunk,
+                "source": "migration",
+            })
+    return docs
+
+
+async def migrate(dry_run: bool = False):
+    patients = db_client.conectacare.patient
+    await ensure_indexes(["activity_bucket"])
+
+    pendientes = {"$or": [{f"{field}.0": {"$exists": True}} for field in ACTIVITY_FIELDS]}
+    proyeccion = {field: 1 for field in ACTIVITY_FIELDS}
+
+    total_pacientes = total_entradas = total_buckets = 0
+    async for patient in patients.find(pendientes, proyeccion):
+        docs = []
+        for field in ACTIVITY_FIELDS:
+            entries = patient.get(field) or []
+            total_entradas += len(entries)
+            docs.extend(build_buckets(patient["_id"], field, entries))
+
+        total_pacientes += 1
+        total_buckets += len(docs)
+        if dry_run:
+            continue
+
+        # Si una ejecución anterior se cortó en este paciente, descartamos lo que alcanzó a insertar
+        await bucket_collection().delete_many({"patient_id": patient["_id"], "source": "migration"})
+        if docs:
+            await bucket_collection().insert_many(docs, ordered=False)
+        await patients.update_one({"_id": patient["_id"]}, {"$unset": {field: "" for field in ACTIVITY_FIELDS}})
+
+    accion = "Se migrarían" if dry_run else "Migrados"
+    print(f"{accion} {total_pacientes} pacientes, {total_entradas} entradas en {total_buckets} buckets")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mueve las actividades embebidas de los pacientes a buckets")
+    parser.add_argument("--dry-run", action="store_true", help="Solo cuenta lo que se migraría, sin escribir")
+    args = parser.parse_args()
+
+    asyncio.run(migrate(args.dry_run))
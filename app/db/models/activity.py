@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
 from typing import Optional, Dict, List
 
@@ -62,3 +62,45 @@ class MedicalHistoryEntry(BaseModel):
     description: str
     notes: Optional[str] = ""
 
+
+
+# Arreglos de actividades embebidos en el paciente y el modelo de cada uno
+ACTIVITY_MODELS = {
+    "medication_logs": MedicationLog,
+    "meals": Meal,
+    "hygiene_logs": HygieneLog,
+    "vital_signs": VitalSigns,
+    "symptoms": Symptom,
+    "medical_history": MedicalHistoryEntry,
+}
+
+ACTIVITY_FIELDS = tuple(ACTIVITY_MODELS)
+
+# Campo de fecha por el que se ordena y filtra cada arreglo (el historial médico usa `date`)
+DATETIME_FIELDS = {field: "datetime" for field in ACTIVITY_FIELDS}
+DATETIME_FIELDS["medical_history"] = "date"
+
+
+# Carga masiva de actividades (sincronización de tablets sin conexión)
+MAX_BATCH_ITEMS = 500
+
+class ActivityBatchItem(BaseModel):
+    type: str                         # nombre del arreglo: "meals", "vital_signs", ...
+    data: Dict                        # el registro, validado luego con el modelo del tipo
+    patient_id: Optional[str] = None  # solo se usa en el batch entre pacientes
+
+
+class ActivityBatch(BaseModel):
+    items: List[ActivityBatchItem] = Field(..., min_length=1, max_length=MAX_BATCH_ITEMS)
+
+
+class ActivityBatchResult(BaseModel):
+    index: int                        # posición del item en la petición
+    type: str
+    patient_id: Optional[str] = None
+    id: Optional[str] = None          # id asignado si se guardó
+    error: Optional[str] = None       # motivo si no se guardó
+
+
+class ActivityBatchResponse(BaseModel):
+    results: List[ActivityBatchResult]
@@ -7,3 +7,12 @@ class Caretaker (BaseModel):
     email: str
     passwordHash: str
     role: str
+
+
+# Caretaker tal como se lista en GET /caretakers/ (sin passwordHash)
+class CaretakerPublic (BaseModel):
+
+    id: str
+    name: str
+    email: str
+    role: str
@@ -1,8 +1,8 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 # En este archivo se hace la clase base del patient y los atributos que contiene
 from app.db.models.activity import MedicalHistoryEntry, Meal, MedicationLog, HygieneLog, VitalSigns, Symptom
-from typing import List
-from datetime import date
+from typing import Dict, List
+from datetime import date, datetime
 from typing import Optional
 
 class Patient(BaseModel):
@@ -25,3 +25,47 @@ class Patient(BaseModel):
     vital_signs: List[VitalSigns] = []
     symptoms: List[Symptom] = []
 
+
+# Resumen de un paciente en el listado de un caretaker (GET /caretakers/{id}/patients)
+class PatientRosterEntry(BaseModel):
+    id: str
+    name: str
+    last_name: str
+    age: int
+    last_vital_sign: Optional[VitalSigns] = None
+    last_medication_at: Optional[datetime] = None
+
+
+# Último estado del paciente para los tableros de sala (GET /patients/{patient_id}/summary)
+class PatientSummary(BaseModel):
+    id: str
+    last_vital_sign: Optional[VitalSigns] = None
+    last_meal: Optional[Meal] = None
+    last_medication: Optional[MedicationLog] = None
+    open_symptoms: List[Symptom] = []
+
+
+# Consultas de varios pacientes por id en una sola petición
+MAX_BATCH_IDS = 500
+
+class PatientIdsRequest(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=MAX_BATCH_IDS)
+
+
+class PatientBatchGetRequest(PatientIdsRequest):
+    fields: Optional[List[str]] = None  # campos del paciente a devolver; por defecto todos
+
+
+class BatchGetError(BaseModel):
+    status: int                       # 400 si el id es inválido, 404 si no existe
+    detail: str
+
+
+class PatientSummaryBatch(BaseModel):
+    results: Dict[str, PatientSummary]
+    errors: Dict[str, BatchGetError]
+
+
+class PatientBatchGetResponse(BaseModel):
+    results: Dict[str, Dict]          # paciente (o los campos pedidos) por id
+    errors: Dict[str, BatchGetError]
@@ -0,0 +1,474 @@
+import base64
+import heapq
+import os
+from itertools import islice
+from bson import ObjectId, json_util
+from pymongo import UpdateOne
+from app.db.client import db_client
+from app.db.models.activity import ACTIVITY_FIELDS, DATETIME_FIELDS
+from app.db import archive, buckets, summary, vital_rollups
+from app.cache import invalidate
+from app.db.coalescer import WriteCoalescer, COALESCING_ENABLED
+
+# En este archivo van las consultas compartidas sobre la colección de pacientes.
+# Las actividades pueden vivir embebidas en el paciente (por defecto) o en buckets
+# (ACTIVITY_STORAGE=buckets, ver app/db/buckets.py); los routers no necesitan saber cuál.
+#
+# Cada paciente lleva un contador `revision` que toda escritura de actividades incrementa
+# en el mismo update (o justo después, en modo buckets). Los GET lo usan como ETag.
+
+# Incremento de la revisión que acompaña a cada escritura
+BUMP_REVISION = {"$inc": {"revision": 1}}
+
+# Los arreglos embebidos se guardan en orden cronológico (fecha, id): los POST insertan con
+# $push + $sort y los PUT reordenan en el mismo update. Con ACTIVITY_ARRAYS_SORTED=true las
+# lecturas confían en ese orden y no vuelven a ordenar; activarlo después de correr
+# `python -m app.db.sort_arrays` sobre los datos existentes.
+ARRAYS_SORTED = os.getenv("ACTIVITY_ARRAYS_SORTED", "false").lower() == "true"
+
+
+def array_order(field: str) -> dict:
+    """Orden en que se guardan las entradas de `field`: de la más antigua a la más reciente, empates por id."""
+    return {DATETIME_FIELDS[field]: 1, "id": 1}
+
+
+def sorted_push(field: str, entries: list) -> dict:
+    """Modificador de $push que agrega `entries` a `field` dejando el arreglo ordenado."""
+    return {"$each": entries, "$sort": array_order(field)}
+
+
+def merge_updates(*updates) -> dict:
+    """Une varios documentos de update operador por operador ($push, $inc, $max...)."""
+    merged = {}
+    for update in updates:
+        for operator, fields in update.items():
+            merged.setdefault(operator, {}).update(fields)
+    return merged
+
+
+def push_update(entries_by_field: dict) -> dict:
+    """Update que agrega las entradas a sus arreglos, incrementa la revisión y actualiza el resumen."""
+    return merge_updates(
+        {"$push": {field: sorted_push(field, entries) for field, entries in entries_by_field.items()}},
+        BUMP_REVISION,
+        summary.push_update(entries_by_field),
+    )
+
+
+async def patient_exists(patient_id: ObjectId) -> bool:
+    return await db_client.conectacare.patient.find_one({"_id": patient_id}, {"_id": 1}) is not None
+
+
+async def patient_revision(patient_id: ObjectId):
+    """Revisión actual del paciente, o None si no existe. Solo proyecta `revision`, no los arreglos."""
+    patient = await db_client.conectacare.patient.find_one({"_id": patient_id}, {"revision": 1})
+    if patient is None:
+        return None
+    return patient.get("revision", 0)
+
+
+async def bump_revision(patient_id: ObjectId, summary_update: dict = None):
+    """Incrementa la revisión en modo buckets, después de escribir en los buckets, junto con el resumen."""
+    await db_client.conectacare.patient.update_one({"_id": patient_id}, merge_updates(BUMP_REVISION, summary_update or {}))
+
+
+async def load_patient(patient_id: ObjectId, include_archived: bool = True):
+    """
+    Documento completo del paciente con sus seis arreglos, o None si no existe. En modo
+    embebido se agregan las entradas archivadas (anteriores a `archived_before`), salvo con
+    `include_archived=False`, que devuelve solo las calientes sin abrir los bloques.
+    """
+    patient = await db_client.conectacare.patient.find_one({"_id": patient_id})
+    if patient is not None and buckets.BUCKETS_ENABLED:
+        patient.update(await buckets.find_all_by_type(patient_id))
+    elif patient is not None and include_archived:
+        await archive.merge_archived(patient)
+    return patient
+
+
+async def iter_patients(patient_ids: list, fields=None):
+    """
+    Documentos de varios pacientes con una sola consulta `$in`, a medida que llegan del cursor.
+    Con `fields` solo se proyectan esos campos (además de _id). En modo buckets los arreglos
+    pedidos se completan con otra consulta para todos los pacientes; en modo embebido, los
+    pacientes con entradas archivadas se devuelven al final, completados con una sola consulta
+    al archivo para todos ellos.
+    """
+    proyeccion = {"archived_before": 1, **{field: 1 for field in fields}} if fields else None
+    pedidos = [field for field in (fields or ACTIVITY_FIELDS) if field in ACTIVITY_FIELDS]
+
+    arrays = {}
+    if buckets.BUCKETS_ENABLED and pedidos:
+        arrays = await buckets.find_arrays_many(patient_ids, pedidos)
+
+    archivados = []
+    async for patient in db_client.conectacare.patient.find({"_id": {"$in": patient_ids}}, proyeccion):
+        patient.update(arrays.get(patient["_id"], {}))
+        if pedidos and not buckets.BUCKETS_ENABLED and patient.get("archived_before") is not None:
+            archivados.append(patient)
+            continue
+        yield patient
+
+    if archivados:
+        cold = await archive.load_entries_many([patient["_id"] for patient in archivados], pedidos)
+        for patient in archivados:
+            yield archive.merge_entries(patient, cold.get(patient["_id"], {}))
+
+
+async def push_activity(patient_id: ObjectId, field: str, entry: dict) -> bool:
+    """
+    Agrega una entrada al arreglo `field` del paciente. Devuelve False si el paciente no existe.
+
+    Es un único update condicional: no hace falta un find_one previo para saber si el
+    paciente existe, basta con mirar matched_count. Con WRITE_COALESCING=true la entrada se
+    agrupa con las demás del mismo paciente (ver app/db/coalescer.py).
+    """
+    if write_coalescer is not None:
+        return await write_coalescer.submit(patient_id, field, entry)
+
+    if buckets.BUCKETS_ENABLED:
+        # Los buckets se crean con upsert, así que la existencia del paciente se verifica aparte
+        if not await patient_exists(patient_id):
+            return False
+        added = await buckets.push_entry(patient_id, field, entry)
+        if added:
+            await bump_revision(patient_id, summary.push_update({field: [entry]}))
+    else:
+        result = await db_client.conectacare.patient.update_one({"_id": patient_id}, push_update({field: [entry]}))
+        added = result.matched_count == 1
+
+    if added:
+        if field == "vital_signs":
+            await vital_rollups.add_readings(patient_id, [entry])
+        await invalidate(patient_id, ("patient", field))
+    return added
+
+
+async def push_activities(patient_id: ObjectId, entries_by_field: dict) -> bool:
+    """
+    Agrega entradas de varios tipos ({campo: [entradas]}) con un único update
+    ($push + $each por arreglo). Devuelve False si el paciente no existe.
+    """
+    if buckets.BUCKETS_ENABLED:
+        if not await patient_exists(patient_id):
+            return False
+        await buckets.push_entries(patient_id, entries_by_field)
+        await bump_revision(patient_id, summary.push_update(entries_by_field))
+    else:
+        result = await db_client.conectacare.patient.update_one({"_id": patient_id}, push_update(entries_by_field))
+        if result.matched_count != 1:
+            return False
+
+    if "vital_signs" in entries_by_field:
+        await vital_rollups.add_readings(patient_id, entries_by_field["vital_signs"])
+    await invalidate(patient_id, ("patient", *entries_by_field))
+    return True
+
+
+# Agrupador de escrituras de push_activity; None si WRITE_COALESCING no está activado
+write_coalescer = WriteCoalescer(push_activities) if COALESCING_ENABLED else None
+
+
+async def push_activities_many(entries_by_patient: dict) -> set:
+    """
+    Variante entre pacientes de push_activities ({patient_id: {campo: [entradas]}}).
+    Todas las escrituras van en un solo bulk_write(ordered=False). Devuelve los ids
+    de los pacientes que existen (a los demás no se les escribe nada).
+    """
+    existentes = {
+        p["_id"] async for p in db_client.conectacare.patient.find({"_id": {"$in": list(entries_by_patient)}}, {"_id": 1})
+    }
+
+    ops = []
+    for patient_id in existentes:
+        entries_by_field = entries_by_patient[patient_id]
+        if buckets.BUCKETS_ENABLED:
+            for field, entries in entries_by_field.items():
+                ops.extend(buckets.bucket_updates(patient_id, field, entries))
+        else:
+            ops.append(UpdateOne({"_id": patient_id}, push_update(entries_by_field)))
+
+    if ops:
+        collection = buckets.bucket_collection() if buckets.BUCKETS_ENABLED else db_client.conectacare.patient
+        await collection.bulk_write(ops, ordered=False)
+        if buckets.BUCKETS_ENABLED:
+            await db_client.conectacare.patient.bulk_write([
+                UpdateOne({"_id": patient_id}, merge_updates(BUMP_REVISION, summary.push_update(entries_by_patient[patient_id])))
+                for patient_id in existentes
+            ], ordered=False)
+        await vital_rollups.apply_updates([
+            op for patient_id in existentes
+            for op in vital_rollups.rollup_updates(patient_id, entries_by_patient[patient_id].get("vital_signs", []))
+        ])
+
+    for patient_id in existentes:
+        await invalidate(patient_id, ("patient", *entries_by_patient[patient_id]))
+
+    return existentes
+
+
+async def set_activity(patient_id: ObjectId, field: str, entry_id: ObjectId, entry: dict) -> bool:
+    """
+    Actualiza la entrada `entry_id` del arreglo `field` reemplazando solo los campos de
+    `entry`. Devuelve False si no existe el paciente o la entrada.
+
+    En modo embebido la fecha puede cambiar, así que el update es un pipeline que modifica el
+    elemento y reordena el arreglo en la misma escritura (un $set posicional seguido de otro
+    update dejaría un instante en que el arreglo está desordenado). Una segunda etapa del mismo
+    pipeline recalcula el resumen del paciente desde el arreglo ya ordenado. Si la entrada no
+    está en el arreglo pero sí archivada, se edita en su bloque (archive.set_entry).
+    """
+    # Los agregados de signos vitales se recalculan en el período anterior y el nuevo de la lectura
+    fecha_anterior = await vital_rollups.reading_date(patient_id, entry_id) if field == "vital_signs" else None
+
+    if buckets.BUCKETS_ENABLED:
+        updated = await buckets.set_entry(patient_id, field, entry_id, entry)
+        if updated:
+            await bump_revision(patient_id, await summary.bucket_summary_update(patient_id, field))
+    else:
+        actualizadas = {
+            "$map": {
+                "input": f"${field}",
+                "as": "e",
+                "in": {"$cond": [
+                    {"$eq": ["$$e.id", entry_id]},
+                    {"$mergeObjects": ["$$e", {"$literal": entry}]},
+                    "$$e",
+                ]},
+            }
+        }
+        pipeline = [{"$set": {
+            field: {"$sortArray": {"input": actualizadas, "sortBy": array_order(field)}},
+            "revision": {"$add": [{"$ifNull": ["$revision", 0]}, 1]},
+        }}]
+        if field in summary.SUMMARY_SOURCES:
+            pipeline.append({"$set": summary.recompute_stage(field)})
+        result = await db_client.conectacare.patient.update_one({"_id": patient_id, f"{field}.id": entry_id}, pipeline)
+        updated = result.matched_count == 1
+        if not updated: # puede estar archivada
+            anterior = await archive.set_entry(patient_id, field, entry_id, entry)
+            updated = anterior is not None
+            if updated and field == "vital_signs":
+                fecha_anterior = anterior["datetime"]
+
+    if updated:
+        if field == "vital_signs":
+            await vital_rollups.update_periods(patient_id, [fecha_anterior, entry.get("datetime")])
+        await invalidate(patient_id, ("patient", field))
+    return updated
+
+
+async def find_activity_array(patient_id: ObjectId, field: str):
+    """
+    Devuelve (revisión, arreglo) con únicamente el arreglo `field` del paciente, o None si
+    el paciente no existe.
+
+    La proyección se hace en el servidor: solo viajan el `_id` (que sirve como marca de
+    existencia), la revisión y el arreglo pedido, no los otros cinco arreglos del documento.
+    """
+    if field not in ACTIVITY_FIELDS:
+        raise ValueError(f"Tipo de actividad desconocido: {field}")
+
+    if buckets.BUCKETS_ENABLED:
+        revision = await patient_revision(patient_id)
+        if revision is None:
+            return None
+        return revision, list(reversed(await buckets.find_entries(patient_id, field))) # en orden cronológico, como el arreglo embebido
+
+    patient = await db_client.conectacare.patient.find_one({"_id": patient_id}, {"_id": 1, "revision": 1, "archived_before": 1, field: 1})
+    if patient is None:
+        return None
+
+    await archive.merge_archived(patient, (field,))
+    return patient.get("revision", 0), patient.get(field, [])
+
+
+def encode_cursor(*values) -> str:
+    """Convierte los valores de la última fila de una página en un cursor opaco (base64 url-safe)."""
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, *types) -> list:
+    """
+    Inverso de encode_cursor. `types` son los tipos esperados de cada valor, p. ej.
+    (datetime, ObjectId). Lanza ValueError si el cursor no es válido o no tiene esa forma.
+    """
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception as e:
+        raise ValueError("Cursor inválido") from e
+    if not isinstance(values, list) or len(values) != len(types) or not all(map(isinstance, values, types)):
+        raise ValueError("Cursor inválido")
+    return values
+
+
+def page_expression(field: str, date_from=None, date_to=None, limit=None, after=None) -> dict:
+    """Expresión de agregación con las entradas de `field` filtradas, ordenadas (más recientes primero) y recortadas."""
+    fecha = f"$$e.{DATETIME_FIELDS[field]}"
+    condiciones = []
+    if date_from is not None:
+        condiciones.append({"$gte": [fecha, date_from]})
+    if date_to is not None:
+        condiciones.append({"$lt": [fecha, date_to]})
+    if after is not None:
+        after_date, after_id = after
+        condiciones.append({"$or": [
+            {"$lt": [fecha, after_date]},
+            {"$and": [{"$eq": [fecha, after_date]}, {"$lt": ["$$e.id", after_id]}]},
+        ]})
+
+    arreglo = {"$ifNull": [f"${field}", []]}
+    if ARRAYS_SORTED:
+        # El arreglo ya está en orden cronológico: alcanza con invertirlo, y sin filtros las
+        # últimas `limit` entradas se toman directamente del final
+        if not condiciones:
+            return {"$reverseArray": {"$slice": [arreglo, -limit]} if limit is not None else arreglo}
+        entradas = {"$reverseArray": {"$filter": {"input": arreglo, "as": "e", "cond": {"$and": condiciones}}}}
+    else:
+        entradas = {
+            "$sortArray": {
+                "input": {
+                    "$filter": {
+                        "input": arreglo,
+                        "as": "e",
+                        "cond": {"$and": condiciones} if condiciones else True,
+                    }
+                },
+                "sortBy": {DATETIME_FIELDS[field]: -1, "id": -1},
+            }
+        }
+    if limit is not None:
+        entradas = {"$slice": [entradas, limit]}
+    return entradas
+
+
+async def find_activity_page(patient_id: ObjectId, field: str, date_from=None, date_to=None, limit=None, after=None):
+    """
+    Devuelve (revisión, entradas) con las entradas de `field` filtradas por rango de fechas
+    y ordenadas de la más reciente a la más antigua, paginadas por keyset.
+
+    `date_from` es inclusivo y `date_to` exclusivo. `after` es la pareja (fecha, id) de la
+    última entrada de la página anterior. El filtrado, orden y recorte se hacen dentro
+    de MongoDB con $filter / $sortArray / $slice, así que solo viaja la página pedida.
+    La revisión es None si el paciente no existe.
+    """
+    if field not in ACTIVITY_FIELDS:
+        raise ValueError(f"Tipo de actividad desconocido: {field}")
+
+    if buckets.BUCKETS_ENABLED:
+        revision = await patient_revision(patient_id)
+        if revision is None:
+            return None, []
+        return revision, await buckets.find_entries(patient_id, field, date_from, date_to, limit, after)
+
+    entradas = page_expression(field, date_from, date_to, limit, after)
+    pipeline = [
+        {"$match": {"_id": patient_id}},
+        {"$project": {"_id": 1, "revision": 1, "archived_before": 1, "entries": entradas}},
+    ]
+    cursor = await db_client.conectacare.patient.aggregate(pipeline)
+    result = await cursor.to_list(length=1)
+    if not result:
+        return None, []
+
+    entries = await archive.complete_page(
+        patient_id, field, result[0]["entries"], result[0].get("archived_before"), date_from, date_to, limit, after
+    )
+    return result[0].get("revision", 0), entries
+
+
+async def find_timeline_page(patient_id: ObjectId, fields, date_from=None, date_to=None, limit: int = 50, after=None):
+    """
+    Devuelve (revisión, [(campo, entrada)]) con las entradas de los arreglos `fields` en un solo
+    orden cronológico (más recientes primero), paginadas por keyset con `after` = (fecha, id)
+    igual que find_activity_page. La revisión es None si el paciente no existe.
+
+    En modo embebido una sola agregación trae, de cada arreglo, a lo sumo `limit` entradas ya
+    filtradas y ordenadas por MongoDB, y acá se mezclan con un merge de k vías (heapq.merge)
+    hasta completar la página: la memoria depende de `limit` y de la cantidad de tipos, no del
+    tamaño de los arreglos.
+    """
+    for field in fields:
+        if field not in ACTIVITY_FIELDS:
+            raise ValueError(f"Tipo de actividad desconocido: {field}")
+
+    if buckets.BUCKETS_ENABLED:
+        revision = await patient_revision(patient_id)
+        if revision is None:
+            return None, []
+        return revision, await buckets.find_timeline(patient_id, fields, date_from, date_to, limit, after)
+
+    pipeline = [
+        {"$match": {"_id": patient_id}},
+        {"$project": {"_id": 1, "revision": 1, "archived_before": 1, **{field: page_expression(field, date_from, date_to, limit, after) for field in fields}}},
+    ]
+    cursor = await db_client.conectacare.patient.aggregate(pipeline)
+    result = await cursor.to_list(length=1)
+    if not result:
+        return None, []
+
+    archived_before = result[0].get("archived_before")
+    for field in fields:
+        result[0][field] = await archive.complete_page(
+            patient_id, field, result[0].get(field, []), archived_before, date_from, date_to, limit, after
+        )
+
+    def ordenadas(field):
+        fecha = DATETIME_FIELDS[field]
+        return (((entry[fecha], entry["id"]), field, entry) for entry in result[0].get(field, []))
+
+    merged = heapq.merge(*(ordenadas(field) for field in fields), key=lambda item: item[0], reverse=True)
+    return result[0].get("revision", 0), [(field, entry) for _, field, entry in islice(merged, limit)]
+
+
+async def find_caretaker_patients(caretaker_id: ObjectId, limit: int, after: ObjectId = None) -> list:
+    """
+    Pacientes asignados a un caretaker (por `caretakers_ids`) ordenados por _id, paginados por
+    keyset con `after` = último _id de la página anterior.
+
+    Cada paciente trae solo lo que muestra el listado: nombre, apellido, edad, el último registro
+    de signos vitales y la fecha de la última medicación. Salen del subdocumento `summary`
+    (app/db/summary.py), que no depende de los arreglos calientes: un paciente con todas sus
+    entradas archivadas sigue mostrando su último estado. Para pacientes sin resumen todavía
+    (datos previos a `python -m app.db.summary`) se calculan desde los arreglos: en modo
+    embebido en la misma consulta, en modo buckets con buckets.latest_entries (una consulta
+    más por página, no una por paciente).
+    """
+    match = {"caretakers_ids": caretaker_id}
+    if after is not None:
+        match["_id"] = {"$gt": after}
+
+    proyeccion = {
+        "name": 1, "last_name": 1, "age": 1,
+        "last_vital_sign": "$summary.last_vital_sign.entry",
+        "last_medication_at": "$summary.last_medication.at",
+    }
+    if not buckets.BUCKETS_ENABLED and ARRAYS_SORTED:
+        proyeccion["last_vital_sign"] = {"$ifNull": [proyeccion["last_vital_sign"], {"$last": "$vital_signs"}]}
+        proyeccion["last_medication_at"] = {"$ifNull": [proyeccion["last_medication_at"], {"$last": "$medication_logs.datetime"}]}
+    elif not buckets.BUCKETS_ENABLED:
+        proyeccion["last_vital_sign"] = {"$ifNull": [proyeccion["last_vital_sign"], {
+            "$first": {"$sortArray": {"input": {"$ifNull": ["$vital_signs", []]}, "sortBy": {"datetime": -1}}}
+        }]}
+        proyeccion["last_medication_at"] = {"$ifNull": [proyeccion["last_medication_at"], {"$max": "$medication_logs.datetime"}]}
+
+    # El índice compuesto (caretakers_ids, _id) resuelve el filtro, el orden y el límite sin ordenar en memoria
+    cursor = await db_client.conectacare.patient.aggregate([
+        {"$match": match},
+        {"$sort": {"_id": 1}},
+        {"$limit": limit},
+        {"$project": proyeccion},
+    ])
+    patients = await cursor.to_list()
+
+    sin_resumen = [p for p in patients if p.get("last_vital_sign") is None or p.get("last_medication_at") is None]
+    if buckets.BUCKETS_ENABLED and sin_resumen:
+        ultimas = await buckets.latest_entries([p["_id"] for p in sin_resumen], ("vital_signs", "medication_logs"))
+        for patient in sin_resumen:
+            if patient.get("last_vital_sign") is None:
+                patient["last_vital_sign"] = ultimas.get((patient["_id"], "vital_signs"))
+            if patient.get("last_medication_at") is None:
+                medicacion = ultimas.get((patient["_id"], "medication_logs"))
+                patient["last_medication_at"] = medicacion["datetime"] if medicacion else None
+
+    return patients
@@ -87,3 +87,14 @@ def medical_history_entry_schema(entry) -> dict:
 
 def medical_history_schema(entries) -> list:
     return [medical_history_entry_schema(entry) for entry in entries]
+
+
+# Schema de lista de cada arreglo de actividades del paciente
+ACTIVITY_SCHEMAS = {
+    "medication_logs": medication_logs_schema,
+    "meals": meals_schema,
+    "hygiene_logs": hygiene_logs_schema,
+    "vital_signs": vital_signs_schema,
+    "symptoms": symptoms_schema,
+    "medical_history": medical_history_schema,
+}
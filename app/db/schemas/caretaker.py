@@ -11,3 +11,12 @@ def caretaker_schema(user) -> dict:
 
 def caretakers_schema(users) -> list:
     return [caretaker_schema(user) for user in users]
+
+
+def caretaker_public_schema(user) -> dict: # sin passwordHash, para el listado
+    return{
+        "id": str(user["_id"]),
+        "name": user.get("name", ""),
+        "email": user.get("email", ""),
+        "role": user.get("role", "")
+        }
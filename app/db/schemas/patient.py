@@ -26,6 +26,39 @@ def patient_schema(patient) -> dict:
         "medication_logs": [to_str_id(m) for m in patient.get("medication_logs", [])],
         "hygiene_logs": [to_str_id(h) for h in patient.get("hygiene_logs", [])],
         "vital_signs": [to_str_id(v) for v in patient.get("vital_signs", [])],
-        "symptoms": [to_str_id(s) for s in patient.get("symptoms", [])]
+        "symptoms": [to_str_id(s) for s in patient.get("symptoms", [])],
+        "archived_before": patient.get("archived_before"), # hay entradas archivadas anteriores a esta fecha (app/db/archive.py)
     }
 
+
+
+def patient_roster_schema(patient) -> dict: # resumen del paciente para el listado de un caretaker
+    last_vital_sign = patient.get("last_vital_sign")
+    return {
+        "id": str(patient["_id"]),
+        "name": patient.get("name", ""),
+        "last_name": patient.get("last_name", ""),
+        "age": patient.get("age", 0),
+        "last_vital_sign": to_str_id(dict(last_vital_sign)) if last_vital_sign else None,
+        "last_medication_at": patient.get("last_medication_at"),
+    }
+
+
+def patients_roster_schema(patients) -> list:
+    return [patient_roster_schema(patient) for patient in patients]
+
+
+def patient_summary_schema(patient, open_since: datetime) -> dict: # último estado del paciente a partir de su subdocumento `summary`
+    summary = patient.get("summary", {})
+
+    def ultima(key):
+        value = summary.get(key)
+        return to_str_id(dict(value["entry"])) if value else None
+
+    return {
+        "id": str(patient["_id"]),
+        "last_vital_sign": ultima("last_vital_sign"),
+        "last_meal": ultima("last_meal"),
+        "last_medication": ultima("last_medication"),
+        "open_symptoms": [to_str_id(dict(s)) for s in summary.get("recent_symptoms", []) if s["datetime"] >= open_since],
+    }
@@ -0,0 +1,45 @@
+"""
+Reordena cronológicamente los arreglos de actividades embebidos en los pacientes.
+
+Las escrituras mantienen cada arreglo ordenado por (fecha, id) (ver queries.sorted_push),
+pero los datos cargados antes quedaron en el orden en que llegaron, que con la
+sincronización offline de las tablets no es el orden clínico. Esta migración los ordena
+una vez, dentro de MongoDB (un $push vacío con $sort por arreglo, sin traer los documentos).
+Solo toca los arreglos que estén desordenados y les incrementa la revisión, así los ETag y
+el caché de pacientes dejan de servir el orden anterior.
+
+Se puede volver a ejecutar sin efectos. Después de correrla se puede activar
+ACTIVITY_ARRAYS_SORTED=true para que las lecturas confíen en el orden guardado.
+No aplica al modo buckets, donde las entradas se ordenan al leerlas.
+
+Uso:
+    python -m app.db.sort_arrays [--dry-run]
+"""
+import argparse
+import asyncio
+from app.db.client import db_client
+from app.db.models.activity import ACTIVITY_FIELDS
+from app.db.queries import BUMP_REVISION, array_order, sorted_push
+
+
+async def sort_arrays(dry_run: bool = False):
+    patients = db_client.conectacare.patient
+
+    for field in ACTIVITY_FIELDS:
+        desordenados = {
+            f"{field}.1": {"$exists": True}, # con una sola entrada ya está ordenado
+            "$expr": {"$ne": [f"${field}", {"$sortArray": {"input": f"${field}", "sortBy": array_order(field)}}]},
+        }
+        if dry_run:
+            print(f"{field}: se reordenarían {await patients.count_documents(desordenados)} pacientes")
+            continue
+        result = await patients.update_many(desordenados, {"$push": {field: sorted_push(field, [])}, **BUMP_REVISION})
+        print(f"{field}: {result.modified_count} pacientes reordenados")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ordena cronológicamente los arreglos de actividades embebidos")
+    parser.add_argument("--dry-run", action="store_true", help="Solo cuenta los pacientes que se reordenarían")
+    args = parser.parse_args()
+
+    asyncio.run(sort_arrays(args.dry_run))
@@ -0,0 +1,183 @@
+"""
+Resumen del último estado de cada paciente para los tableros de sala.
+
+El documento del paciente lleva un subdocumento `summary` con lo que muestran los tableros,
+así GET /patients/{patient_id}/summary (y su variante por lotes) lee un documento chico en
+lugar de traer y recorrer los seis arreglos:
+
+    {"last_vital_sign": {"at": datetime, "id": ObjectId, "entry": {...}},
+     "last_meal": {...}, "last_medication": {...},
+     "recent_symptoms": [{...}, ...]}   # los SUMMARY_RECENT_SYMPTOMS más recientes
+
+Cada escritura de actividades lo actualiza en el mismo update que modifica el arreglo:
+
+- POST: `$max` sobre {at, id, entry}. MongoDB compara subdocumentos campo por campo en orden,
+  así que gana la entrada con la fecha (y luego el id) más reciente aunque la tablet la
+  sincronice tarde. Los síntomas se agregan con $push + $sort + $slice.
+- PUT: la fecha puede cambiar, así que se recalcula desde el arreglo ya reordenado en la misma
+  etapa del pipeline (ver queries.set_activity).
+
+En modo buckets el resumen se escribe junto con el incremento de la revisión. Para calcularlo
+sobre los datos existentes:
+
+    python -m app.db.summary
+"""
+import argparse
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from app.db.client import db_client
+from app.db.models.activity import DATETIME_FIELDS
+from app.db import buckets
+
+# Cuántos síntomas recientes se guardan y hasta qué antigüedad se consideran abiertos
+# (los síntomas no tienen estado de resolución)
+RECENT_SYMPTOMS = int(os.getenv("SUMMARY_RECENT_SYMPTOMS", "5"))
+OPEN_SYMPTOM_HOURS = int(os.getenv("SUMMARY_OPEN_SYMPTOM_HOURS", "72"))
+
+# Arreglo -> campo del resumen con su entrada más reciente
+LATEST_FIELDS = {
+    "vital_signs": "last_vital_sign",
+    "meals": "last_meal",
+    "medication_logs": "last_medication",
+}
+SYMPTOMS_FIELD = "recent_symptoms"
+SUMMARY_SOURCES = (*LATEST_FIELDS, "symptoms")
+
+SUMMARY_PROJECTION = {"summary": 1, "revision": 1}
+
+
+def _latest(field: str, entry: dict) -> dict:
+    return {"at": entry[DATETIME_FIELDS[field]], "id": entry["id"], "entry": entry}
+
+
+def push_update(entries_by_field: dict) -> dict:
+    """Operadores que agregan al resumen las entradas nuevas ({campo: [entradas]})."""
+    update = {}
+    for field, entries in entries_by_field.items():
+        if not entries:
+            continue
+        if field in LATEST_FIELDS:
+            # Una misma tanda puede traer fechas con zona (`...Z`) y sin ella
+            newest = max(entries, key=lambda entry: (buckets.utc_naive(entry[DATETIME_FIELDS[field]]), entry["id"]))
+            update.setdefault("$max", {})[f"summary.{LATEST_FIELDS[field]}"] = _latest(field, newest)
+        elif field == "symptoms":
+            update.setdefault("$push", {})[f"summary.{SYMPTOMS_FIELD}"] = {
+                "$each": entries, "$sort": {"datetime": -1, "id": -1}, "$slice": RECENT_SYMPTOMS,
+            }
+    return update
+
+
+def summary_document(arrays: dict) -> dict:
+    """Resumen completo a partir de los arreglos en orden cronológico (paciente nuevo con entradas iniciales)."""
+    document = {name: _latest(field, arrays[field][-1]) for field, name in LATEST_FIELDS.items() if arrays.get(field)}
+    if arrays.get("symptoms"):
+        document[SYMPTOMS_FIELD] = arrays["symptoms"][::-1][:RECENT_SYMPTOMS]
+    return document
+
+
+def recompute_stage(field: str, arreglo=None) -> dict:
+    """
+    $set de pipeline que recalcula la parte del resumen que depende de `field` a partir del
+    arreglo en orden cronológico (por defecto el propio campo, ya ordenado por la etapa previa).
+    Vacío si el resumen no usa ese arreglo.
+    """
+    arreglo = arreglo or f"${field}"
+    if field in LATEST_FIELDS:
+        return {f"summary.{LATEST_FIELDS[field]}": {
+            "$let": {
+                "vars": {"ultima": {"$last": arreglo}},
+                "in": {"at": f"$$ultima.{DATETIME_FIELDS[field]}", "id": "$$ultima.id", "entry": "$$ultima"},
+            }
+        }}
+    if field == "symptoms":
+        return {f"summary.{SYMPTOMS_FIELD}": {"$slice": [{"$reverseArray": arreglo}, RECENT_SYMPTOMS]}}
+    return {}
+
+
+def replace_stage(field: str, entry: dict) -> dict:
+    """
+    $set de pipeline que reemplaza en el resumen la versión anterior de `entry` (mismo id), para
+    los PUT sobre entradas archivadas, que no están en el arreglo desde el que se recalcula.
+    """
+    if field in LATEST_FIELDS:
+        actual = f"$summary.{LATEST_FIELDS[field]}"
+        return {f"summary.{LATEST_FIELDS[field]}": {
+            "$cond": [{"$eq": [f"{actual}.id", entry["id"]]}, {"$literal": _latest(field, entry)}, actual],
+        }}
+    if field == "symptoms":
+        reemplazadas = {"$map": {
+            "input": {"$ifNull": [f"$summary.{SYMPTOMS_FIELD}", []]},
+            "as": "s",
+            "in": {"$cond": [{"$eq": ["$$s.id", entry["id"]]}, {"$literal": entry}, "$$s"]},
+        }}
+        return {f"summary.{SYMPTOMS_FIELD}": {"$sortArray": {"input": reemplazadas, "sortBy": {"datetime": -1, "id": -1}}}}
+    return {}
+
+
+def summary_from_entries(field: str, newest_first: list) -> dict:
+    """$set del resumen de `field` a partir de sus entradas más recientes (modo buckets)."""
+    if field in LATEST_FIELDS:
+        key = f"summary.{LATEST_FIELDS[field]}"
+        return {"$set": {key: _latest(field, newest_first[0])}} if newest_first else {"$unset": {key: ""}}
+    if field == "symptoms":
+        return {"$set": {f"summary.{SYMPTOMS_FIELD}": newest_first[:RECENT_SYMPTOMS]}}
+    return {}
+
+
+async def bucket_summary_update(patient_id: ObjectId, field: str) -> dict:
+    """Resumen de `field` leído de los buckets, para los PUT en modo buckets."""
+    if field not in SUMMARY_SOURCES:
+        return {}
+    limit = RECENT_SYMPTOMS if field == "symptoms" else 1
+    return summary_from_entries(field, await buckets.find_entries(patient_id, field, limit=limit))
+
+
+def open_since() -> datetime:
+    """Fecha desde la que un síntoma se considera abierto (UTC sin zona, como las guarda PyMongo)."""
+    return datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=OPEN_SYMPTOM_HOURS)
+
+
+async def find_summaries(patient_ids: list) -> dict:
+    """{_id: documento con summary y revision} de los pacientes que existen."""
+    cursor = db_client.conectacare.patient.find({"_id": {"$in": patient_ids}}, SUMMARY_PROJECTION)
+    return {patient["_id"]: patient async for patient in cursor}
+
+
+async def rebuild_all() -> int:
+    """
+    Recalcula el resumen de todos los pacientes e incrementa su revisión, así los ETag de
+    /summary cambian y los clientes no siguen recibiendo 304 con el resumen anterior.
+    Devuelve la cantidad de pacientes actualizados.
+    """
+    patients = db_client.conectacare.patient
+
+    if not buckets.BUCKETS_ENABLED:
+        # Dentro de MongoDB, un update por arreglo; se ordena por si los datos no pasaron por app.db.sort_arrays
+        con_entradas = {"$or": [{f"{field}.0": {"$exists": True}} for field in SUMMARY_SOURCES]}
+        total = await patients.count_documents(con_entradas)
+        for field in SUMMARY_SOURCES:
+            ordenado = {"$sortArray": {"input": f"${field}", "sortBy": {DATETIME_FIELDS[field]: 1, "id": 1}}}
+            await patients.update_many(
+                {f"{field}.0": {"$exists": True}},
+                [{"$set": {**recompute_stage(field, ordenado), "revision": {"$add": [{"$ifNull": ["$revision", 0]}, 1]}}}],
+            )
+        return total
+
+    total = 0
+    async for patient in patients.find({}, {"_id": 1}):
+        update = {"$inc": {"revision": 1}}
+        for field in SUMMARY_SOURCES:
+            for op, values in (await bucket_summary_update(patient["_id"], field)).items():
+                update.setdefault(op, {}).update(values)
+        await patients.update_one({"_id": patient["_id"]}, update)
+        total += 1
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recalcula el resumen de último estado de todos los pacientes")
+    parser.parse_args()
+
+    print(f"Resumen recalculado para {asyncio.run(rebuild_all())} pacientes")
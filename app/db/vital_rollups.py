@@ -0,0 +1,300 @@
+"""
+Agregados de signos vitales por paciente y período (día o semana) para los gráficos.
+
+Cada documento de la colección `vital_rollup` resume las lecturas de un período:
+
+    {"patient_id": ObjectId, "granularity": "day", "period": datetime(2025, 6, 8), "count": 4,
+     "daily_weight": {"sum": 280, "min": 69, "max": 71}, "systolic": {...}, "diastolic": {...},
+     "heart_rate": {...}}
+
+Los POST de signos vitales (uno o en batch) actualizan los períodos de forma incremental con
+$inc/$min/$max. Un PUT puede cambiar o mover una lectura y el mínimo/máximo no se pueden
+"deshacer", así que recalcula solo los períodos de la fecha anterior y la nueva de esa
+lectura, leyendo las lecturas de esas semanas. El recálculo usa NumPy (agrupa por período con
+reduceat) y también está como CLI para reconstruir todo:
+
+    python -m app.db.vital_rollups                 # todos los pacientes
+    python -m app.db.vital_rollups --patient-id <ObjectId>
+
+GET /patients/{patient_id}/vital_signs/stats lee solo estos documentos: el costo depende de la
+cantidad de períodos y no de la cantidad de lecturas.
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+import numpy as np
+from bson import ObjectId
+from pymongo import ASCENDING, DeleteMany, DeleteOne, ReplaceOne, UpdateOne
+from app.db.client import db_client
+from app.db import archive, buckets
+
+GRANULARITIES = ("day", "week")
+
+# Métrica del agregado -> ruta dentro de la lectura
+VITAL_METRICS = {
+    "daily_weight": ("daily_weight",),
+    "systolic": ("blood_pressure", "systolic"),
+    "diastolic": ("blood_pressure", "diastolic"),
+    "heart_rate": ("heart_rate",),
+}
+
+
+def rollup_collection():
+    return db_client.conectacare.vital_rollup
+
+
+def period_start(value: datetime, granularity: str) -> datetime:
+    """Inicio del período (medianoche UTC; las semanas empiezan el lunes)."""
+    day = buckets.bucket_day(value)
+    if granularity == "week":
+        day = datetime.fromordinal(day.toordinal() - day.weekday())
+    return day
+
+
+def _reading_values(entry: dict):
+    """Valores de las cuatro métricas de una lectura, o None si le falta alguna."""
+    valores = []
+    for path in VITAL_METRICS.values():
+        value = entry
+        for key in path:
+            value = value.get(key) if isinstance(value, dict) else None
+        if not isinstance(value, (int, float)):
+            return None
+        valores.append(value)
+    return valores
+
+
+def compute_rollups(patient_id: ObjectId, entries: list, granularity: str) -> list:
+    """
+    Agregados de `entries` (lecturas de signos vitales) por período, vectorizado con NumPy:
+    se ordenan las lecturas por período y cada suma/mín/máx sale de un reduceat por columna.
+    """
+    fechas, valores = [], []
+    for entry in entries:
+        reading = _reading_values(entry)
+        if reading is None or entry.get("datetime") is None:
+            continue
+        fechas.append(buckets.utc_naive(entry["datetime"]))
+        valores.append(reading)
+    if not fechas:
+        return []
+
+    days = np.array(fechas, dtype="datetime64[D]")
+    if granularity == "week":
+        # datetime64[W] cuenta semanas desde el jueves 1970-01-01; se corre 3 días para empezar en lunes
+        days = (days + 3).astype("datetime64[W]").astype("datetime64[D]") - 3
+    values = np.array(valores, dtype=np.float64)
+
+    order = np.argsort(days, kind="stable")
+    days, values = days[order], values[order]
+    periods, starts, counts = np.unique(days, return_index=True, return_counts=True)
+
+    sums = np.add.reduceat(values, starts, axis=0)
+    mins = np.minimum.reduceat(values, starts, axis=0)
+    maxs = np.maximum.reduceat(values, starts, axis=0)
+
+    docs = []
+    for i, period in enumerate(periods.astype("datetime64[ms]").tolist()):
+        doc = {"patient_id": patient_id, "granularity": granularity, "period": period, "count": int(counts[i])}
+        for j, metric in enumerate(VITAL_METRICS):
+            doc[metric] = {"sum": float(sums[i, j]), "min": float(mins[i, j]), "max": float(maxs[i, j])}
+        docs.append(doc)
+    return docs
+
+
+def rollup_updates(patient_id: ObjectId, entries: list) -> list:
+    """Updates incrementales ($inc de conteo y sumas, $min/$max) para agregar lecturas nuevas."""
+    ops = []
+    for granularity in GRANULARITIES:
+        for doc in compute_rollups(patient_id, entries, granularity):
+            update = {"$inc": {"count": doc["count"]}, "$min": {}, "$max": {}}
+            for metric in VITAL_METRICS:
+                update["$inc"][f"{metric}.sum"] = doc[metric]["sum"]
+                update["$min"][f"{metric}.min"] = doc[metric]["min"]
+                update["$max"][f"{metric}.max"] = doc[metric]["max"]
+            ops.append(UpdateOne(
+                {"patient_id": patient_id, "granularity": granularity, "period": doc["period"]},
+                update,
+                upsert=True,
+            ))
+    return ops
+
+
+async def apply_updates(ops: list) -> None:
+    if ops:
+        await rollup_collection().bulk_write(ops, ordered=False)
+
+
+async def add_readings(patient_id: ObjectId, entries: list) -> None:
+    """Suma lecturas nuevas a los agregados del paciente."""
+    await apply_updates(rollup_updates(patient_id, entries))
+
+
+async def load_readings(patient_id: ObjectId) -> list:
+    if buckets.BUCKETS_ENABLED:
+        return await buckets.find_entries(patient_id, "vital_signs")
+    patient = await db_client.conectacare.patient.find_one({"_id": patient_id}, {"vital_signs": 1, "archived_before": 1})
+    if patient is None:
+        return []
+    await archive.merge_archived(patient, ("vital_signs",)) # las lecturas archivadas siguen contando en las estadísticas
+    return patient.get("vital_signs", [])
+
+
+async def reading_date(patient_id: ObjectId, entry_id: ObjectId):
+    """Fecha actual de la lectura caliente `entry_id`, o None si no está en el arreglo (la de una archivada la devuelve archive.set_entry)."""
+    if buckets.BUCKETS_ENABLED:
+        entry = await buckets.find_entry(patient_id, "vital_signs", entry_id)
+    else:
+        patient = await db_client.conectacare.patient.find_one(
+            {"_id": patient_id}, {"vital_signs": {"$elemMatch": {"id": entry_id}}}
+        )
+        entry = (patient or {}).get("vital_signs", [None])[0]
+    return entry.get("datetime") if entry else None
+
+
+async def load_readings_between(patient_id: ObjectId, date_from: datetime, date_to: datetime) -> list:
+    """Lecturas del paciente con fecha en [date_from, date_to), incluidas las archivadas."""
+    if buckets.BUCKETS_ENABLED:
+        return await buckets.find_entries(patient_id, "vital_signs", date_from, date_to)
+    cursor = await db_client.conectacare.patient.aggregate([
+        {"$match": {"_id": patient_id}},
+        {"$project": {"archived_before": 1, "vital_signs": {"$filter": {
+            "input": {"$ifNull": ["$vital_signs", []]},
+            "as": "e",
+            "cond": {"$and": [{"$gte": ["$$e.datetime", date_from]}, {"$lt": ["$$e.datetime", date_to]}]},
+        }}}},
+    ])
+    patient = next(iter(await cursor.to_list(1)), None)
+    if patient is None:
+        return []
+    readings = patient["vital_signs"]
+    if archive.reaches_archive(patient.get("archived_before"), date_from):
+        readings += await archive.find_entries(patient_id, "vital_signs", date_from, date_to)
+    return readings
+
+
+async def update_periods(patient_id: ObjectId, fechas) -> None:
+    """
+    Recalcula solo los períodos (día y semana) que contienen `fechas`, p. ej. la fecha anterior
+    y la nueva de una lectura editada. Lee las lecturas de cada semana involucrada una sola vez.
+    """
+    dias = {period_start(buckets.utc_naive(fecha), "day") for fecha in fechas if fecha is not None}
+    semanas = {period_start(dia, "week") for dia in dias}
+
+    ops = []
+    for semana in sorted(semanas):
+        entries = await load_readings_between(patient_id, semana, semana + timedelta(days=7))
+        periodos = {"week": {semana}, "day": {dia for dia in dias if period_start(dia, "week") == semana}}
+        for granularity, periods in periodos.items():
+            docs = {doc["period"]: doc for doc in compute_rollups(patient_id, entries, granularity)}
+            for period in periods:
+                clave = {"patient_id": patient_id, "granularity": granularity, "period": period}
+                ops.append(ReplaceOne(clave, docs[period], upsert=True) if period in docs else DeleteOne(clave))
+    await apply_updates(ops)
+
+
+def rebuild_operations(patient_id: ObjectId, entries: list) -> list:
+    """Reemplaza los agregados del paciente por los recalculados y borra los períodos que ya no tienen lecturas."""
+    ops = []
+    for granularity in GRANULARITIES:
+        docs = compute_rollups(patient_id, entries, granularity)
+        ops += [
+            ReplaceOne({"patient_id": patient_id, "granularity": granularity, "period": doc["period"]}, doc, upsert=True)
+            for doc in docs
+        ]
+        ops.append(DeleteMany({"patient_id": patient_id, "granularity": granularity,
+                               "period": {"$nin": [doc["period"] for doc in docs]}}))
+    return ops
+
+
+async def rebuild_patient(patient_id: ObjectId) -> None:
+    """
+    Recalcula los agregados de un paciente desde sus lecturas. Se hace con upserts y no
+    borrando todo primero, así un GET de estadísticas concurrente nunca ve el paciente vacío.
+    """
+    await rollup_collection().bulk_write(rebuild_operations(patient_id, await load_readings(patient_id)))
+
+
+async def iter_patient_readings():
+    """(patient_id, lecturas) de todos los pacientes con signos vitales, recorriendo un solo cursor."""
+    if not buckets.BUCKETS_ENABLED:
+        con_lecturas = {"$or": [{"vital_signs.0": {"$exists": True}}, {"archived_before": {"$exists": True}}]}
+        async for patient in db_client.conectacare.patient.find(con_lecturas, {"vital_signs": 1, "archived_before": 1}):
+            await archive.merge_archived(patient, ("vital_signs",))
+            if patient.get("vital_signs"):
+                yield patient["_id"], patient["vital_signs"]
+        return
+
+    # En modo buckets los buckets de cada paciente llegan seguidos gracias al orden por patient_id
+    actual, lecturas = None, []
+    cursor = buckets.bucket_collection().find({"type": "vital_signs"}, {"patient_id": 1, "entries": 1}).sort("patient_id", ASCENDING)
+    async for bucket in cursor:
+        if bucket["patient_id"] != actual:
+            if actual is not None:
+                yield actual, lecturas
+            actual, lecturas = bucket["patient_id"], []
+        lecturas.extend(bucket.get("entries", []))
+    if actual is not None:
+        yield actual, lecturas
+
+
+async def rebuild_all() -> int:
+    pacientes = 0
+    async for patient_id, entries in iter_patient_readings():
+        await rollup_collection().bulk_write(rebuild_operations(patient_id, entries))
+        pacientes += 1
+    return pacientes
+
+
+async def find_rollups(patient_id: ObjectId, granularity: str, date_from=None, date_to=None) -> list:
+    query = {"patient_id": patient_id, "granularity": granularity}
+    periodo = {}
+    if date_from is not None:
+        periodo["$gte"] = period_start(date_from, granularity)
+    if date_to is not None:
+        periodo["$lt"] = buckets.utc_naive(date_to)
+    if periodo:
+        query["period"] = periodo
+    return await rollup_collection().find(query, {"_id": 0, "patient_id": 0, "granularity": 0}).sort("period", ASCENDING).to_list()
+
+
+def rollup_stats(docs: list) -> dict:
+    """
+    min/mean/max por período y tendencia lineal de cada métrica (pendiente de los promedios
+    por día, ajustada con mínimos cuadrados sobre los períodos devueltos).
+    """
+    periods = []
+    for doc in docs:
+        item = {"period": doc["period"], "count": doc["count"]}
+        for metric in VITAL_METRICS:
+            item[metric] = {
+                "min": doc[metric]["min"],
+                "mean": doc[metric]["sum"] / doc["count"],
+                "max": doc[metric]["max"],
+            }
+        periods.append(item)
+
+    trend = {metric: None for metric in VITAL_METRICS}
+    if len(periods) >= 2:
+        x = np.array([doc["period"] for doc in docs], dtype="datetime64[s]").astype(np.float64) / 86400
+        for metric in VITAL_METRICS:
+            y = np.array([item[metric]["mean"] for item in periods])
+            trend[metric] = round(float(np.polyfit(x - x[0], y, 1)[0]), 6)
+
+    return {"periods": periods, "trend_per_day": trend}
+
+
+async def main(args):
+    if args.patient_id:
+        await rebuild_patient(ObjectId(args.patient_id))
+        print(f"Agregados de {args.patient_id} recalculados")
+    else:
+        print(f"Agregados recalculados para {await rebuild_all()} pacientes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recalcula los agregados de signos vitales")
+    parser.add_argument("--patient-id", help="Solo este paciente")
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
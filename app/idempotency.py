@@ -0,0 +1,169 @@
+"""
+Soporte del header `Idempotency-Key` en los POST (crear paciente, caretaker y actividades).
+
+Con Wi-Fi inestable las tablets reintentan los POST y cada reintento creaba una entrada
+duplicada. Si el POST trae `Idempotency-Key`, la primera petición reserva la clave en la
+colección `idempotency_key` y, al terminar, guarda ahí su respuesta; los reintentos con la
+misma clave reciben esa respuesta guardada (con el header `Idempotent-Replayed: true`) sin
+volver a ejecutar el handler ni escribir en el paciente.
+
+- Solo se aplica a los POST que crean (IDEMPOTENT_ROUTES): los de consulta como
+  `/patients:batchGet` pasan de largo, así una clave repetida no devuelve datos viejos.
+- Las claves son por ruta: la misma clave en otra URL es otra operación.
+- La clave se reusa con otro cuerpo -> 422. Llega mientras la original sigue en curso -> 409.
+- Las respuestas 5xx no se guardan: la clave se libera para que el cliente pueda reintentar.
+- La reserva lleva `leased_at`: si el proceso muere o la petición se corta antes de guardar la
+  respuesta, después de IDEMPOTENCY_LEASE segundos un reintento con el mismo cuerpo toma la
+  clave y ejecuta el handler, en lugar de recibir 409 hasta que venza el TTL.
+- Un índice TTL (app/db/indexes.py) borra las claves después de IDEMPOTENCY_TTL segundos.
+- Delante de MongoDB hay un LRU en el proceso (IDEMPOTENCY_CACHE_SIZE) con las respuestas
+  ya terminadas, así una ráfaga de reintentos no consulta la base en cada uno.
+"""
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from pymongo.errors import DuplicateKeyError
+from starlette.routing import compile_path
+from app.db.client import db_client
+from app.db.indexes import IDEMPOTENCY_TTL
+from app.db.models.activity import ACTIVITY_FIELDS
+
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_LEASE = float(os.getenv("IDEMPOTENCY_LEASE", "30"))
+
+# Plantillas de los POST que crean algo (paciente, caretaker, actividades sueltas y por lotes)
+IDEMPOTENT_ROUTES = (
+    "/patients/",
+    "/caretakers/",
+    "/patients/activities:batch",
+    "/patients/{patient_id}/activities:batch",
+    *(f"/patients/{{patient_id}}/{field}" for field in ACTIVITY_FIELDS),
+)
+IDEMPOTENT_PATHS = [compile_path(route)[0] for route in IDEMPOTENT_ROUTES]
+
+# Headers de la respuesta original que se repiten en los reintentos
+REPLAYED_HEADERS = ("content-type", "etag", "location")
+
+
+def idempotency_collection():
+    return db_client.conectacare.idempotency_key
+
+
+class ResponseLRU:
+    """Respuestas terminadas por clave, con vencimiento igual al TTL de la colección."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry["expira"] < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry["record"]
+
+    def put(self, key: str, record: dict):
+        self._entries[key] = {"expira": time.monotonic() + self.ttl, "record": record}
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+recent_responses = ResponseLRU(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL)
+
+
+def lease_expired(record: dict) -> bool:
+    """True si la reserva "pending" lleva más de IDEMPOTENCY_LEASE segundos sin terminar."""
+    leased_at = record.get("leased_at") or record["created_at"]
+    if leased_at.tzinfo is None:  # PyMongo devuelve las fechas en UTC sin tzinfo
+        leased_at = leased_at.replace(tzinfo=timezone.utc)
+    return leased_at < datetime.now(timezone.utc) - timedelta(seconds=IDEMPOTENCY_LEASE)
+
+
+async def take_over(scoped_key: str, record: dict) -> bool:
+    """Toma una reserva vencida. Solo uno de varios reintentos simultáneos lo logra."""
+    result = await idempotency_collection().update_one(
+        {"_id": scoped_key, "status": "pending", "leased_at": record.get("leased_at")},
+        {"$set": {"leased_at": datetime.now(timezone.utc)}},
+    )
+    return result.modified_count == 1
+
+
+def replay(record: dict) -> Response:
+    headers = dict(record.get("headers", {}))
+    headers["Idempotent-Replayed"] = "true"
+    return Response(content=record["body"], status_code=record["status_code"], headers=headers)
+
+
+async def idempotency_middleware(request: Request, call_next):
+    key = request.headers.get("idempotency-key")
+    if request.method != "POST" or not key or not any(path.match(request.url.path) for path in IDEMPOTENT_PATHS):
+        return await call_next(request)
+
+    scoped_key = f"{request.url.path} {key}"
+    fingerprint = hashlib.sha256(await request.body()).hexdigest()
+
+    record = recent_responses.get(scoped_key)
+    if record is None:
+        ahora = datetime.now(timezone.utc)
+        try:
+            await idempotency_collection().insert_one({
+                "_id": scoped_key,
+                "fingerprint": fingerprint,
+                "status": "pending",
+                "created_at": ahora,
+                "leased_at": ahora,
+            })
+        except DuplicateKeyError:
+            record = await idempotency_collection().find_one({"_id": scoped_key})
+            if record is None:  # venció justo entre el insert y la lectura
+                return JSONResponse(status_code=409, content={"detail": "Idempotency-Key en uso, reintentar"})
+            if record["status"] == "pending":
+                if not lease_expired(record):
+                    return JSONResponse(status_code=409, content={"detail": "Hay una petición en curso con esta Idempotency-Key"})
+                if record["fingerprint"] != fingerprint:
+                    return JSONResponse(status_code=422, content={"detail": "Idempotency-Key reutilizada con otro cuerpo"})
+                # La petición original no terminó (proceso caído o conexión cortada): este reintento la reemplaza
+                if not await take_over(scoped_key, record):
+                    return JSONResponse(status_code=409, content={"detail": "Hay una petición en curso con esta Idempotency-Key"})
+                record = None
+            else:
+                recent_responses.put(scoped_key, record)
+
+    if record is not None:
+        if record["fingerprint"] != fingerprint:
+            return JSONResponse(status_code=422, content={"detail": "Idempotency-Key reutilizada con otro cuerpo"})
+        return replay(record)
+
+    # Primera vez que se ve la clave: se ejecuta el handler y se guarda su respuesta
+    try:
+        response = await call_next(request)
+    except Exception:
+        await idempotency_collection().delete_one({"_id": scoped_key})
+        raise
+
+    if response.status_code >= 500:
+        await idempotency_collection().delete_one({"_id": scoped_key})
+        return response
+
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    record = {
+        "fingerprint": fingerprint,
+        "status": "done",
+        "status_code": response.status_code,
+        "headers": {name: value for name, value in response.headers.items() if name in REPLAYED_HEADERS},
+        "body": body,
+    }
+    await idempotency_collection().update_one({"_id": scoped_key}, {"$set": record})
+    recent_responses.put(scoped_key, record)
+
+    return Response(content=body, status_code=response.status_code, headers=dict(response.headers))
@@ -1,11 +1,59 @@
 from fastapi import FastAPI, Request
-from fastapi.responses import Response
+from fastapi.responses import Response, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.routers import caretakers, patients
+from app.db.indexes import ensure_indexes, missing_unique_indexes, print_report
+from app.db.client import db_client
+from app.db.coalescer import WriteQueueFull
+from app.db.queries import write_coalescer
+from app.idempotency import idempotency_middleware
+from app.metrics import metrics_summary, metrics_registry, mark_worker_dead
+from pymongo.errors import PyMongoError
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from starlette.routing import Match
+from contextlib import asynccontextmanager
+import os
 import time
 
-app = FastAPI()  # Inicializamos FastAPI
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Cliente de MongoDB con la configuración MONGO_* (pool, timeouts, compresión; ver app/db/client.py).
+    # El ping abre las primeras conexiones del pool antes de recibir tráfico.
+    await db_client.connect()
+    try:
+        await db_client.ping()
+    except Exception as e:
+        print(f"MongoDB no respondió al arrancar: {str(e) or type(e).__name__}")
+
+    # Reconciliamos los índices declarados en app/db/indexes.py (idempotente).
+    # Se puede desactivar con CREATE_INDEXES_ON_STARTUP=false y usar `python -m app.db.indexes`.
+    if os.getenv("CREATE_INDEXES_ON_STARTUP", "true").lower() != "false":
+        try:
+            print_report(await ensure_indexes())
+        except Exception as e:
+            print(f"No se pudieron verificar los índices: {e}")
+
+    # Los duplicados de paciente y caretaker solo se detectan con los índices únicos: sin ellos no se arranca
+    try:
+        faltantes = await missing_unique_indexes()
+    except PyMongoError as e:
+        faltantes = None
+        print(f"No se pudieron verificar los índices únicos: {e}")
+    if faltantes:
+        raise RuntimeError(f"Faltan índices únicos o no coinciden con su definición: {', '.join(faltantes)} (ver `python -m app.db.indexes`)")
+    yield
+    if write_coalescer is not None:
+        await write_coalescer.close()
+    await db_client.close()
+    mark_worker_dead()
+
+
+app = FastAPI(lifespan=lifespan)  # Inicializamos FastAPI
+
+# Idempotency-Key en los POST: los reintentos reciben la respuesta original sin volver a escribir.
+# Se registra antes que CORS para que las respuestas repetidas también lleven los headers de CORS.
+app.middleware("http")(idempotency_middleware)
 
 # Configuración de CORS (esto debe estar antes de incluir los routers)
 origins = [
@@ -20,8 +68,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],          # Métodos permitidos (GET, POST, etc.)
     allow_headers=["*"],          # Encabezados permitidos
+    expose_headers=["X-Next-Cursor", "ETag", "Idempotent-Replayed"],  # Cursor de paginación, ETag de los GET de pacientes y reintentos idempotentes
 )
 
+# Con WRITE_COALESCING la cola de escrituras agrupadas tiene un tope; al llenarse se pide reintentar
+@app.exception_handler(WriteQueueFull)
+async def write_queue_full_handler(request: Request, exc: WriteQueueFull):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
 # Routers
 app.include_router(caretakers.router)
 app.include_router(patients.router)
@@ -39,107 +93,62 @@ EXCEPTIONS_COUNT = Counter(
     "http_exceptions_total", "Conteo de excepciones por endpoint", ["method", "endpoint"]
 )
 
+# Etiqueta para las peticiones que no coinciden con ninguna ruta (404), para no crear una serie por URL
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+def route_template(request: Request) -> str:
+    # FastAPI deja la ruta que hizo match en el scope; usamos su plantilla (p. ej. /patients/{patient_id}/meals)
+    # y no la URL real, así cada patient_id o log_id no crea una serie nueva en Prometheus.
+    route = request.scope.get("route")
+    if route is None:
+        # Las respuestas que idempotency_middleware devuelve antes del ruteo (reintentos, 409, 422)
+        # no pasan por el router: se busca la ruta igual que él para contarlas en su endpoint
+        route = next((r for r in request.app.router.routes if r.matches(request.scope)[0] == Match.FULL), None)
+    return getattr(route, "path", UNMATCHED_ROUTE)
+
+
 @app.middleware("http")
 async def metrics_middleware(request: Request, call_next):
-    start_time = time.time()
+    start_time = time.perf_counter()
     method = request.method
-    endpoint = request.url.path
 
     try:
         response = await call_next(request)
         status_code = response.status_code
     except Exception:
-        EXCEPTIONS_COUNT.labels(method=method, endpoint=endpoint).inc()
+        EXCEPTIONS_COUNT.labels(method=method, endpoint=route_template(request)).inc()
         status_code = 500
         raise
 
-    duration = time.time() - start_time
+    duration = time.perf_counter() - start_time
+    endpoint = route_template(request)
     REQUEST_COUNT.labels(method=method, endpoint=endpoint, http_status=status_code).inc()
     REQUEST_LATENCY.labels(method=method, endpoint=endpoint).observe(duration)
 
     return response
 
 
-@app.get("/metrics")
-def metrics():
-    raw_metrics = generate_latest().decode('utf-8')
-    resumen = {}
-
-    for line in raw_metrics.splitlines():
-        if line.startswith("http_requests_total{"):
-            # Extraemos método, endpoint y valor
-            partes = line.split()
-            labels_part = partes[0]
-            count = float(partes[1])
-
-            # Extraer método y endpoint con parsing básico
-            method = labels_part.split('method="')[1].split('"')[0]
-            endpoint = labels_part.split('endpoint="')[1].split('"')[0]
-
-            key = (endpoint, method)
-            resumen[key] = resumen.get(key, 0) + count
-
-    resumen_str = "\n# === Resumen total de peticiones por endpoint y método ===\n"
-    for (endpoint, method), total in resumen.items():
-        resumen_str += f"# Endpoint: {endpoint}, Method: {method}, Total: {int(total)}\n"
-
-    # Resumen de latencias
-    latencias = {}
-    counts = {}
-
-    for line in raw_metrics.splitlines():
-        if line.startswith("http_request_duration_seconds_sum{"):
-            parts = line.split()
-            labels_part = parts[0]
-            total_time = float(parts[1])
-
-            method = labels_part.split('method="')[1].split('"')[0]
-            endpoint = labels_part.split('endpoint="')[1].split('"')[0]
-
-            latencias[(endpoint, method)] = total_time
-
-        elif line.startswith("http_request_duration_seconds_count{"):
-            parts = line.split()
-            labels_part = parts[0]
-            count = float(parts[1])
-
-            method = labels_part.split('method="')[1].split('"')[0]
-            endpoint = labels_part.split('endpoint="')[1].split('"')[0]
-
-            counts[(endpoint, method)] = count
-
-    latencia_str = "\n# === Latencia promedio por endpoint y método (en segundos) ===\n"
-    for key in latencias:
-        total_time = latencias.get(key, 0)
-        count = counts.get(key, 1)
-        promedio = total_time / count if count else 0
-        latencia_str += f"# Endpoint: {key[0]}, Method: {key[1]}, Promedio: {promedio:.4f} segundos\n"
-
-    # Resumen de errores
-
-    errores = {}
-
-    for line in raw_metrics.splitlines():
-        if line.startswith("http_exceptions_total{"):
-            parts = line.split()
-            labels_part = parts[0]
-            count = float(parts[1])
-
-            method = labels_part.split('method="')[1].split('"')[0]
-            endpoint = labels_part.split('endpoint="')[1].split('"')[0]
+@app.get("/health/ready")
+async def readiness():
+    # Listo para recibir tráfico solo si MongoDB responde un ping a través del pool
+    try:
+        await db_client.ping()
+    except Exception as e:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "detail": str(e) or type(e).__name__})
+    return {"status": "ready"}
 
-            errores[(endpoint, method)] = count
 
-    errores_str = "\n# === Errores totales por endpoint y método ===\n"
-    if errores:
-        for key, count in errores.items():
-            errores_str += f"# Endpoint: {key[0]}, Method: {key[1]}, Errores: {int(count)}\n"
-    else:
-        errores_str += "# No se registraron errores.\n"
+@app.get("/metrics")
+def metrics():
+    # Exposición Prometheus sin modificar; el resumen legible está en /metrics/summary
+    return Response(generate_latest(metrics_registry()), media_type=CONTENT_TYPE_LATEST)
 
 
-    # Devolver las métricas con el resumen y latencias
-    return Response(raw_metrics + "\n" + resumen_str + "\n" + latencia_str + "\n" + errores_str, media_type=CONTENT_TYPE_LATEST)
+@app.get("/metrics/summary")
+def metrics_summary_json():
+    # Totales, tasa de errores, latencia promedio y p50/p95/p99 por endpoint y método
+    return metrics_summary(metrics_registry())
 
 
 # uvicorn app.main:app --reload
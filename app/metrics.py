@@ -0,0 +1,115 @@
+"""
+Resumen de las métricas HTTP en JSON (GET /metrics/summary).
+
+Se arma recorriendo los collectors del registry de Prometheus directamente, sin generar ni
+parsear el texto de exposición. Por cada (endpoint, método) devuelve el total de peticiones,
+los errores (status >= 500 y excepciones), la latencia promedio y los percentiles p50/p95/p99
+estimados a partir de los buckets del histograma, con la misma interpolación lineal que
+`histogram_quantile` de Prometheus.
+
+Con varios workers (python -m app.serve) cada proceso tiene sus propios contadores; si
+PROMETHEUS_MULTIPROC_DIR está definido, prometheus_client los escribe en archivos de ese
+directorio y metrics_registry() los agrega, así /metrics y el resumen reflejan a todos los
+workers y no solo al que atiende el scrape.
+"""
+import math
+import os
+from prometheus_client import REGISTRY, CollectorRegistry, multiprocess
+
+PERCENTILES = {"p50": 0.50, "p95": 0.95, "p99": 0.99}
+
+
+def multiprocess_enabled() -> bool:
+    return bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+
+def metrics_registry():
+    """Registry a exponer: el del proceso o, en modo multiproceso, uno que agrega los archivos de todos los workers."""
+    if not multiprocess_enabled():
+        return REGISTRY
+    # Se arma en cada scrape: los archivos cambian mientras los workers atienden peticiones
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def mark_worker_dead():
+    """Limpieza al terminar un worker: descarta sus series de gauges en vivo (multiprocess_mode="live*")."""
+    if multiprocess_enabled():
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def histogram_quantile(q: float, buckets: list) -> float:
+    """
+    Percentil `q` a partir de los buckets acumulados [(le, conteo), ...] ordenados por `le`.
+    Si el percentil cae en el bucket +Inf se devuelve el límite del último bucket finito.
+    """
+    if not buckets or buckets[-1][1] == 0:
+        return None
+    rank = q * buckets[-1][1]
+    limite_anterior, conteo_anterior = 0.0, 0.0
+    for limite, conteo in buckets:
+        if conteo >= rank:
+            if math.isinf(limite):
+                return limite_anterior
+            if conteo == conteo_anterior:
+                return limite
+            return limite_anterior + (limite - limite_anterior) * (rank - conteo_anterior) / (conteo - conteo_anterior)
+        limite_anterior, conteo_anterior = limite, conteo
+    return limite_anterior
+
+
+def metrics_summary(registry=REGISTRY) -> dict:
+    rutas = {}
+
+    def ruta(labels):
+        key = (labels["endpoint"], labels["method"])
+        if key not in rutas:
+            rutas[key] = {"requests": 0, "errors": 0, "exceptions": 0, "latency_sum": 0.0,
+                          "latency_count": 0, "buckets": {}}
+        return rutas[key]
+
+    # Una sola pasada por los collectors; cada muestra se acumula según su nombre
+    for metric in registry.collect():
+        for sample in metric.samples:
+            if sample.name == "http_requests_total":
+                datos = ruta(sample.labels)
+                datos["requests"] += sample.value
+                if int(sample.labels["http_status"]) >= 500:
+                    datos["errors"] += sample.value
+            elif sample.name == "http_exceptions_total":
+                ruta(sample.labels)["exceptions"] += sample.value
+            elif sample.name == "http_request_duration_seconds_sum":
+                ruta(sample.labels)["latency_sum"] += sample.value
+            elif sample.name == "http_request_duration_seconds_count":
+                ruta(sample.labels)["latency_count"] += sample.value
+            elif sample.name == "http_request_duration_seconds_bucket":
+                buckets = ruta(sample.labels)["buckets"]
+                le = float(sample.labels["le"])
+                buckets[le] = buckets.get(le, 0) + sample.value
+
+    routes = []
+    totales = {"requests": 0, "errors": 0, "exceptions": 0}
+    for (endpoint, method), datos in sorted(rutas.items()):
+        buckets = sorted(datos["buckets"].items())
+        # Las excepciones no llegan a http_requests_total, así que se suman a los errores
+        errores = datos["errors"] + datos["exceptions"]
+        peticiones = datos["requests"] + datos["exceptions"]
+        latencia = {"mean": datos["latency_sum"] / datos["latency_count"] if datos["latency_count"] else None}
+        latencia.update({nombre: histogram_quantile(q, buckets) for nombre, q in PERCENTILES.items()})
+
+        routes.append({
+            "endpoint": endpoint,
+            "method": method,
+            "requests": int(peticiones),
+            "errors": int(errores),
+            "exceptions": int(datos["exceptions"]),
+            "error_rate": errores / peticiones if peticiones else 0.0,
+            "latency_seconds": latencia,
+        })
+        totales["requests"] += int(peticiones)
+        totales["errors"] += int(errores)
+        totales["exceptions"] += int(datos["exceptions"])
+
+    totales["error_rate"] = totales["errors"] / totales["requests"] if totales["requests"] else 0.0
+    return {"routes": routes, "totals": totales}
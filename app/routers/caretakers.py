@@ -1,8 +1,16 @@
-from fastapi import APIRouter, HTTPException
-from app.db.models.caretaker import Caretaker
+from fastapi import APIRouter, HTTPException, Query
+from typing import Optional
+from app.db.models.caretaker import Caretaker, CaretakerPublic
+from app.db.models.patient import PatientRosterEntry
 from app.db.client import db_client
-from app.db.schemas.caretaker import caretaker_schema, caretakers_schema
-from bson import ObjectId
+from app.db.queries import find_caretaker_patients, encode_cursor, decode_cursor
+from app.db.schemas.caretaker import caretaker_schema, caretaker_public_schema
+from app.db.schemas.patient import patients_roster_schema
+from app.serialization import FastJSONResponse, dumps
+from fastapi.responses import StreamingResponse
+from pymongo import ASCENDING
+from bson import ObjectId, errors as bson_errors
+from pymongo.errors import DuplicateKeyError
 
 # en este archivo deben ir los métodos para trabajar con la base de datos (get, post, put, delete)
 
@@ -13,43 +21,110 @@ router = APIRouter(prefix="/caretakers", tags=["caretakers"]) # Inicializamos la
 @router.post("/", response_model=Caretaker, status_code=201) # crear caretaker
 async def caretaker(user: Caretaker):
 
-    if type(search_caretakers(user.email)) == Caretaker: 
-        raise HTTPException(status_code=206, detail="El correo ya existe")
-
     user_dict = dict(user)
 
     del user_dict["id"] # eliminamos el id porque mongo lo asigna automáticamente
 
-    ide = db_client.conectacare.caretaker.insert_one(user_dict).inserted_id
+    try: # el índice único sobre `email` (app/db/indexes.py) detecta los correos duplicados
+        ide = (await db_client.conectacare.caretaker.insert_one(user_dict)).inserted_id
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="El correo ya existe")
 
-    new_user= caretaker_schema(db_client.conectacare.caretaker.find_one({"_id": ide}))
+    new_user= caretaker_schema(await db_client.conectacare.caretaker.find_one({"_id": ide}))
 
     return Caretaker(**new_user)
 
 
 
 
-@router.get("/", response_model=list[Caretaker]) # muestra todos los caretakers
-async def caretakers():
-    return caretakers_schema(db_client.conectacare.caretaker.find())
+# Campos que viajan en el listado; passwordHash nunca sale de la base
+CARETAKER_LIST_PROJECTION = {"name": 1, "email": 1, "role": 1}
+
+@router.get("/", response_model=list[CaretakerPublic]) # lista los caretakers, por páginas si se pide `limit`
+async def caretakers(
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Máximo de caretakers a devolver (por defecto, todos)"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página siguiente (header X-Next-Cursor)"),
+    role: Optional[str] = Query(None, description="Filtrar por rol"),
+):
+    """
+    Caretakers ordenados por _id. Con `limit` se paginan por keyset: la respuesta trae el header
+    X-Next-Cursor si hay más; sin `limit` se devuelven todos, como antes. La página se serializa a medida que llega del cursor de MongoDB
+    (StreamingResponse), sin armar la lista completa ni validarla con Pydantic.
+    """
+    query = {}
+    if role is not None:
+        query["role"] = role # usa el índice (role, _id)
+    if cursor:
+        try:
+            query["_id"] = {"$gt": decode_cursor(cursor, ObjectId)[0]}
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+
+    collection = db_client.conectacare.caretaker
+
+    # El header se envía antes que el cuerpo, así que el límite de la página se averigua con una
+    # consulta cubierta por el índice: solo los _id en las posiciones limit-1 y limit.
+    headers = {}
+    if limit is not None:
+        limites = await collection.find(query, {"_id": 1}).sort("_id", ASCENDING).skip(limit - 1).limit(2).to_list()
+        if len(limites) == 2:
+            headers["X-Next-Cursor"] = encode_cursor(limites[0]["_id"])
+
+    async def serializar():
+        yield b"["
+        primero = True
+        async for user in collection.find(query, CARETAKER_LIST_PROJECTION).sort("_id", ASCENDING).limit(limit or 0):
+            yield (b"" if primero else b",") + dumps(caretaker_public_schema(user))
+            primero = False
+        yield b"]"
+
+    return StreamingResponse(serializar(), media_type="application/json", headers=headers)
 
 @router.get("/{id}", response_model=Caretaker)
 async def caretakerid(id:str):
-    return search_caretakersid("_id", ObjectId(id))
-
-def search_caretakersid(field: str, key): # función para obtener un caretaker
+    return await search_caretakersid("_id", ObjectId(id))
+
+@router.get("/{id}/patients", response_model=list[PatientRosterEntry]) # pacientes asignados al caretaker
+async def caretaker_patients(
+    id: str,
+    limit: int = Query(100, ge=1, le=500, description="Máximo de pacientes a devolver"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página siguiente (header X-Next-Cursor)"),
+):
+    """
+    Listado liviano de los pacientes del caretaker (nombre, edad, últimos signos vitales y
+    última medicación) en una sola consulta por `caretakers_ids`, en lugar de pedir cada
+    paciente completo. Si hay más pacientes, la respuesta trae el header X-Next-Cursor.
+    """
     try:
-        duplicate = caretaker_schema(db_client.conectacare.caretaker.find_one({field: key}))
+        caretaker_id = ObjectId(id)
+    except bson_errors.InvalidId:
+        raise HTTPException(status_code=400, detail="Formato de id inválido")
+
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor, ObjectId)[0]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+
+    # Pedimos un paciente de más para saber si hay una página siguiente
+    patients = await find_caretaker_patients(caretaker_id, limit + 1, after)
+    if not patients and after is None and await db_client.conectacare.caretaker.find_one({"_id": caretaker_id}, {"_id": 1}) is None:
+        raise HTTPException(status_code=404, detail="Caretaker no encontrado")
+
+    headers = {}
+    if len(patients) > limit:
+        patients = patients[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(patients[-1]["_id"])
+
+    return FastJSONResponse(patients_roster_schema(patients), headers=headers)
+
+async def search_caretakersid(field: str, key): # función para obtener un caretaker
+    try:
+        duplicate = caretaker_schema(await db_client.conectacare.caretaker.find_one({field: key}))
         return Caretaker(**duplicate)
     except:
         return {"error": "no se ha encontrado el usuario getbyid"}
 
-
-def search_caretakers(email:str): # función para verificar emails duplicados
-    try:
-        duplicate = caretaker_schema(db_client.conectacare.caretaker.find_one({"email":email}))
-        return Caretaker(**duplicate)
-    except:
-        return {"error": "no se ha encontrado el usuario"}
     
     
\ No newline at end of file
@@ -1,13 +1,23 @@
-from fastapi import APIRouter, HTTPException, Body
+from fastapi import APIRouter, HTTPException, Body, Depends, Header, Query, Response
 from app.db.client import db_client
+from app.db import buckets, summary, vital_rollups
+from app.cache import cached
+from app.serialization import FastJSONResponse, dumps
+from app.db.export import export_chunks, export_filename, EXPORT_FORMATS
+from fastapi.responses import StreamingResponse
+from app.db.queries import find_activity_array, load_patient, patient_exists, patient_revision, push_activity, push_activities, push_activities_many, set_activity, iter_patients, find_activity_page, find_timeline_page, encode_cursor, decode_cursor, DATETIME_FIELDS
 from bson import ObjectId
 from datetime import datetime
 from bson import ObjectId, errors as bson_errors
+from pymongo.errors import DuplicateKeyError
 from app.db.schemas.activity import * 
 from app.db.schemas.patient import *
-from app.db.models.activity import MedicationLog, Meal, HygieneLog, VitalSigns, Symptom, MedicalHistoryEntry
-from app.db.models.patient import Patient
+from app.db.models.activity import MedicationLog, Meal, HygieneLog, VitalSigns, Symptom, MedicalHistoryEntry, ACTIVITY_FIELDS, ACTIVITY_MODELS
+from app.db.models.activity import ActivityBatch, ActivityBatchItem, ActivityBatchResult, ActivityBatchResponse
+from app.db.models.patient import Patient, PatientSummary, PatientIdsRequest, PatientSummaryBatch, PatientBatchGetRequest, PatientBatchGetResponse
 from datetime import datetime, date
+from typing import List, Optional
+from pydantic import ValidationError
 
 router = APIRouter(prefix="/patients", tags=["patients"])
 
@@ -16,10 +26,6 @@ router = APIRouter(prefix="/patients", tags=["patients"])
 
 async def create_patient(patient_data: Patient):
 
-    duplicated = search_duplicated(patient_data.document)
-    if isinstance(duplicated, Patient):
-        raise HTTPException(status_code=409, detail="El documento ya existe")
-
     patient_dict = dict(patient_data)
     del patient_dict["id"]
 
@@ -31,34 +37,158 @@ async def create_patient(patient_data: Patient):
     if "caretakers_ids" in patient_dict:
         patient_dict["caretakers_ids"] = [ObjectId(cid) for cid in patient_dict["caretakers_ids"]]
 
-    ide = db_client.conectacare.patient.insert_one(patient_dict).inserted_id
-    new_patient = patient_schema(db_client.conectacare.patient.find_one({"_id": ide}))
+    # Las entradas iniciales se guardan como dicts con su propio id, igual que las de los POST
+    actividades = {
+        field: [dict(entry.dict(), id=ObjectId()) for entry in patient_dict.pop(field)]
+        for field in ACTIVITY_FIELDS
+    }
+    if not buckets.BUCKETS_ENABLED: # embebidas, en orden cronológico (ver queries.ARRAYS_SORTED) y con su resumen
+        for field, entries in actividades.items():
+            patient_dict[field] = sorted(entries, key=lambda entry: (buckets.utc_naive(entry[DATETIME_FIELDS[field]]), entry["id"]))
+        patient_dict["summary"] = summary.summary_document(patient_dict)
+
+    # El índice único sobre `document` (app/db/indexes.py) detecta los duplicados sin carreras
+    try:
+        ide = (await db_client.conectacare.patient.insert_one(patient_dict)).inserted_id
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="El documento ya existe")
+
+    # En modo buckets las actividades no se embeben en el paciente, van a su propia colección
+    if buckets.BUCKETS_ENABLED and any(actividades.values()):
+        await push_activities(ide, {field: entries for field, entries in actividades.items() if entries})
+    elif actividades["vital_signs"]:
+        await vital_rollups.add_readings(ide, actividades["vital_signs"]) # los signos vitales iniciales también cuentan para las estadísticas
+
+    new_patient = patient_schema(await load_patient(ide))
     return Patient(**new_patient)
 
 
-def search_duplicated(document: int):
-    patient_found = db_client.conectacare.patient.find_one({"document": document})
-    if patient_found:
-        return Patient(**patient_schema(patient_found))
-    return None
+class ActivityLogFilters: # filtros opcionales de los GET de actividades, se inyecta con Depends()
+    def __init__(
+        self,
+        date_from: Optional[datetime] = Query(None, alias="from", description="Fecha inicial (inclusiva) en ISO 8601"),
+        date_to: Optional[datetime] = Query(None, alias="to", description="Fecha final (exclusiva) en ISO 8601"),
+        limit: Optional[int] = Query(None, ge=1, le=500, description="Máximo de registros a devolver"),
+        cursor: Optional[str] = Query(None, description="Cursor de la página siguiente (header X-Next-Cursor)"),
+    ):
+        self.date_from = date_from
+        self.date_to = date_to
+        self.limit = limit
+        self.cursor = cursor
+
+    def is_empty(self) -> bool:
+        return self.date_from is None and self.date_to is None and self.limit is None and self.cursor is None
+
+
+def revision_etag(revision: int) -> str: # ETag de las respuestas de un paciente, a partir de su revisión
+    return f'"{revision}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    etags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in etags or any(tag.removeprefix("W/") == etag for tag in etags)
+
+
+async def not_modified(object_id: ObjectId, if_none_match: Optional[str]):
+    """
+    Si el cliente mandó If-None-Match, consulta solo la revisión del paciente (sin traer los
+    arreglos) y devuelve (revisión, respuesta 304 o None). Sin el header no consulta nada.
+    """
+    if not if_none_match:
+        return None, None
+
+    revision = await patient_revision(object_id)
+    if revision is None:
+        raise HTTPException(status_code=404, detail="Paciente no encontrado")
+
+    etag = revision_etag(revision)
+    if etag_matches(if_none_match, etag):
+        return revision, Response(status_code=304, headers={"ETag": etag})
+    return revision, None
+
+
+async def get_activity_logs(patient_id: str, field: str, filters: Optional[ActivityLogFilters] = None, if_none_match: Optional[str] = None) -> Response: # función compartida por los GET de cada tipo de actividad
+    try:
+        object_id = ObjectId(patient_id)
+    except bson_errors.InvalidId:
+        raise HTTPException(status_code=400, detail="Formato de patient_id inválido")
+
+    revision, respuesta_304 = await not_modified(object_id, if_none_match)
+    if respuesta_304 is not None:
+        return respuesta_304
+
+    schema = ACTIVITY_SCHEMAS[field]
+
+    # Sin filtros se devuelve el arreglo completo como antes (solo trae el arreglo pedido, no el documento completo).
+    # Esta respuesta se guarda ya serializada en el caché de pacientes junto con su revisión y las escrituras la invalidan.
+    if filters is None or filters.is_empty():
+        async def cargar():
+            found = await find_activity_array(object_id, field)
+            if found is None:
+                raise HTTPException(status_code=404, detail="Paciente no encontrado")
+            body_revision, logs = found
+            return {"revision": body_revision, "body": dumps(schema(logs))}
+
+        fresh = (lambda value: value["revision"] >= revision) if revision is not None else None
+        entry = await cached(str(object_id), field, cargar, fresh)
+        return FastJSONResponse(entry["body"], headers={"ETag": revision_etag(entry["revision"])})
+
+    after = None
+    if filters.cursor:
+        try:
+            after = decode_cursor(filters.cursor, datetime, ObjectId)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+
+    # Pedimos un registro de más para saber si hay una página siguiente
+    limit = filters.limit + 1 if filters.limit else None
+    body_revision, logs = await find_activity_page(object_id, field, filters.date_from, filters.date_to, limit, after)
+    if body_revision is None:
+        raise HTTPException(status_code=404, detail="Paciente no encontrado")
+
+    headers = {"ETag": revision_etag(body_revision)}
+    if filters.limit and len(logs) > filters.limit:
+        logs = logs[:filters.limit]
+        last = logs[-1]
+        headers["X-Next-Cursor"] = encode_cursor(last[DATETIME_FIELDS[field]], last.get("id"))
+
+    return FastJSONResponse(schema(logs), headers=headers)
     
 
 # #GET POR ID FUNCIONANDO
 @router.get("/patients/{patient_id}", summary="Obtener paciente por ID")
-async def get_patient_by_id(patient_id: str):
+async def get_patient_by_id(
+    patient_id: str,
+    if_none_match: Optional[str] = Header(None),
+    hot_only: bool = Query(False, description="Omitir las actividades archivadas (anteriores a archived_before)"),
+):
     try:
         object_id = ObjectId(patient_id)
     except bson_errors.InvalidId:
         raise HTTPException(status_code=400, detail="ID de paciente inválido")
 
-    patient = db_client.conectacare.patient.find_one({"_id": object_id})
-    if not patient:
-        raise HTTPException(status_code=404, detail="Paciente no encontrado")
+    revision, respuesta_304 = await not_modified(object_id, if_none_match) # 304 si el cliente ya tiene esta revisión
+    if respuesta_304 is not None:
+        return respuesta_304
 
-    try:
-        return patient_schema(patient)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al procesar el paciente: {str(e)}")
+    async def cargar():
+        patient = await load_patient(object_id, include_archived=not hot_only)
+        if not patient:
+            raise HTTPException(status_code=404, detail="Paciente no encontrado")
+
+        try:
+            return {"revision": patient.get("revision", 0), "body": dumps(patient_schema(patient))}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error al procesar el paciente: {str(e)}")
+
+    fresh = (lambda value: value["revision"] >= revision) if revision is not None else None
+    if hot_only: # variante sin lo archivado: no se guarda en el caché, que tiene la historia completa
+        entry = await cargar()
+    else:
+        entry = await cached(str(object_id), "patient", cargar, fresh) # caché de pacientes, se invalida en cada escritura
+    return FastJSONResponse(entry["body"], headers={"ETag": revision_etag(entry["revision"])})
 
 # #GET PATIENTS FUNCIONANDO función en el otro backend 3002
 # @router.get("/", summary="Obtener lista de pacientes", response_description="Lista de pacientes")
@@ -80,43 +210,22 @@ async def add_medication_log(patient_id: str, medication_log: MedicationLog):
     except bson_errors.InvalidId:
         raise HTTPException(status_code=400, detail="Formato de patient_id inválido")
 
-    # Verificar si el paciente existe
-    patient = db_client.conectacare.patient.find_one({"_id": object_id}) #verificamos que el patient existe
-    if not patient:
-        raise HTTPException(status_code=404, detail="Paciente no encontrado")
-
     # Convertir a dict y agregar el campo `id` con un nuevo ObjectId
     medication_log_data = medication_log.dict()
     medication_log_data["id"] = ObjectId()
 
     # Agregar el nuevo registro al arreglo de medication_logs
-    result = db_client.conectacare.patient.update_one(
-        {"_id": object_id},
-        {"$push": {"medication_logs": medication_log_data}}
-    )
+    added = await push_activity(object_id, "medication_logs", medication_log_data)
 
-    if result.modified_count == 1:
-        return MedicationLog(**medication_log_schema(medication_log_data))
+    if added:
+        return FastJSONResponse(medication_log_schema(medication_log_data))
 
-    raise HTTPException(status_code=400, detail="No se pudo agregar el registro")
+    raise HTTPException(status_code=404, detail="Paciente no encontrado")
 
 #GET FUNCIONANDO
 @router.get("/{patient_id}/medication_logs", summary="Obtener registros de medicación de un paciente", response_description="Lista de registros de medicación")
-async def get_medication_logs(patient_id: str):
-
-    try:
-        object_id = ObjectId(patient_id)
-    except bson_errors.InvalidId:
-        raise HTTPException(status_code=400, detail="Formato de patient_id inválido")
-
-    patient = db_client.conectacare.patient.find_one({"_id": object_id})
-
-    if not patient:
-        raise HTTPException(status_code=404, detail="Paciente no encontrado")
-
-    medication_logs = patient.get("medication_logs", [])
-
-    return medication_logs_schema(medication_logs)
+async def get_medication_logs(patient_id: str, filters: ActivityLogFilters = Depends(), if_none_match: Optional[str] = Header(None)):
+    return await get_activity_logs(patient_id, "medication_logs", filters, if_none_match)
 
 #PUT FUNCIONANDO
 @router.put("/{patient_id}/medication_logs/{log_id}", response_model=MedicationLog, summary="Actualizar un registro de medicación de un paciente", response_description="Registro de medicación actualizado")
@@ -132,13 +241,10 @@ async def update_medication_log(patient_id: str, log_id: str, updated_log: Medic
 
     updated_log_dict["id"] = log_id_object
 
-    result = db_client.conectacare.patient.update_one(
-        {"_id": object_id, "medication_logs.id": log_id_object},
-        {"$set": {"medication_logs.$": updated_log_dict}}
-    )
+    updated = await set_activity(object_id, "medication_logs", log_id_object, updated_log_dict)
 
-    if result.modified_count == 1:
-        return MedicationLog(**medication_log_schema(updated_log_dict))
+    if updated:
+        return FastJSONResponse(medication_log_schema(updated_log_dict))
 
     raise HTTPException(status_code=404, detail="No se encontró el registro a actualizar")
 
@@ -150,39 +256,21 @@ async def add_meal(patient_id: str, meal: Meal):
     except bson_errors.InvalidId:
         raise HTTPException(status_code=400, detail="Formato de patient_id inválido")
     
-    patient = db_client.conectacare.patient.find_one({"_id": id_del_paciente}) #verificamos que el patient existe
-    if not patient:
-        raise HTTPException(status_code=404, detail="Paciente no encontrado")
-
     comida_a_agregar = meal.dict()
     comida_a_agregar["id"] = ObjectId() #asignamos el _id porque como hacemos un update y no un insert, mongo no lo asigna automaticamente.
 
 
-    result = db_client.conectacare.patient.update_one(
-        {"_id": id_del_paciente},
-        {"$push": {"meals": comida_a_agregar}}
-    )    
-    
-    if result.modified_count == 1:
-        return Meal(**meal_schema(comida_a_agregar))
-    
-    raise HTTPException(status_code=400, detail="No se pudo agregar el registro")
+    added = await push_activity(id_del_paciente, "meals", comida_a_agregar)
 
-#GET FUNCIONANDO
-@router.get("/{patient_id}/meals", summary="Obtener registros de comidas de un paciente", response_description="Lista de registros de comidas")
-async def get_meals(patient_id: str):
-    try:
-        object_id = ObjectId(patient_id)
-    except bson_errors.InvalidId:
-        raise HTTPException(status_code=400, detail="Formato de patient_id inválido")
-
-    patient = db_client.conectacare.patient.find_one({"_id": object_id})
-    if not patient:
-        raise HTTPException(status_code=404, detail="Paciente no encontrado")
+    if added:
+        return FastJSONResponse(meal_schema(comida_a_agregar))
 
-    meals = patient.get("meals", [])
+    raise HTTPException(status_code=404, detail="Paciente no encontrado")
 
-    return meals_schema(meals)
+#GET FUNCIONANDO
+@router.get("/{patient_id}/meals", summary="Obtener registros de comidas de un paciente", response_description="Lista de registros de comidas")
+async def get_meals(patient_id: str, filters: ActivityLogFilters = Depends(), if_none_match: Optional[str] = Header(None)):
+    return await get_activity_logs(patient_id, "meals", filters, if_none_match)
 
 #PUT FUNCIONANDO
 @router.put("/{patient_id}/meals/{meal_id}", response_model=Meal, summary="Actualizar un registro de comida de un paciente", response_description="Registro de comida actualizado")
@@ -198,13 +286,10 @@ async def update_meal(patient_id: str, meal_id: str, updated_meal: Meal):
     updated_meal_dict = updated_meal.dict()
     updated_meal_dict["id"]= meal_id_object
 
-    result = db_client.conectacare.patient.update_one(
-        {"_id": object_id, "meals.id": meal_id_object},
-        {"$set": {"meals.$": updated_meal_dict}}
-    )
+    updated = await set_activity(object_id, "meals", meal_id_object, updated_meal_dict)
 
-    if result.modified_count == 1:
-        return Meal(**meal_schema(updated_meal_dict))
+    if updated:
+        return FastJSONResponse(meal_schema(updated_meal_dict))
 
     raise HTTPException(status_code=404, detail="No se encontró el registro a actualizar")
 
@@ -216,38 +301,20 @@ async def add_hygiene_log(patient_id: str, hygiene_log: HygieneLog):
     except bson_errors.InvalidId:
         raise HTTPException(status_code=400, detail="Formato de patient_id inválido")
 
-    patient = db_client.conectacare.patient.find_one({"_id": object_id})
-    if not patient:
-        raise HTTPException(status_code=404, detail="Paciente no encontrado")
-
     hygiene_log_dict = hygiene_log.dict()
     hygiene_log_dict["id"] = ObjectId()
 
-    result = db_client.conectacare.patient.update_one(
-        {"_id": object_id},
-        {"$push": {"hygiene_logs": hygiene_log_dict}}
-    )
+    added = await push_activity(object_id, "hygiene_logs", hygiene_log_dict)
 
-    if result.modified_count == 1:
-        return HygieneLog(**hygiene_log_schema(hygiene_log_dict))
+    if added:
+        return FastJSONResponse(hygiene_log_schema(hygiene_log_dict))
 
-    raise HTTPException(status_code=400, detail="No se pudo agregar el registro")
+    raise HTTPException(status_code=404, detail="Paciente no encontrado")
 
 #GET FUNCIONANDO
 @router.get("/{patient_id}/hygiene_logs", summary="Obtener registros de higiene de un paciente", response_description="Lista de registros de higiene")
-async def get_hygiene_logs(patient_id: str):
-    try:
-        object_id = ObjectId(patient_id)
-    except bson_errors.InvalidId:
-        raise HTTPException(status_code=400, detail="Formato de patient_id inválido")
-
-    patient = db_client.conectacare.patient.find_one({"_id": object_id})
-    if not patient:
-        raise HTTPException(status_code=404, detail="Paciente no encontrado")
-
-    hygiene_logs = patient.get("hygiene_logs", [])
-
-    return hygiene_logs_schema(hygiene_logs)
+async def get_hygiene_logs(patient_id: str, filters: ActivityLogFilters = Depends(), if_none_match: Optional[str] = Header(None)):
+    return await get_activity_logs(patient_id, "hygiene_logs", filters, if_none_match)
 
 # PUT FUNCIONANDO
 @router.put("/{patient_id}/hygiene_logs/{hygiene_id}", response_model=HygieneLog, summary="Actualizar un registro de higiene de un paciente", response_description="Registro de higiene actualizado")
@@ -263,13 +330,10 @@ async def update_hygiene_log(patient_id: str, hygiene_id: str, updated_log: Hygi
     updated_log_dict = updated_log.dict()
     updated_log_dict["id"] = hygiene_id_object
 
-    result = db_client.conectacare.patient.update_one(
-        {"_id": object_id, "hygiene_logs.id": hygiene_id_object},
-        {"$set": {"hygiene_logs.$": updated_log_dict}}
-    )
+    updated = await set_activity(object_id, "hygiene_logs", hygiene_id_object, updated_log_dict)
 
-    if result.modified_count == 1:
-        return HygieneLog(**hygiene_log_schema(updated_log_dict))
+    if updated:
+        return FastJSONResponse(hygiene_log_schema(updated_log_dict))
 
     raise HTTPException(status_code=404, detail="No se encontró el registro a actualizar")
 
@@ -281,45 +345,52 @@ async def add_vital_signs(patient_id: str, vital_signs: VitalSigns):
     except bson_errors.InvalidId:
         raise HTTPException(status_code=400, detail="Formato de patient_id inválido")
 
-    patient = db_client.conectacare.patient.find_one({"_id": object_id})
-    if not patient:
-        raise HTTPException(status_code=404, detail="Paciente no encontrado")
-
     vital_signs_dict = vital_signs.dict()
     vital_signs_dict["id"] = ObjectId()
 
     # for item in vital_signs_dict["weight_by_month"]:
     #     item["id"] = ObjectId()
 
-    result = db_client.conectacare.patient.update_one(
-        {"_id": object_id},
-        {"$push": {"vital_signs": vital_signs_dict}}
-    )
+    added = await push_activity(object_id, "vital_signs", vital_signs_dict)
 
-    if result.modified_count == 1:
-        return VitalSigns(**vital_sign_schema(vital_signs_dict))
+    if added:
+        return FastJSONResponse(vital_sign_schema(vital_signs_dict))
 
-    raise HTTPException(status_code=400, detail="No se pudo agregar el registro")
+    raise HTTPException(status_code=404, detail="Paciente no encontrado")
 
 #GET FUNCIONANDO
 @router.get("/{patient_id}/vital_signs", summary="Obtener registros de signos vitales de un paciente", response_description="Lista de registros de signos vitales")
-async def get_vital_signs(patient_id: str):
+async def get_vital_signs(patient_id: str, filters: ActivityLogFilters = Depends(), if_none_match: Optional[str] = Header(None)):
+    return await get_activity_logs(patient_id, "vital_signs", filters, if_none_match)
+
+#EN PROGRESO
+@router.get("/{patient_id}/vital_signs/stats", summary="Estadísticas de signos vitales de un paciente", response_description="min/mean/max por período y tendencia")
+async def get_vital_signs_stats(
+    patient_id: str,
+    granularity: str = Query("day", description="day o week"),
+    date_from: Optional[datetime] = Query(None, alias="from", description="Fecha inicial (inclusiva) en ISO 8601"),
+    date_to: Optional[datetime] = Query(None, alias="to", description="Fecha final (exclusiva) en ISO 8601"),
+):
+    """
+    Peso, presión sistólica/diastólica y frecuencia cardíaca agregados por día o semana
+    (mínimo, promedio y máximo) y la pendiente por día de cada métrica. Se calcula con los
+    agregados que mantienen las escrituras (app/db/vital_rollups.py), sin leer las lecturas.
+    """
     try:
         object_id = ObjectId(patient_id)
     except bson_errors.InvalidId:
         raise HTTPException(status_code=400, detail="Formato de patient_id inválido")
+    if granularity not in vital_rollups.GRANULARITIES:
+        raise HTTPException(status_code=400, detail="granularity debe ser day o week")
 
-    patient = db_client.conectacare.patient.find_one({"_id": object_id})
-    if not patient:
+    docs = await vital_rollups.find_rollups(object_id, granularity, date_from, date_to)
+    if not docs and not await patient_exists(object_id):
         raise HTTPException(status_code=404, detail="Paciente no encontrado")
 
-    vital_signs = patient.get("vital_signs", [])
-
-    return vital_signs_schema(vital_signs)
+    return FastJSONResponse({"granularity": granularity, **vital_rollups.rollup_stats(docs)})
 
-#EN PROGRESO
 @router.put("/{patient_id}/vital_signs/{vital_id}", response_model=VitalSigns, summary="Actualizar un registro de signos vitales de un paciente", response_description="Registro de signos vitales actualizado")
-def update_vital_signs(patient_id: str, vital_id: str, updated_signs: VitalSigns):
+async def update_vital_signs(patient_id: str, vital_id: str, updated_signs: VitalSigns):
 
     try:
         object_id = ObjectId(patient_id)
@@ -331,13 +402,10 @@ def update_vital_signs(patient_id: str, vital_id: str, updated_signs: VitalSigns
     updated_signs_dict = updated_signs.dict()
     updated_signs_dict["id"] = vital_id_object
 
-    result = db_client.conectacare.patient.update_one(
-        {"_id": object_id, "vital_signs.id": vital_id_object},
-        {"$set": {"vital_signs.$": updated_signs_dict}}
-    )
+    updated = await set_activity(object_id, "vital_signs", vital_id_object, updated_signs_dict)
 
-    if result.modified_count == 1:
-        return VitalSigns(**vital_sign_schema(updated_signs_dict))
+    if updated:
+        return FastJSONResponse(vital_sign_schema(updated_signs_dict))
 
     raise HTTPException(status_code=404, detail="No se encontró el registro a actualizar")
 
@@ -350,38 +418,20 @@ async def add_symptom(patient_id: str, symptom: Symptom):
     except bson_errors.InvalidId:
         raise HTTPException(status_code=400, detail="Formato de patient_id inválido")
 
-    patient = db_client.conectacare.patient.find_one({"_id": object_id})
-    if not patient:
-        raise HTTPException(status_code=404, detail="Paciente no encontrado")
-
     symptom_dict = symptom.dict()
     symptom_dict["id"] = ObjectId()
 
-    result = db_client.conectacare.patient.update_one(
-        {"_id": object_id},
-        {"$push": {"symptoms": symptom_dict}}
-    )
+    added = await push_activity(object_id, "symptoms", symptom_dict)
 
-    if result.modified_count == 1:
-        return Symptom(**symptom_schema(symptom_dict))
+    if added:
+        return FastJSONResponse(symptom_schema(symptom_dict))
 
-    raise HTTPException(status_code=400, detail="No se pudo agregar el registro")
+    raise HTTPException(status_code=404, detail="Paciente no encontrado")
 
 #GET FUNCIONANDO
 @router.get("/{patient_id}/symptoms", summary="Obtener registros de síntomas de un paciente", response_description="Lista de registros de síntomas")
-async def get_symptoms(patient_id: str):
-    try:
-        object_id = ObjectId(patient_id)
-    except bson_errors.InvalidId:
-        raise HTTPException(status_code=400, detail="Formato de patient_id inválido")
-
-    patient = db_client.conectacare.patient.find_one({"_id": object_id})
-    if not patient:
-        raise HTTPException(status_code=404, detail="Paciente no encontrado")
-
-    symptoms = patient.get("symptoms", [])
-
-    return symptoms_schema(symptoms)
+async def get_symptoms(patient_id: str, filters: ActivityLogFilters = Depends(), if_none_match: Optional[str] = Header(None)):
+    return await get_activity_logs(patient_id, "symptoms", filters, if_none_match)
 
 #PUT FUNCIONANDO
 @router.put("/{patient_id}/symptoms/{symptom_id}", response_model= Symptom, summary="Actualizar un registro de síntomas de un paciente", response_description="Registro de síntoma actualizado")
@@ -396,13 +446,10 @@ async def update_symptom(patient_id: str, symptom_id: str, updated_symptom: Symp
     updated_symptom_dict = updated_symptom.dict()
     updated_symptom_dict["id"] = symptom_id_log
 
-    result = db_client.conectacare.patient.update_one(
-        {"_id": object_id, "symptoms.id": symptom_id_log},
-        {"$set": {"symptoms.$": updated_symptom_dict}}
-    )
+    updated = await set_activity(object_id, "symptoms", symptom_id_log, updated_symptom_dict)
 
-    if result.modified_count == 1:
-        return Symptom(**symptom_schema(updated_symptom_dict))
+    if updated:
+        return FastJSONResponse(symptom_schema(updated_symptom_dict))
 
     raise HTTPException(status_code=404, detail="No se encontró el registro a actualizar")
 
@@ -414,59 +461,304 @@ async def add_medical_history_entry(patient_id: str, entry: MedicalHistoryEntry)
     except bson_errors.InvalidId:
         raise HTTPException(status_code=400, detail="Formato de patient_id inválido")
 
-    patient = db_client.conectacare.patient.find_one({"_id": object_id})
-    if not patient:
-        raise HTTPException(status_code=404, detail="Paciente no encontrado")
-
     entry_dict = entry.dict()
     entry_dict["id"] = ObjectId()
     
-    result = db_client.conectacare.patient.update_one(
-        {"_id": object_id},
-        {"$push": {"medical_history": entry_dict}}
-    )
+    added = await push_activity(object_id, "medical_history", entry_dict)
 
-    if result.modified_count == 1:
-        return MedicalHistoryEntry(**medical_history_entry_schema(entry_dict))
+    if added:
+        return FastJSONResponse(medical_history_entry_schema(entry_dict))
 
-    raise HTTPException(status_code=400, detail="No se pudo agregar el registro")
+    raise HTTPException(status_code=404, detail="Paciente no encontrado")
 
 #GET FUNCIONANDO
 @router.get("/{patient_id}/medical_history", summary="Obtener historial médico de un paciente", response_description="Historial médico")
-async def get_medical_history(patient_id: str):
+async def get_medical_history(patient_id: str, filters: ActivityLogFilters = Depends(), if_none_match: Optional[str] = Header(None)):
+    return await get_activity_logs(patient_id, "medical_history", filters, if_none_match)
+
+#PUT FUNCIONANDO
+@router.put("/{patient_id}/medical_history/{medical_history_id}", response_model= MedicalHistoryEntry, summary="Actualizar un registro del historial médico de un paciente", response_description="Registro del historial médico actualizado")
+async def update_medical_history_entry(patient_id: str, medical_history_id: str, updated_entry: MedicalHistoryEntry):
+
     try:
         object_id = ObjectId(patient_id)
+        medical_history_id_object = ObjectId(medical_history_id)
+
     except bson_errors.InvalidId:
         raise HTTPException(status_code=400, detail="Formato de patient_id inválido")
 
-    patient = db_client.conectacare.patient.find_one({"_id": object_id})
-    if not patient:
-        raise HTTPException(status_code=404, detail="Paciente no encontrado")
+    updated_entry_dict = updated_entry.dict()
+    updated_entry_dict["id"] = medical_history_id_object
 
-    medical_history = patient.get("medical_history", [])
+    updated = await set_activity(object_id, "medical_history", medical_history_id_object, updated_entry_dict)
 
-    return medical_history_schema(medical_history)
+    if updated:
+        return FastJSONResponse(medical_history_entry_schema(updated_entry_dict))
 
-#PUT FUNCIONANDO
-@router.put("/{patient_id}/medical_history/{medical_history_id}", response_model= MedicalHistoryEntry, summary="Actualizar un registro del historial médico de un paciente", response_description="Registro del historial médico actualizado")
-async def update_medical_history_entry(patient_id: str, medical_history_id: str, updated_entry: MedicalHistoryEntry):
+    raise HTTPException(status_code=404, detail="No se encontró el registro a actualizar")
+
+def validate_batch_item(index: int, item: ActivityBatchItem, patient_id: Optional[str] = None):
+    """Valida un item del batch con el modelo de su tipo. Devuelve (entrada para mongo o None, resultado)."""
+    result = ActivityBatchResult(index=index, type=item.type, patient_id=patient_id or item.patient_id)
+
+    model = ACTIVITY_MODELS.get(item.type)
+    if model is None:
+        result.error = f"Tipo de actividad desconocido: {item.type}"
+        return None, result
+
+    try:
+        entry = model(**item.data).dict()
+    except ValidationError as e:
+        result.error = "; ".join(f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in e.errors())
+        return None, result
+
+    entry["id"] = ObjectId()
+    result.id = str(entry["id"])
+    return entry, result
+
+#POST BATCH
+@router.post("/{patient_id}/activities:batch", response_model=ActivityBatchResponse, summary="Registrar varias actividades de un paciente", response_description="Resultado por item")
+async def add_activities_batch(patient_id: str, batch: ActivityBatch):
+    """
+    Registra en una sola escritura actividades de distintos tipos (comidas, medicación, higiene,
+    signos vitales, síntomas, historial médico), por ejemplo al sincronizar una tablet que estuvo
+    sin conexión. Cada item es `{"type": "<arreglo>", "data": {...}}`; los items inválidos se
+    reportan en su resultado y no impiden que se guarden los demás.
+    """
+    try:
+        object_id = ObjectId(patient_id)
+    except bson_errors.InvalidId:
+        raise HTTPException(status_code=400, detail="Formato de patient_id inválido")
+
+    entries_by_field = {}
+    results = []
+    for index, item in enumerate(batch.items):
+        entry, result = validate_batch_item(index, item, patient_id)
+        if entry is not None:
+            entries_by_field.setdefault(item.type, []).append(entry)
+        results.append(result)
+
+    if entries_by_field:
+        found = await push_activities(object_id, entries_by_field) # un solo update con $push/$each por arreglo
+    else:
+        found = await patient_exists(object_id)
 
+    if not found:
+        raise HTTPException(status_code=404, detail="Paciente no encontrado")
+
+    return ActivityBatchResponse(results=results)
+
+#POST BATCH ENTRE PACIENTES
+@router.post("/activities:batch", response_model=ActivityBatchResponse, summary="Registrar actividades de varios pacientes", response_description="Resultado por item")
+async def add_activities_batch_many(batch: ActivityBatch):
+    """
+    Igual que el batch por paciente, pero cada item indica su `patient_id`. Las escrituras de
+    todos los pacientes van en un solo bulk_write no ordenado; si un paciente no existe sus
+    items se reportan con error y el resto se guarda igual.
+    """
+    entries_by_patient = {}
+    pending = []
+    results = []
+    for index, item in enumerate(batch.items):
+        if not item.patient_id:
+            results.append(ActivityBatchResult(index=index, type=item.type, error="Falta patient_id"))
+            continue
+        try:
+            object_id = ObjectId(item.patient_id)
+        except bson_errors.InvalidId:
+            results.append(ActivityBatchResult(index=index, type=item.type, patient_id=item.patient_id, error="Formato de patient_id inválido"))
+            continue
+
+        entry, result = validate_batch_item(index, item)
+        if entry is not None:
+            entries_by_patient.setdefault(object_id, {}).setdefault(item.type, []).append(entry)
+            pending.append((object_id, result))
+        results.append(result)
+
+    if entries_by_patient:
+        existentes = await push_activities_many(entries_by_patient)
+        for object_id, result in pending:
+            if object_id not in existentes:
+                result.id = None
+                result.error = "Paciente no encontrado"
+
+    return ActivityBatchResponse(results=results)
+
+#EXPORTACIÓN
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+@router.get("/activities:export", summary="Exportar actividades de todos los pacientes", response_description="NDJSON o CSV en streaming")
+async def export_activities(
+    type: str = Query(..., description="Arreglo a exportar: meals, vital_signs, ..."),
+    date_from: Optional[datetime] = Query(None, alias="from", description="Fecha inicial (inclusiva) en ISO 8601"),
+    date_to: Optional[datetime] = Query(None, alias="to", description="Fecha final (exclusiva) en ISO 8601"),
+    format: str = Query("ndjson", description="ndjson o csv"),
+    gzip: bool = Query(False, description="Comprimir la respuesta con gzip (Content-Encoding: gzip)"),
+):
+    """
+    Vuelca las entradas de un tipo de actividad de todos los pacientes, una fila por entrada con
+    su `patient_id`. Se lee con un cursor en lotes y se responde en streaming, así que la memoria
+    del servidor no crece con el tamaño del volcado. También disponible como CLI: `python -m app.db.export`.
+    """
+    if type not in ACTIVITY_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Tipo de actividad desconocido: {type}")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato desconocido: {format}")
+
+    headers = {"Content-Disposition": f'attachment; filename="{export_filename(type, format, False)}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+
+    return StreamingResponse(export_chunks(type, format, date_from, date_to, gzip), media_type=EXPORT_MEDIA_TYPES[format], headers=headers)
+
+#LÍNEA DE TIEMPO
+@router.get("/{patient_id}/timeline", summary="Línea de tiempo de actividades de un paciente", response_description="Actividades de todos los tipos, de la más reciente a la más antigua")
+async def get_timeline(
+    patient_id: str,
+    types: Optional[List[str]] = Query(None, alias="type", description="Tipos a incluir (se puede repetir); por defecto todos"),
+    date_from: Optional[datetime] = Query(None, alias="from", description="Fecha inicial (inclusiva) en ISO 8601"),
+    date_to: Optional[datetime] = Query(None, alias="to", description="Fecha final (exclusiva) en ISO 8601"),
+    limit: int = Query(50, ge=1, le=500, description="Máximo de registros a devolver"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página siguiente (header X-Next-Cursor)"),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Todas las actividades del paciente en un solo orden cronológico, cada una como
+    `{"type", "datetime", "entry"}`. Se pagina con `limit` y el cursor (fecha, id) del header
+    X-Next-Cursor, igual que los GET de cada tipo; la mezcla se hace página a página, sin
+    cargar los arreglos completos.
+    """
     try:
         object_id = ObjectId(patient_id)
-        medical_history_id_object = ObjectId(medical_history_id)
+    except bson_errors.InvalidId:
+        raise HTTPException(status_code=400, detail="Formato de patient_id inválido")
+
+    fields = list(dict.fromkeys(types)) if types else list(ACTIVITY_FIELDS)
+    for field in fields:
+        if field not in ACTIVITY_FIELDS:
+            raise HTTPException(status_code=400, detail=f"Tipo de actividad desconocido: {field}")
+
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor, datetime, ObjectId)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+
+    revision, respuesta_304 = await not_modified(object_id, if_none_match)
+    if respuesta_304 is not None:
+        return respuesta_304
+
+    # Pedimos un registro de más para saber si hay una página siguiente
+    body_revision, items = await find_timeline_page(object_id, fields, date_from, date_to, limit + 1, after)
+    if body_revision is None:
+        raise HTTPException(status_code=404, detail="Paciente no encontrado")
 
+    headers = {"ETag": revision_etag(body_revision)}
+    if len(items) > limit:
+        items = items[:limit]
+        field, last = items[-1]
+        headers["X-Next-Cursor"] = encode_cursor(last[DATETIME_FIELDS[field]], last.get("id"))
+
+    timeline = [
+        {"type": field, "datetime": entry[DATETIME_FIELDS[field]], "entry": ACTIVITY_SCHEMAS[field]([entry])[0]}
+        for field, entry in items
+    ]
+    return FastJSONResponse(timeline, headers=headers)
+
+#CONSULTA POR LOTES
+def parse_batch_ids(ids: list) -> tuple: # ids válidos sin repetir y errores por id (400) de una consulta por lotes
+    object_ids, errors = {}, {}
+    for patient_id in ids:
+        try:
+            object_ids[patient_id] = ObjectId(patient_id)
+        except bson_errors.InvalidId:
+            errors[patient_id] = {"status": 400, "detail": "Formato de patient_id inválido"}
+    return object_ids, errors
+
+
+# Campos que se pueden pedir en `fields` (los de patient_schema; el id siempre viaja)
+PATIENT_FIELDS = tuple(field for field in Patient.model_fields if field != "id")
+
+@router.post(":batchGet", response_model=PatientBatchGetResponse, summary="Obtener varios pacientes por ID", response_description="Pacientes por id y errores por id")
+async def batch_get_patients(request: PatientBatchGetRequest):
+    """
+    Varios pacientes en una sola consulta `$in` (hasta 500 ids) para las vistas de sala, en
+    lugar de un GET por cama. `fields` limita los campos que se leen y devuelven. Los ids
+    inválidos o inexistentes van en `errors` con su status. El cuerpo se serializa en streaming
+    a medida que llegan los documentos.
+    """
+    if request.fields:
+        for field in request.fields:
+            if field not in PATIENT_FIELDS:
+                raise HTTPException(status_code=400, detail=f"Campo desconocido: {field}")
+
+    object_ids, errors = parse_batch_ids(request.ids)
+    claves = {} # un mismo ObjectId puede llegar escrito de más de una forma
+    for patient_id, object_id in object_ids.items():
+        claves.setdefault(object_id, []).append(patient_id)
+
+    async def serializar():
+        yield b'{"results":{'
+        primero = True
+        async for patient in iter_patients(list(claves), request.fields):
+            body = patient_schema(patient)
+            if request.fields:
+                body = {"id": body["id"], **{field: body[field] for field in request.fields}}
+            body = dumps(body)
+            for patient_id in claves.pop(patient["_id"]):
+                yield (b"" if primero else b",") + dumps(patient_id) + b":" + body
+                primero = False
+
+        for pendientes in claves.values(): # los que no devolvió la consulta no existen
+            for patient_id in pendientes:
+                errors[patient_id] = {"status": 404, "detail": "Paciente no encontrado"}
+        yield b'},"errors":' + dumps(errors) + b"}"
+
+    return StreamingResponse(serializar(), media_type="application/json")
+
+
+#RESUMEN
+@router.get("/{patient_id}/summary", response_model=PatientSummary, summary="Último estado de un paciente", response_description="Últimos signos vitales, comida y medicación, y síntomas abiertos")
+async def get_patient_summary(patient_id: str, if_none_match: Optional[str] = Header(None)):
+    """
+    Lo que muestran los tableros de sala, leído del subdocumento `summary` que mantiene cada
+    escritura (app/db/summary.py): no se traen ni recorren los arreglos del paciente. Los
+    síntomas abiertos son los registrados en las últimas SUMMARY_OPEN_SYMPTOM_HOURS horas.
+    """
+    try:
+        object_id = ObjectId(patient_id)
     except bson_errors.InvalidId:
         raise HTTPException(status_code=400, detail="Formato de patient_id inválido")
 
-    updated_entry_dict = updated_entry.dict()
-    updated_entry_dict["id"] = medical_history_id_object
+    revision, respuesta_304 = await not_modified(object_id, if_none_match)
+    if respuesta_304 is not None:
+        return respuesta_304
 
-    result = db_client.conectacare.patient.update_one(
-        {"_id": object_id, "medical_history.id": medical_history_id_object},
-        {"$set": {"medical_history.$": updated_entry_dict}}
-    )
+    found = await summary.find_summaries([object_id])
+    if object_id not in found:
+        raise HTTPException(status_code=404, detail="Paciente no encontrado")
+
+    patient = found[object_id]
+    return FastJSONResponse(patient_summary_schema(patient, summary.open_since()), headers={"ETag": revision_etag(patient.get("revision", 0))})
 
-    if result.modified_count == 1:
-        return MedicalHistoryEntry(**medical_history_entry_schema(updated_entry_dict))
 
-    raise HTTPException(status_code=404, detail="No se encontró el registro a actualizar")
\ No newline at end of file
+@router.post("/summary:batchGet", response_model=PatientSummaryBatch, summary="Último estado de varios pacientes", response_description="Resúmenes por id y errores por id")
+async def get_patient_summaries(request: PatientIdsRequest):
+    """
+    Variante por lotes de GET /patients/{patient_id}/summary para las vistas de sala: una sola
+    consulta `$in` para todos los ids. Los ids inválidos o inexistentes van en `errors` con su
+    status, sin que falle el resto.
+    """
+    object_ids, errors = parse_batch_ids(request.ids)
+    found = await summary.find_summaries(list(set(object_ids.values())))
+    since = summary.open_since()
+
+    results = {}
+    for patient_id, object_id in object_ids.items():
+        if object_id in found:
+            results[patient_id] = patient_summary_schema(found[object_id], since)
+        else:
+            errors[patient_id] = {"status": 404, "detail": "Paciente no encontrado"}
+
+    return FastJSONResponse({"results": results, "errors": errors})
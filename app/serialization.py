@@ -0,0 +1,33 @@
+"""
+Serialización rápida de respuestas con orjson.
+
+Los handlers que devuelven datos leídos de MongoDB o recién escritos por ellos mismos (ya
+confiables) responden con FastJSONResponse directamente: así FastAPI no vuelve a validar contra el response_model ni
+pasa el contenido por jsonable_encoder, y orjson convierte ObjectId y datetime sin pasos
+intermedios. El response_model de cada ruta se mantiene para la documentación en /docs.
+"""
+import orjson
+from bson import ObjectId, Decimal128
+from fastapi.responses import JSONResponse
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    raise TypeError(f"Tipo no serializable a JSON: {type(value).__name__}")
+
+
+def dumps(content) -> bytes:
+    """Serializa a JSON (bytes). datetime/date salen en ISO 8601 y ObjectId como string."""
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse serializada con orjson. También acepta bytes ya serializados (p. ej. desde el caché)."""
+
+    def render(self, content) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
@@ -0,0 +1,62 @@
+"""
+Lanzador de producción con varios workers de uvicorn.
+
+Prepara el directorio de métricas multiproceso de Prometheus antes de arrancar los workers
+(la variable debe existir antes de que cada worker importe prometheus_client) y lo vacía
+para no sumar contadores de una ejecución anterior. Cada worker crea su propio cliente de
+MongoDB la primera vez que lo usa (ver app/db/client.py) y al terminar lo cierra y limpia
+sus archivos de métricas en el lifespan de app/main.py.
+
+El caché `memory` es por proceso: una escritura solo lo invalida en el worker que la atendió
+y los demás seguirían sirviendo el paciente viejo hasta PATIENT_CACHE_TTL. Con más de un
+worker el lanzador lo reemplaza por `none`; para tener caché usar PATIENT_CACHE=redis.
+
+Uso:
+    python -m app.serve --workers 4 --port 8000
+
+WEB_CONCURRENCY, PORT y PROMETHEUS_MULTIPROC_DIR sirven como valores por defecto.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+
+import uvicorn
+from dotenv import load_dotenv
+
+
+def prepare_multiproc_dir(path: str):
+    # Los archivos *.db de una ejecución anterior se sumarían a los contadores nuevos
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+
+
+def disable_process_cache():
+    # Los workers heredan el entorno del lanzador, y load_dotenv no pisa una variable ya definida
+    if os.getenv("PATIENT_CACHE", "memory") == "memory":
+        os.environ["PATIENT_CACHE"] = "none"
+        print("PATIENT_CACHE=memory no se comparte entre workers: caché desactivado (usar PATIENT_CACHE=redis)")
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Arranca el backend con varios workers de uvicorn")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument("--metrics-dir", default=os.getenv("PROMETHEUS_MULTIPROC_DIR")
+                        or os.path.join(tempfile.gettempdir(), "conectacare_prometheus"))
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        prepare_multiproc_dir(args.metrics_dir)
+        print(f"Métricas multiproceso en {args.metrics_dir}")
+        disable_process_cache()
+
+    uvicorn.run("app.main:app", host=args.host, port=args.port, workers=args.workers,
+                log_level="info", proxy_headers=True)
+
+
+if __name__ == "__main__":
+    main()
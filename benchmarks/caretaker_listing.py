@@ -0,0 +1,69 @@
+"""
+Latencia del listado de caretakers a medida que crece la colección.
+
+Con el servidor levantado, inserta caretakers de prueba hasta llegar a cada tamaño de
+`--sizes` y mide GET /caretakers/ (primera página y una página profunda, alcanzada con el
+cursor) y el filtro por rol. Con la paginación por keyset sobre _id la latencia debe quedar
+plana aunque la colección crezca. Los caretakers de prueba se eliminan al terminar.
+
+Uso:
+    uvicorn app.main:app --port 8000
+    python -m benchmarks.caretaker_listing --sizes 1000 10000 50000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import httpx
+from bson import ObjectId
+from app.db.client import db_client
+from app.db.queries import encode_cursor
+
+ROLE = "benchmark"
+
+
+async def medir(client, path, params, repeat):
+    tiempos = []
+    for _ in range(repeat):
+        inicio = time.perf_counter()
+        (await client.get(path, params=params)).raise_for_status()
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos) * 1000
+
+
+async def main(args):
+    collection = db_client.conectacare.caretaker
+    creados = 0
+    try:
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=60) as client:
+            print(f"{'caretakers':>11} {'1ra pág (ms)':>13} {'pág profunda (ms)':>18} {'por rol (ms)':>13}")
+            for size in sorted(args.sizes):
+                while creados < size:
+                    lote = min(5000, size - creados)
+                    await collection.insert_many([
+                        {"name": "benchmark", "email": f"{ObjectId()}@benchmark", "passwordHash": "-", "role": ROLE}
+                        for _ in range(lote)
+                    ])
+                    creados += lote
+
+                # Cursor de una página cercana al final, tomado de la propia colección
+                profundo = await collection.find({"role": ROLE}, {"_id": 1}).sort("_id", -1).skip(args.limit).limit(1).to_list()
+                cursor = encode_cursor(profundo[0]["_id"]) if profundo else None
+
+                primera = await medir(client, "/caretakers/", {"limit": args.limit}, args.repeat)
+                profunda = await medir(client, "/caretakers/", {"limit": args.limit, **({"cursor": cursor} if cursor else {})}, args.repeat)
+                por_rol = await medir(client, "/caretakers/", {"limit": args.limit, "role": ROLE}, args.repeat)
+                print(f"{size:>11} {primera:>13.1f} {profunda:>18.1f} {por_rol:>13.1f}")
+    finally:
+        await collection.delete_many({"role": ROLE})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latencia del listado de caretakers según el tamaño de la colección")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
@@ -0,0 +1,140 @@
+"""
+Prueba de carga del listado de pacientes de un caretaker.
+
+Crea en la base de MONGO_URI un caretaker con `--patients` pacientes (cada uno con
+`--history` registros de signos vitales y de medicación) y, con el servidor levantado,
+compara la carga completa de la pantalla de inicio del caretaker:
+
+- antes:   un GET /patients/patients/{id} por paciente (N+1, cada uno con su historial completo)
+- después: GET /caretakers/{id}/patients recorriendo las páginas con X-Next-Cursor
+
+Después mide el throughput de la primera página con varios clientes en paralelo. Los datos
+de prueba se eliminan al terminar.
+
+Uso:
+    uvicorn app.main:app --port 8000
+    python -m benchmarks.caretaker_roster --patients 500 --history 200
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+import httpx
+from bson import ObjectId
+from app.db.client import db_client
+from app.db import buckets
+from benchmarks.concurrency import run_level
+
+
+def historial(history: int) -> dict:
+    inicio = datetime(2025, 1, 1)
+    return {
+        "vital_signs": [
+            {"id": ObjectId(), "datetime": inicio + timedelta(hours=6 * i), "daily_weight": 70,
+             "blood_pressure": {"systolic": 120, "diastolic": 80}, "heart_rate": 72, "observations": ""}
+            for i in range(history)
+        ],
+        "medication_logs": [
+            {"id": ObjectId(), "datetime": inicio + timedelta(hours=8 * i), "medication_name": "enalapril",
+             "dose": "10mg", "route": "oral", "status": "administrado", "observations": ""}
+            for i in range(history)
+        ],
+    }
+
+
+async def seed(args) -> tuple:
+    db = db_client.conectacare
+    caretaker_id = (await db.caretaker.insert_one({
+        "name": "benchmark", "email": f"roster-{ObjectId()}@benchmark", "passwordHash": "-", "role": "benchmark",
+    })).inserted_id
+
+    base = random.randint(10**12, 10**13)
+    patient_ids = []
+    for i in range(args.patients):
+        actividades = historial(args.history)
+        patient = {"name": f"Paciente {i}", "last_name": "Benchmark", "birth_date": datetime(1940, 1, 1),
+                   "age": 85, "document": base + i, "caretakers_ids": [caretaker_id], "revision": 0}
+        if not buckets.BUCKETS_ENABLED:
+            patient.update(actividades)
+        patient_id = (await db.patient.insert_one(patient)).inserted_id
+        if buckets.BUCKETS_ENABLED:
+            await buckets.push_entries(patient_id, actividades)
+        patient_ids.append(patient_id)
+
+    return caretaker_id, patient_ids
+
+
+async def cleanup(caretaker_id, patient_ids):
+    db = db_client.conectacare
+    await db.patient.delete_many({"_id": {"$in": patient_ids}})
+    await db.caretaker.delete_one({"_id": caretaker_id})
+    if buckets.BUCKETS_ENABLED:
+        await buckets.bucket_collection().delete_many({"patient_id": {"$in": patient_ids}})
+
+
+async def antes(client, caretaker_id, patient_ids, concurrency):
+    semaforo = asyncio.Semaphore(concurrency)
+
+    async def uno(patient_id):
+        async with semaforo:
+            (await client.get(f"/patients/patients/{patient_id}")).raise_for_status()
+
+    await asyncio.gather(*(uno(pid) for pid in patient_ids))
+
+
+async def despues(client, caretaker_id, patient_ids, concurrency):
+    cursor, total = None, 0
+    while True:
+        params = {"limit": 100, **({"cursor": cursor} if cursor else {})}
+        response = await client.get(f"/caretakers/{caretaker_id}/patients", params=params)
+        response.raise_for_status()
+        total += len(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    if total != len(patient_ids):
+        raise RuntimeError(f"El listado devolvió {total} pacientes de {len(patient_ids)}")
+
+
+async def medir(nombre, estrategia, client, caretaker_id, patient_ids, args):
+    await estrategia(client, caretaker_id, patient_ids, args.concurrency)  # calentamiento
+    tiempos = []
+    for _ in range(args.repeat):
+        inicio = time.perf_counter()
+        await estrategia(client, caretaker_id, patient_ids, args.concurrency)
+        tiempos.append(time.perf_counter() - inicio)
+    print(f"{nombre:>8} media {statistics.mean(tiempos) * 1000:9.1f} ms  mejor {min(tiempos) * 1000:9.1f} ms")
+    return statistics.mean(tiempos)
+
+
+async def main(args):
+    print(f"Creando {args.patients} pacientes con {args.history} registros por arreglo...")
+    caretaker_id, patient_ids = await seed(args)
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+            print(f"Pantalla de inicio completa ({args.patients} pacientes)")
+            t_antes = await medir("antes", antes, client, caretaker_id, patient_ids, args)
+            t_despues = await medir("después", despues, client, caretaker_id, patient_ids, args)
+            print(f"  {t_antes / t_despues:.1f}x más rápido")
+
+            print(f"Primera página (limit=100) con {args.concurrency} clientes en paralelo")
+            r = await run_level(client, f"/caretakers/{caretaker_id}/patients?limit=100", args.requests, args.concurrency)
+            print(f"  {r['rps']:.1f} req/s  p50 {r['p50_ms']:.1f} ms  p95 {r['p95_ms']:.1f} ms  errores {r['errores']}")
+    finally:
+        await cleanup(caretaker_id, patient_ids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga del listado de pacientes de un caretaker")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--patients", type=int, default=500)
+    parser.add_argument("--history", type=int, default=200, help="Registros por arreglo de cada paciente")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500, help="Peticiones de la prueba de throughput")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
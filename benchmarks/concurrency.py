@@ -0,0 +1,79 @@
+"""
+Benchmark de concurrencia del backend.
+
+Lanza N peticiones GET contra un endpoint del servicio manteniendo un número
+fijo de peticiones en vuelo y muestra cómo escala el throughput. Con el acceso
+a MongoDB asíncrono el throughput debe crecer con la concurrencia hasta saturar
+el pool de conexiones; con el cliente síncrono se quedaba plano porque cada
+consulta bloqueaba el event loop.
+
+Uso:
+    uvicorn app.main:app --port 8000
+    python -m benchmarks.concurrency --patient-id <ObjectId> --concurrency 1 4 16 64
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def run_level(client: httpx.AsyncClient, path: str, total: int, concurrency: int) -> dict:
+    latencias = []
+    errores = 0
+    pendientes = iter(range(total))
+
+    async def worker():
+        nonlocal errores
+        for _ in pendientes:
+            inicio = time.perf_counter()
+            try:
+                response = await client.get(path)
+                if response.status_code >= 400:
+                    errores += 1
+            except httpx.HTTPError:
+                errores += 1
+            latencias.append(time.perf_counter() - inicio)
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duracion = time.perf_counter() - inicio
+
+    latencias.sort()
+    return {
+        "concurrency": concurrency,
+        "rps": total / duracion,
+        "p50_ms": statistics.median(latencias) * 1000,
+        "p95_ms": latencias[int(len(latencias) * 0.95) - 1] * 1000,
+        "errores": errores,
+    }
+
+
+async def main(args):
+    path = args.path or f"/patients/{args.patient_id}/medication_logs"
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=30) as client:
+        # Calentamos conexiones HTTP y el pool de MongoDB antes de medir
+        await run_level(client, path, min(args.requests, 20), 4)
+
+        print(f"{'en vuelo':>9} {'req/s':>10} {'p50 (ms)':>10} {'p95 (ms)':>10} {'errores':>8}")
+        for concurrency in args.concurrency:
+            r = await run_level(client, path, args.requests, concurrency)
+            print(f"{r['concurrency']:>9} {r['rps']:>10.1f} {r['p50_ms']:>10.1f} {r['p95_ms']:>10.1f} {r['errores']:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de throughput vs. peticiones en vuelo")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--patient-id", help="ObjectId de un paciente existente")
+    parser.add_argument("--path", help="Ruta a medir (por defecto /patients/{patient_id}/medication_logs)")
+    parser.add_argument("--requests", type=int, default=500, help="Peticiones por nivel de concurrencia")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    args = parser.parse_args()
+
+    if not args.path and not args.patient_id:
+        parser.error("se requiere --patient-id o --path")
+
+    asyncio.run(main(args))
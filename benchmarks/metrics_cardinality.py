@@ -0,0 +1,64 @@
+"""
+Verificación de la cardinalidad de las métricas HTTP.
+
+Envía peticiones a la app en el mismo proceso (sin servidor ni base de datos) con
+`--requests` patient_id distintos y cuenta las series de http_requests_total,
+http_request_duration_seconds y http_exceptions_total antes y después. Como las métricas se
+etiquetan con la plantilla de la ruta y no con la URL, el número de series no debe crecer.
+
+Los ids enviados no son ObjectId válidos, así que cada petición responde 400 sin consultar
+MongoDB (basta con que MONGO_URI tenga cualquier valor).
+
+Uso:
+    python -m benchmarks.metrics_cardinality --requests 100000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
+
+import httpx
+from prometheus_client import REGISTRY
+from app.main import app
+
+METRICAS = ("http_requests_total", "http_request_duration_seconds", "http_exceptions_total")
+
+
+def contar_series() -> int:
+    series = set()
+    for metric in REGISTRY.collect():
+        for sample in metric.samples:
+            if sample.name.startswith(METRICAS):
+                series.add((sample.name, tuple(sorted(sample.labels.items()))))
+    return len(series)
+
+
+async def main(args):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        # Una petición por ruta para que existan las series antes de contar
+        await client.get("/patients/calentamiento/meals")
+        await client.get("/ruta/inexistente")
+        antes = contar_series()
+
+        inicio = time.perf_counter()
+        for i in range(args.requests):
+            await client.get(f"/patients/paciente-{i}/meals")
+            await client.get(f"/ruta/inexistente-{i}")
+        duracion = time.perf_counter() - inicio
+
+    despues = contar_series()
+    print(f"{args.requests} patient_id distintos en {duracion:.1f} s")
+    print(f"Series HTTP antes: {antes}, después: {despues}")
+    return antes == despues
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Comprueba que las métricas HTTP no crean una serie por URL")
+    parser.add_argument("--requests", type=int, default=100000)
+    args = parser.parse_args()
+
+    sys.exit(0 if asyncio.run(main(args)) else 1)
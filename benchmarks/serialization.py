@@ -0,0 +1,118 @@
+"""
+Micro-benchmark de serialización de pacientes y arreglos de actividades.
+
+Genera en memoria un paciente con `--entries` entradas por arreglo (codificado en BSON,
+como llega desde MongoDB) y compara para el GET del paciente y el GET de un arreglo:
+
+- anterior: decode BSON -> schema -> validación Pydantic -> jsonable_encoder -> json stdlib
+- anterior sin validación (GET sin response_model): decode -> schema -> jsonable_encoder -> json
+- actual:   decode BSON -> schema -> orjson (app/serialization.py)
+
+No necesita base de datos.
+
+Uso:
+    python -m benchmarks.serialization --entries 10000
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+import bson
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from app.db.models.activity import MedicationLog
+from app.db.models.patient import Patient
+from app.db.schemas.activity import medication_logs_schema
+from app.db.schemas.patient import patient_schema
+from app.serialization import dumps
+
+
+def build_patient(entries: int) -> dict:
+    inicio = datetime(2020, 1, 1)
+
+    def fecha(i):
+        return inicio + timedelta(minutes=37 * i)
+
+    return {
+        "_id": ObjectId(),
+        "name": "Paciente",
+        "last_name": "Benchmark",
+        "birth_date": datetime(1940, 5, 17),
+        "age": 85,
+        "document": 123456,
+        "caretakers_ids": [ObjectId() for _ in range(3)],
+        "medication_logs": [
+            {"id": ObjectId(), "datetime": fecha(i), "medication_name": "enalapril", "dose": "10mg",
+             "route": "oral", "status": "administrado", "observations": "sin efectos adversos"}
+            for i in range(entries)
+        ],
+        "meals": [
+            {"id": ObjectId(), "datetime": fecha(i), "meal_type": "almuerzo", "description": "sopa",
+             "hydration": "agua 250ml", "observations": ""}
+            for i in range(entries)
+        ],
+        "hygiene_logs": [
+            {"id": ObjectId(), "datetime": fecha(i), "type": "baño", "condition": "estable",
+             "status": "completado", "assistance_level": "parcial", "observations": ""}
+            for i in range(entries)
+        ],
+        "vital_signs": [
+            {"id": ObjectId(), "datetime": fecha(i), "daily_weight": 70,
+             "blood_pressure": {"systolic": 120, "diastolic": 80}, "heart_rate": 72, "observations": ""}
+            for i in range(entries)
+        ],
+        "symptoms": [
+            {"id": ObjectId(), "datetime": fecha(i), "description": "tos", "observations": ""}
+            for i in range(entries)
+        ],
+        "medical_history": [
+            {"id": ObjectId(), "date": fecha(i), "description": "control", "notes": ""}
+            for i in range(entries)
+        ],
+    }
+
+
+def medir(nombre, funcion, repeticiones):
+    funcion()  # calentamiento
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        size = len(funcion())
+        tiempos.append(time.perf_counter() - inicio)
+    mejor = min(tiempos)
+    print(f"  {nombre:<28} {mejor * 1000:9.1f} ms  ({size / 1e6:.1f} MB)")
+    return mejor
+
+
+def main(args):
+    patient = build_patient(args.entries)
+    raw = bson.encode(patient)
+    # El GET de un arreglo usa una proyección, así que solo llega ese arreglo
+    raw_logs = bson.encode({"_id": patient["_id"], "medication_logs": patient["medication_logs"]})
+    medication_logs_adapter = TypeAdapter(list[MedicationLog])
+
+    print(f"Paciente completo ({args.entries} entradas por arreglo, {len(raw) / 1e6:.1f} MB en BSON)")
+    anterior = medir("anterior (con validación)", lambda: json.dumps(jsonable_encoder(
+        Patient(**patient_schema(bson.decode(raw))))).encode(), args.repeat)
+    medir("anterior (sin validación)", lambda: json.dumps(jsonable_encoder(
+        patient_schema(bson.decode(raw)))).encode(), args.repeat)
+    actual = medir("actual (orjson)", lambda: dumps(patient_schema(bson.decode(raw))), args.repeat)
+    print(f"  {anterior / actual:.1f}x más rápido")
+
+    print("Arreglo medication_logs")
+    anterior = medir("anterior (con validación)", lambda: json.dumps(jsonable_encoder(
+        medication_logs_adapter.validate_python(medication_logs_schema(bson.decode(raw_logs)["medication_logs"])))).encode(), args.repeat)
+    medir("anterior (sin validación)", lambda: json.dumps(jsonable_encoder(
+        medication_logs_schema(bson.decode(raw_logs)["medication_logs"]))).encode(), args.repeat)
+    actual = medir("actual (orjson)", lambda: dumps(medication_logs_schema(bson.decode(raw_logs)["medication_logs"])), args.repeat)
+    print(f"  {anterior / actual:.1f}x más rápido")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara la serialización anterior de respuestas con la de orjson")
+    parser.add_argument("--entries", type=int, default=10000, help="Entradas por arreglo del paciente")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    main(args)
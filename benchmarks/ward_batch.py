@@ -0,0 +1,96 @@
+"""
+Refresco de una vista de sala: un GET por cama contra un solo POST /patients:batchGet.
+
+Crea `--patients` pacientes (cada uno con `--history` registros de signos vitales) en la base
+de MONGO_URI y, con el servidor levantado, mide:
+
+- antes:     GET /patients/patients/{id} uno tras otro, como hace hoy la vista de sala
+- después:   POST /patients:batchGet con todos los ids
+- campos:    el mismo batchGet pidiendo solo `name`, `last_name` y `vital_signs`
+
+Los pacientes de prueba se eliminan al terminar.
+
+Uso:
+    uvicorn app.main:app --port 8000
+    python -m benchmarks.ward_batch --patients 40 --history 200
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import httpx
+from bson import ObjectId
+from app.db.client import db_client
+from app.db import buckets
+from benchmarks.caretaker_roster import historial
+
+
+async def seed(args) -> list:
+    base = random.randint(10**12, 10**13)
+    patient_ids = []
+    for i in range(args.patients):
+        actividades = {"vital_signs": historial(args.history)["vital_signs"]}
+        patient = {"name": f"Cama {i}", "last_name": "Benchmark", "age": 80, "document": base + i, "revision": 0}
+        if not buckets.BUCKETS_ENABLED:
+            patient.update(actividades)
+        patient_id = (await db_client.conectacare.patient.insert_one(patient)).inserted_id
+        if buckets.BUCKETS_ENABLED:
+            await buckets.push_entries(patient_id, actividades)
+        patient_ids.append(str(patient_id))
+    return patient_ids
+
+
+async def cleanup(patient_ids):
+    object_ids = [ObjectId(pid) for pid in patient_ids]
+    await db_client.conectacare.patient.delete_many({"_id": {"$in": object_ids}})
+    if buckets.BUCKETS_ENABLED:
+        await buckets.bucket_collection().delete_many({"patient_id": {"$in": object_ids}})
+
+
+async def antes(client, patient_ids):
+    for patient_id in patient_ids:
+        (await client.get(f"/patients/patients/{patient_id}")).raise_for_status()
+
+
+async def despues(client, patient_ids, fields=None):
+    body = {"ids": patient_ids, **({"fields": fields} if fields else {})}
+    response = await client.post("/patients:batchGet", json=body)
+    response.raise_for_status()
+    if len(response.json()["results"]) != len(patient_ids):
+        raise RuntimeError("batchGet no devolvió todos los pacientes")
+
+
+async def medir(nombre, estrategia, repeat):
+    await estrategia()  # calentamiento
+    tiempos = []
+    for _ in range(repeat):
+        inicio = time.perf_counter()
+        await estrategia()
+        tiempos.append(time.perf_counter() - inicio)
+    print(f"{nombre:>8} media {statistics.mean(tiempos) * 1000:9.1f} ms  mejor {min(tiempos) * 1000:9.1f} ms")
+    return statistics.mean(tiempos)
+
+
+async def main(args):
+    print(f"Creando {args.patients} pacientes con {args.history} signos vitales...")
+    patient_ids = await seed(args)
+    try:
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=60) as client:
+            t_antes = await medir("antes", lambda: antes(client, patient_ids), args.repeat)
+            t_despues = await medir("después", lambda: despues(client, patient_ids), args.repeat)
+            await medir("campos", lambda: despues(client, patient_ids, ["name", "last_name", "vital_signs"]), args.repeat)
+            print(f"  {t_antes / t_despues:.1f}x más rápido")
+    finally:
+        await cleanup(patient_ids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vista de sala: GET por paciente contra POST /patients:batchGet")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--patients", type=int, default=40)
+    parser.add_argument("--history", type=int, default=200, help="Signos vitales por paciente")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
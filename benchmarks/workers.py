@@ -0,0 +1,85 @@
+"""
+Throughput con 1 vs N workers.
+
+Arranca el servidor con `python -m app.serve --workers N` para cada valor de --workers,
+mide el throughput de una ruta con benchmarks.concurrency y apaga el servidor antes de
+pasar al siguiente. Al final compara contra el primer valor (normalmente 1 worker) y
+verifica que /metrics/summary cuente las peticiones de todos los workers.
+
+Uso:
+    python -m benchmarks.workers --patient-id <ObjectId> --workers 1 4
+    python -m benchmarks.workers --path /patients/patients/<ObjectId> --workers 1 2 4 --concurrency 64
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.concurrency import run_level
+
+
+def wait_ready(base_url: str, timeout: float = 30):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        try:
+            httpx.get(f"{base_url}/metrics", timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"El servidor no respondió en {timeout} s")
+
+
+async def measure(base_url: str, path: str, total: int, concurrency: int) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        await run_level(client, path, min(total, 50), concurrency)  # calentamiento de cada worker
+        resultado = await run_level(client, path, total, concurrency)
+        resumen = (await client.get("/metrics/summary")).json()
+    resultado["contadas"] = sum(r["requests"] for r in resumen["routes"] if r["endpoint"] != "/metrics/summary")
+    return resultado
+
+
+def main(args):
+    path = args.path or f"/patients/{args.patient_id}/medication_logs"
+    base_url = f"http://127.0.0.1:{args.port}"
+    env = dict(os.environ, CREATE_INDEXES_ON_STARTUP="false")
+
+    resultados = []
+    for workers in args.workers:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "app.serve", "--workers", str(workers), "--port", str(args.port), "--host", "127.0.0.1"],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_ready(base_url)
+            resultados.append((workers, asyncio.run(measure(base_url, path, args.requests, args.concurrency))))
+        finally:
+            server.terminate()
+            server.wait()
+
+    base = resultados[0][1]["rps"]
+    print(f"CPUs: {os.cpu_count()}, en vuelo: {args.concurrency}, ruta: {path}")
+    print(f"{'workers':>8} {'req/s':>10} {'p50 (ms)':>10} {'p95 (ms)':>10} {'vs base':>8} {'contadas':>9}")
+    for workers, r in resultados:
+        print(f"{workers:>8} {r['rps']:>10.1f} {r['p50_ms']:>10.1f} {r['p95_ms']:>10.1f} "
+              f"{r['rps'] / base:>7.2f}x {r['contadas']:>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara el throughput del servidor con distinta cantidad de workers")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--patient-id", help="ObjectId de un paciente existente")
+    parser.add_argument("--path", help="Ruta a medir (por defecto /patients/{patient_id}/medication_logs)")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    if not args.path and not args.patient_id:
+        parser.error("se requiere --patient-id o --path")
+
+    main(args)
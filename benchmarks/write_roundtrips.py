@@ -0,0 +1,88 @@
+"""
+Benchmark de escrituras de actividades: antes vs. después.
+
+Compara, contra la base configurada en MONGO_URI, las dos formas de agregar una entrada:
+
+- antes:   find_one del paciente completo para verificar que existe + update_one con $push
+- después: un único update_one con $push, y el 404 se deduce de matched_count
+
+Crea un paciente temporal con `--history` entradas previas (para que el find_one tenga que
+traer un documento realista) en la base `--db` y lo elimina al terminar.
+
+Uso:
+    python -m benchmarks.write_roundtrips --inserts 200 --history 5000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime
+from bson import ObjectId
+from app.db.client import db_client
+
+
+def entrada():
+    return {
+        "id": ObjectId(),
+        "datetime": datetime.utcnow(),
+        "medication_name": "enalapril",
+        "dose": "10mg",
+        "route": "oral",
+        "status": "administrado",
+        "observations": "",
+    }
+
+
+async def antes(collection, patient_id):
+    patient = await collection.find_one({"_id": patient_id})
+    if not patient:
+        raise RuntimeError("Paciente no encontrado")
+    await collection.update_one({"_id": patient_id}, {"$push": {"medication_logs": entrada()}})
+
+
+async def despues(collection, patient_id):
+    result = await collection.update_one({"_id": patient_id}, {"$push": {"medication_logs": entrada()}})
+    if result.matched_count != 1:
+        raise RuntimeError("Paciente no encontrado")
+
+
+async def medir(nombre, estrategia, collection, patient_id, inserts):
+    tiempos = []
+    for _ in range(inserts):
+        inicio = time.perf_counter()
+        await estrategia(collection, patient_id)
+        tiempos.append(time.perf_counter() - inicio)
+
+    tiempos.sort()
+    print(
+        f"{nombre:>8} media {statistics.mean(tiempos) * 1000:8.2f} ms"
+        f"  p50 {statistics.median(tiempos) * 1000:8.2f} ms"
+        f"  p95 {tiempos[int(len(tiempos) * 0.95) - 1] * 1000:8.2f} ms"
+    )
+    return statistics.mean(tiempos)
+
+
+async def main(args):
+    collection = db_client[args.db].patient
+    patient_id = (await collection.insert_one({
+        "name": "benchmark",
+        "medication_logs": [entrada() for _ in range(args.history)],
+    })).inserted_id
+
+    try:
+        await despues(collection, patient_id)  # calentamos el pool de conexiones
+        t_antes = await medir("antes", antes, collection, patient_id, args.inserts)
+        t_despues = await medir("después", despues, collection, patient_id, args.inserts)
+        print(f"Latencia por inserción reducida {(1 - t_despues / t_antes) * 100:.0f}%")
+    finally:
+        await collection.delete_one({"_id": patient_id})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latencia de inserción: find_one + update_one vs. update_one condicional")
+    parser.add_argument("--db", default="conectacare_bench", help="Base de datos donde crear el paciente temporal")
+    parser.add_argument("--inserts", type=int, default=200)
+    parser.add_argument("--history", type=int, default=5000, help="Entradas previas del paciente temporal")
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
@@ -0,0 +1,51 @@
+"""Bloques del archivo en frío y combinación con las entradas calientes."""
+from datetime import datetime
+from bson import ObjectId
+from app.db import archive
+
+
+def comida(dia: int, descripcion: str = "") -> dict:
+    return {"id": ObjectId(), "datetime": datetime(2025, 1, dia), "description": descripcion}
+
+
+def test_merge_entries_ordena_y_gana_la_caliente():
+    viejas = [comida(1), comida(3), comida(5)]
+    editada = dict(viejas[1], description="editada")
+    patient = {"meals": [editada, comida(10)]}
+
+    archive.merge_entries(patient, {"meals": viejas})
+
+    assert [entry["datetime"].day for entry in patient["meals"]] == [1, 3, 5, 10]
+    assert patient["meals"][1]["description"] == "editada"
+
+
+def test_merge_entries_sin_arreglo_caliente():
+    viejas = [comida(2), comida(1)]
+
+    patient = archive.merge_entries({}, {"meals": viejas, "vital_signs": []})
+
+    assert [entry["datetime"].day for entry in patient["meals"]] == [1, 2]
+    assert patient["vital_signs"] == []
+
+
+def test_merge_newest_first_con_limite():
+    calientes = [comida(9), comida(8)]
+    frias = [comida(7), calientes[1], comida(6)]
+
+    merged = archive.merge_newest_first("meals", calientes, frias, limit=3)
+
+    assert [entry["datetime"].day for entry in merged] == [9, 8, 7]
+    assert merged[1] is calientes[1]
+
+
+def test_bloques_en_orden_y_de_ida_y_vuelta(monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_CHUNK_SIZE", 2)
+    entries = [comida(dia) for dia in (4, 1, 3, 2, 5)]
+
+    chunks = archive.build_chunks(ObjectId(), "meals", entries)
+
+    assert [chunk["count"] for chunk in chunks] == [2, 2, 1]
+    assert [(chunk["start"].day, chunk["end"].day) for chunk in chunks] == [(1, 2), (3, 4), (5, 5)]
+    decoded = [entry for chunk in chunks for entry in archive.decode_entries(chunk)]
+    assert decoded == sorted(entries, key=lambda entry: entry["datetime"])
+    assert chunks[0]["ids"] == [entry["id"] for entry in decoded[:2]]
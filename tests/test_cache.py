@@ -0,0 +1,55 @@
+"""Invalidación del caché en memoria frente a lecturas en curso."""
+import asyncio
+from app.cache import MemoryCache
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_escritura_durante_la_lectura_de_un_paciente_sin_cache():
+    cache = MemoryCache()
+    token = run(cache.token("p1"))
+
+    run(cache.invalidate("p1", ["patient"]))
+    run(cache.set("p1", "patient", "viejo", token))
+
+    assert run(cache.get("p1", "patient")) is None
+
+
+def test_escritura_de_otro_paciente_no_descarta_la_lectura():
+    cache = MemoryCache()
+    token = run(cache.token("p1"))
+
+    run(cache.invalidate("p2", ["patient"]))
+    run(cache.set("p1", "patient", "valor", token))
+
+    assert run(cache.get("p1", "patient")) == "valor"
+
+
+def test_generacion_de_un_paciente_en_cache():
+    cache = MemoryCache()
+    run(cache.set("p1", "meals", "v1", run(cache.token("p1"))))
+    token = run(cache.token("p1"))
+
+    run(cache.invalidate("p1", ["patient", "meals"]))
+    assert run(cache.get("p1", "meals")) is None
+    run(cache.set("p1", "meals", "viejo", token))
+    assert run(cache.get("p1", "meals")) is None
+
+    run(cache.set("p1", "meals", "v2", run(cache.token("p1"))))
+    assert run(cache.get("p1", "meals")) == "v2"
+
+
+def test_invalidaciones_descartadas_suben_el_piso():
+    cache = MemoryCache(max_patients=2)
+    token = run(cache.token("p1"))
+
+    # p1 sale de la lista de invalidaciones recordadas, pero su lectura sigue siendo anterior
+    for patient_id in ("p1", "p2", "p3"):
+        run(cache.invalidate(patient_id, ["patient"]))
+    run(cache.set("p1", "patient", "viejo", token))
+    assert run(cache.get("p1", "patient")) is None
+
+    run(cache.set("p1", "patient", "nuevo", run(cache.token("p1"))))
+    assert run(cache.get("p1", "patient")) == "nuevo"
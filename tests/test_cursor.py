@@ -0,0 +1,33 @@
+"""Cursores opacos de la paginación por keyset."""
+from datetime import datetime
+import pytest
+from bson import ObjectId
+from app.db.queries import decode_cursor, encode_cursor
+
+
+def test_ida_y_vuelta():
+    fecha, entry_id = datetime(2025, 6, 1, 10, 0), ObjectId()
+
+    after_date, after_id = decode_cursor(encode_cursor(fecha, entry_id), datetime, ObjectId)
+
+    assert after_date.replace(tzinfo=None) == fecha and after_id == entry_id
+
+
+@pytest.mark.parametrize("cursor", [
+    "no-es-base64!",
+    encode_cursor(1),
+    encode_cursor(datetime(2025, 6, 1), ObjectId(), 3),
+    encode_cursor(ObjectId(), datetime(2025, 6, 1)),
+    encode_cursor(datetime(2025, 6, 1)),
+])
+def test_forma_invalida(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, datetime, ObjectId)
+
+
+def test_cursor_de_un_solo_id():
+    caretaker_id = ObjectId()
+
+    assert decode_cursor(encode_cursor(caretaker_id), ObjectId) == [caretaker_id]
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(datetime(2025, 6, 1), caretaker_id), ObjectId)
@@ -0,0 +1,20 @@
+"""Rutas a las que se aplica Idempotency-Key."""
+import pytest
+from app.idempotency import IDEMPOTENT_PATHS
+
+
+def aplica(path: str) -> bool:
+    return any(pattern.match(path) for pattern in IDEMPOTENT_PATHS)
+
+
+@pytest.mark.parametrize("path", [
+    "/patients/", "/caretakers/", "/patients/activities:batch",
+    "/patients/6650a1b2c3d4e5f6a7b8c9d0/activities:batch", "/patients/6650a1b2c3d4e5f6a7b8c9d0/meals",
+])
+def test_posts_de_creacion(path):
+    assert aplica(path)
+
+
+@pytest.mark.parametrize("path", ["/patients:batchGet", "/patients/summary:batchGet", "/patients/6650a1b2c3d4e5f6a7b8c9d0/timeline"])
+def test_posts_de_consulta(path):
+    assert not aplica(path)
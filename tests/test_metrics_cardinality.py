@@ -0,0 +1,32 @@
+"""Las métricas HTTP se etiquetan con la plantilla de la ruta: muchos patient_id no crean series nuevas."""
+import asyncio
+import os
+import httpx
+from benchmarks.metrics_cardinality import contar_series
+from app.main import app
+
+# 2000 ids mantienen la suite rápida; la verificación del pedido (100 000 ids distintos) se corre con
+# METRICS_CARDINALITY_IDS=100000 o con `python -m benchmarks.metrics_cardinality --requests 100000`
+PACIENTES = int(os.getenv("METRICS_CARDINALITY_IDS", "2000"))
+
+
+async def recorrer(client, cantidad: int, desde: int = 0):
+    # Los ids no son ObjectId válidos: cada petición responde 400 (o 404 sin ruta) sin consultar MongoDB
+    for i in range(desde, desde + cantidad):
+        assert (await client.get(f"/patients/paciente-{i}/meals")).status_code == 400
+        assert (await client.get(f"/patients/paciente-{i}/timeline")).status_code == 400
+        assert (await client.get(f"/patients/patients/paciente-{i}")).status_code == 400
+        assert (await client.get(f"/ruta/inexistente-{i}")).status_code == 404
+
+
+def test_series_no_crecen_con_los_patient_id():
+    async def main():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await recorrer(client, 1)  # crea las series de cada ruta
+            antes = contar_series()
+            await recorrer(client, PACIENTES, desde=1)
+            return antes, contar_series()
+
+    antes, despues = asyncio.run(main())
+    assert despues == antes
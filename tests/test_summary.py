@@ -0,0 +1,33 @@
+"""Operadores del resumen de último estado para las entradas nuevas."""
+from datetime import datetime, timezone
+from bson import ObjectId
+from app.db import summary
+
+
+def test_push_update_mezcla_fechas_con_y_sin_zona():
+    # 10:00Z y 09:00 sin zona (UTC, como las devuelve MongoDB) en la misma tanda
+    con_zona = {"id": ObjectId(), "datetime": datetime(2025, 6, 1, 10, 0, tzinfo=timezone.utc), "value": 1}
+    sin_zona = {"id": ObjectId(), "datetime": datetime(2025, 6, 1, 9, 0), "value": 2}
+
+    update = summary.push_update({"vital_signs": [sin_zona, con_zona]})
+
+    assert update["$max"]["summary.last_vital_sign"]["entry"] is con_zona
+
+
+def test_push_update_desempata_por_id():
+    fecha = datetime(2025, 6, 1, 10, 0)
+    primera, segunda = ({"id": ObjectId(), "datetime": fecha} for _ in range(2))
+
+    update = summary.push_update({"meals": [segunda, primera]})
+
+    assert update["$max"]["summary.last_meal"]["id"] == segunda["id"]
+
+
+def test_push_update_sintomas_y_arreglos_vacios():
+    sintomas = [{"id": ObjectId(), "datetime": datetime(2025, 6, 1)}]
+
+    update = summary.push_update({"symptoms": sintomas, "meals": [], "hygiene_logs": sintomas})
+
+    assert update == {"$push": {"summary.recent_symptoms": {
+        "$each": sintomas, "$sort": {"datetime": -1, "id": -1}, "$slice": summary.RECENT_SYMPTOMS,
+    }}}